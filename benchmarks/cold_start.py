@@ -0,0 +1,72 @@
+""" Time cold starts of `bulker activate -e` and `bulker run`.
+
+Loads a throwaway crate into a temporary config, then times each command
+repeatedly, with the fast path and with it disabled (BULKER_NO_FASTPATH=1).
+
+    python benchmarks/cold_start.py [-n REPEATS]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+MANIFEST = """manifest:
+  name: bench
+  commands:
+  - command: cowsay
+    docker_image: nsheff/cowsay
+"""
+
+
+def bulker(*args, env=None):
+    """ Run the bulker console entry point in a fresh interpreter """
+    cmd = [sys.executable, "-c", "import sys; from bulker.runtime import main; "
+           "sys.argv[0] = 'bulker'; main()"] + list(args)
+    return subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL,
+                          stderr=subprocess.DEVNULL)
+
+
+def time_command(args, env, repeats):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = bulker(*args, env=env)
+        times.append(time.perf_counter() - start)
+        if result.returncode != 0:
+            raise RuntimeError("Failed: bulker {}".format(" ".join(args)))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cfg = os.path.join(tmp, "bulker_config.yaml")
+        manifest = os.path.join(tmp, "bench.yaml")
+        with open(manifest, "w") as f:
+            f.write(MANIFEST)
+        bulker("init", "-c", cfg, "-e", "docker")
+        bulker("load", "-c", cfg, "-m", manifest, "bulker/bench")
+
+        commands = {
+            "activate -e": ["activate", "-e", "-c", cfg, "bulker/bench"],
+            "run true": ["run", "-c", cfg, "bulker/bench", "true"],
+        }
+        print("{:<14}{:>12}{:>12}".format("command", "full (ms)", "fast (ms)"))
+        for label, cmd in commands.items():
+            slow_env = dict(os.environ, BULKER_NO_FASTPATH="1")
+            slow = time_command(cmd, slow_env, args.repeats)
+            fast = time_command(cmd, dict(os.environ), args.repeats)
+            print("{:<14}{:>12.1f}{:>12.1f}".format(
+                label, statistics.median(slow) * 1000,
+                statistics.median(fast) * 1000))
+
+
+if __name__ == "__main__":
+    main()
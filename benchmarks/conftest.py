@@ -0,0 +1,166 @@
+""" Fixtures for the benchmark suite: timing, synthetic crates, and a local registry.
+
+    pytest benchmarks [--bench-rounds N] [--bench-save FILE]
+                      [--bench-compare FILE [--bench-tolerance 0.25]]
+"""
+
+import json
+import logging
+import os
+import statistics
+import threading
+import time
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+import pytest
+import yacman
+
+from bulker.bulker import DEFAULT_CONFIG_FILEPATH, bulker_init, bulker_load_batch
+
+_RESULTS = {}
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("bulker benchmarks")
+    group.addoption("--bench-rounds", type=int, default=5,
+                    help="Timed rounds per benchmark (default: 5)")
+    group.addoption("--bench-save", metavar="FILE",
+                    help="Write the median time of each benchmark to a JSON file")
+    group.addoption("--bench-compare", metavar="FILE",
+                    help="Fail benchmarks slower than the medians in this JSON file")
+    group.addoption("--bench-tolerance", type=float, default=0.25,
+                    help="Allowed slowdown against --bench-compare (default: 0.25)")
+
+
+def pytest_configure(config):
+    # Progress messages from bulker_load would swamp the timings
+    logging.getLogger("bulker").setLevel(logging.WARNING)
+
+
+@pytest.fixture
+def bench(request):
+    """
+    Time a callable over several rounds, recording the results under the
+    benchmark's test id; with --bench-compare, fail if the median regressed.
+
+    Usage: bench(func, *args, rounds=None, **kwargs)
+    """
+    config = request.config
+    baseline = {}
+    if config.getoption("bench_compare"):
+        with open(config.getoption("bench_compare")) as f:
+            baseline = json.load(f)
+
+    def run(func, *args, rounds=None, **kwargs):
+        times = []
+        for _ in range(rounds or config.getoption("bench_rounds")):
+            start = time.perf_counter()
+            func(*args, **kwargs)
+            times.append(time.perf_counter() - start)
+        name = request.node.name
+        _RESULTS[name] = times
+        median = statistics.median(times)
+        tolerance = config.getoption("bench_tolerance")
+        if name in baseline and median > baseline[name] * (1 + tolerance):
+            pytest.fail("{}: median {:.1f} ms is more than {:.0%} slower than the "
+                        "baseline {:.1f} ms".format(name, median * 1000, tolerance,
+                                                    baseline[name] * 1000))
+        return times
+
+    return run
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    if not _RESULTS:
+        return
+    width = max(len(name) for name in _RESULTS)
+    terminalreporter.section("bulker benchmarks")
+    terminalreporter.write_line("{:<{w}}{:>12}{:>12}{:>12}".format(
+        "benchmark", "min (ms)", "median (ms)", "max (ms)", w=width + 2))
+    for name, times in _RESULTS.items():
+        terminalreporter.write_line("{:<{w}}{:>12.1f}{:>12.1f}{:>12.1f}".format(
+            name, min(times) * 1000, statistics.median(times) * 1000,
+            max(times) * 1000, w=width + 2))
+    if config.getoption("bench_save"):
+        with open(config.getoption("bench_save"), "w") as f:
+            json.dump({name: statistics.median(times) for name, times in _RESULTS.items()},
+                      f, indent=2, sort_keys=True)
+
+
+def write_manifest(folder, name, n_commands, imports=(), images=10):
+    """ Write a synthetic manifest whose commands share a handful of images """
+    manifest = {"manifest": {
+        "name": name,
+        "imports": list(imports),
+        "commands": [{"command": "{}-cmd{}".format(name, i),
+                      "docker_image": "bench/{}-img{}:1.0".format(name, i % images)}
+                     for i in range(n_commands)]}}
+    yacman.YAMLConfigManager.from_obj(manifest).write_copy(
+        os.path.join(str(folder), "bulker", name + ".yaml"))
+
+
+@pytest.fixture(scope="session")
+def registry(tmp_path_factory):
+    """
+    A local HTTP stand-in for hub.bulker.io, serving synthetic manifests:
+    size10/size100/size1000 (that many commands), chain1..chain5 (each
+    importing the one before it, 20 commands each), and crate0..crate499
+    (10 commands each).
+    """
+    served = tmp_path_factory.mktemp("registry")
+    os.makedirs(os.path.join(str(served), "bulker"))
+    for size in (10, 100, 1000):
+        write_manifest(served, "size{}".format(size), size)
+    for depth in range(1, 6):
+        imports = ["bulker/chain{}".format(depth - 1)] if depth > 1 else []
+        write_manifest(served, "chain{}".format(depth), 20, imports=imports)
+    for i in range(500):
+        write_manifest(served, "crate{}".format(i), 10)
+
+    class Handler(SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    class Server(ThreadingHTTPServer):
+        # The default backlog of 5 drops concurrent fetches, adding 1s retries
+        request_queue_size = 128
+
+    server = Server(("127.0.0.1", 0), partial(Handler, directory=str(served)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}/".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+
+
+def make_config(folder, registry_url):
+    """ Initialize a docker bulker config in folder that uses the given registry """
+    cfg_path = os.path.join(str(folder), "bulker_config.yaml")
+    bulker_init(cfg_path, DEFAULT_CONFIG_FILEPATH, "docker")
+    bcfg = yacman.YAMLConfigManager.from_yaml_file(cfg_path)
+    bcfg["bulker"]["default_crate_folder"] = os.path.join(str(folder), "crates")
+    bcfg["bulker"]["registry_url"] = registry_url
+    return bcfg
+
+
+@pytest.fixture
+def config(tmp_path, registry):
+    """ An empty bulker config pointed at the local registry """
+    return make_config(tmp_path, registry)
+
+
+@pytest.fixture(scope="session")
+def loaded_config(tmp_path_factory, registry):
+    """ Returns configs holding the first n synthetic crates, built once per n """
+    configs = {}
+
+    def get(n):
+        if n not in configs:
+            bcfg = make_config(tmp_path_factory.mktemp("loaded{}".format(n)), registry)
+            bulker_load_batch(bcfg, ["bulker/crate{}".format(i) for i in range(n)],
+                              force=True)
+            configs[n] = bcfg
+        return configs[n]
+
+    return get
@@ -0,0 +1,91 @@
+""" Benchmarks of bulker's hot paths at realistic scale.
+
+Every manifest is served from the local HTTP registry in conftest.py, so the
+timings include fetching and revalidating manifests, as they would for users.
+"""
+
+import itertools
+import os
+
+import pytest
+
+from bulker.bulker import bulker_load, bulker_reload, get_new_PATH, \
+                          load_remote_registry_path, load_templates, parse_registry_paths
+
+import cold_start
+
+
+def load_closure(bcfg, registry_path, tmp_path):
+    """ Returns a function that loads registry_path into a fresh folder each call """
+    exe_template, shell_template, _ = load_templates(bcfg)
+    counter = itertools.count()
+
+    def load():
+        manifest, cratevars = load_remote_registry_path(bcfg, registry_path)
+        bulker_load(manifest, cratevars, bcfg, exe_template, shell_template,
+                    crate_path=str(tmp_path / "round{}".format(next(counter))),
+                    force=True, recurse=True, write_config=False)
+    return load
+
+
+@pytest.mark.parametrize("commands", [10, 100, 1000])
+def test_load(bench, config, tmp_path, commands):
+    load = load_closure(config, "bulker/size{}".format(commands), tmp_path)
+    bench(load)
+    assert len(os.listdir(str(tmp_path / "round0"))) >= commands
+
+
+@pytest.mark.parametrize("depth", [1, 2, 3, 4, 5])
+def test_load_import_chain(bench, config, tmp_path, depth):
+    # recurse=True reloads every crate in the chain on each round
+    load = load_closure(config, "bulker/chain{}".format(depth), tmp_path)
+    bench(load)
+    assert len(config["bulker"]["crates"]["bulker"]) == depth
+
+
+@pytest.mark.parametrize("crates", [10, 100, 500])
+def test_reload(bench, loaded_config, crates):
+    bcfg = loaded_config(crates)
+    results = bench(bulker_reload, bcfg, write_config=False, rounds=3)
+    assert len(results) == 3
+
+
+@pytest.mark.parametrize("crates", [10, 100, 500])
+def test_get_new_PATH(bench, loaded_config, crates):
+    bcfg = loaded_config(crates)
+    # Activating a handful of crates out of a large config is the common case
+    cratelist = parse_registry_paths(
+        ",".join("bulker/crate{}".format(i) for i in range(0, crates, max(1, crates // 5))),
+        bcfg["bulker"]["default_namespace"])
+
+    def lookup():
+        for _ in range(100):
+            get_new_PATH(bcfg, cratelist)
+    bench(lookup)
+
+
+def time_cli(bench, bcfg, args, fastpath):
+    env = dict(os.environ)
+    if not fastpath:
+        env["BULKER_NO_FASTPATH"] = "1"
+
+    def run():
+        if cold_start.bulker(*args, env=env).returncode != 0:
+            raise RuntimeError("Failed: bulker {}".format(" ".join(args)))
+    bench(run)
+
+
+@pytest.mark.parametrize("fastpath", [True, False], ids=["fast", "full"])
+@pytest.mark.parametrize("crates", [10, 500])
+def test_activate_echo_cold_start(bench, loaded_config, crates, fastpath):
+    bcfg = loaded_config(crates)
+    time_cli(bench, bcfg, ["activate", "-e", "-c", bcfg.filepath, "bulker/crate0"],
+             fastpath)
+
+
+@pytest.mark.parametrize("fastpath", [True, False], ids=["fast", "full"])
+@pytest.mark.parametrize("crates", [10, 500])
+def test_run_cold_start(bench, loaded_config, crates, fastpath):
+    bcfg = loaded_config(crates)
+    time_cli(bench, bcfg, ["run", "-c", bcfg.filepath, "bulker/crate0", "true"],
+             fastpath)
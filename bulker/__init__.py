@@ -1,9 +1,6 @@
 # Project configuration, particularly for logging.
 
-import logmuse
 from ._version import __version__
 
 __classes__ = []
 __all__ = __classes__ + []
-
-logmuse.init_logger("bulker")
@@ -2,19 +2,32 @@
 
 
 import argparse
+import atexit
 import copy
-import jinja2
 import logging
 import logmuse
 import os
-import psutil
 import sys
 import yacman
 from yacman import write_lock
-import signal
 import shutil
-
+import threading
+import subprocess
+import hashlib
+import io
+import json
+import math
+import re
+import sqlite3
+import time
+
+from collections import ChainMap
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from fnmatch import fnmatchcase
+from functools import partial
 from shutil import which, copytree
+from types import MappingProxyType
 
 
 from ubiquerg import is_url, is_command_callable, parse_registry_path as prp, \
@@ -22,6 +35,8 @@ from ubiquerg import is_url, is_command_callable, parse_registry_path as prp, \
 
 
 from . import __version__
+from . import runtime
+from .runtime import mkabs
 
 TEMPLATE_SUBDIR = "templates"
 DEFAULT_CONFIG_FILEPATH =  os.path.join(
@@ -41,18 +56,67 @@ SINGULARITY_EXE_TEMPLATE = "singularity_executable.jinja2"
 SINGULARITY_SHELL_TEMPLATE = "singularity_shell.jinja2"
 SINGULARITY_BUILD_TEMPLATE = "singularity_build.jinja2"
 
+CRATE_INDEX_FILENAME = ".bulker_crate.json"
+LOCKFILE_VERSION = 1
+BUNDLE_VERSION = 1
+BUNDLE_META_FILENAME = "bulker_bundle.json"
+DEFAULT_IMPORT_MODE = "link"
+
+IMAGE_STORE_SUBDIR = ".store"
+IMAGE_USERS_FILENAME = "configs"  # configs that use an image folder, in its store
+TRASH_SUBDIR = ".trash"  # unloaded crates awaiting 'bulker gc', in default_crate_folder
+REGISTRY_MANIFEST_TYPES = [
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.manifest.v1+json"]
+
+# Package settings that shape the container a warm-mode command runs in
+WARM_CONTAINER_KEYS = ["docker_image", "dockerargs", "docker_args", "no_user",
+                       "no_network", "envvars", "volumes"]
+# Docker run flags that `docker exec` needs too, to keep stdin and the terminal
+WARM_EXEC_FLAGS = ["-i", "-t", "-it", "-ti", "--interactive", "--tty"]
+
 RCFILE_TEMPLATE = "start.sh"
 RCFILE_STRICT_TEMPLATE = "start_strict.sh"
 
 DEFAULT_BASE_URL = "http://hub.bulker.io"
 
+DEFAULT_BUILD_JOBS = 4
+DEFAULT_LOAD_JOBS = 8
+
+MANIFEST_CACHE_SUBDIR = "manifest_cache"
+TEMPLATE_CACHE_SUBDIR = "template_cache"
+DEFAULT_MANIFEST_CACHE_TTL = 0  # seconds; 0 revalidates on every use
+DEFAULT_CACHE_PRUNE_DAYS = 30
+
+TELEMETRY_LOG_FILENAME = "telemetry.log"
+DEFAULT_TELEMETRY_MAX_KB = 10240  # the log is rotated to <log>.1 past this size
+
 LOCAL_EXE_TEMPLATE = """
 #!/bin/sh\n\n{cmd} "$@"
 """
 
 _LOGGER = logging.getLogger(__name__)
+logmuse.init_logger("bulker")
+
+
+# Guards the crate registry in the config while crates load concurrently
+_REGISTRY_LOCK = threading.RLock()
+
+# Timing spans recorded with --profile (see span); None when not profiling
+_SPANS = None
+_SPANS_LOCK = threading.Lock()
 
-PROC = -1
+# Crate stores read so far, by config path (see read_crate_store)
+_CRATE_STORES = {}
+
+# Open sqlite crate registries, by database path (see crate_registry)
+_CRATE_REGISTRIES = {}
+
+# Shared jinja2 environments, by (template folder, bytecode cache folder)
+_TEMPLATE_ENVIRONMENTS = {}
+_TEMPLATE_LOCK = threading.Lock()
 
 # TODO: move to exceptions file
 
@@ -78,6 +142,16 @@ class MissingCrateError(BulkerError):
     pass
 
 
+class ImportCycleError(BulkerError):
+    """ Error type for manifests that (indirectly) import themselves. """
+    pass
+
+
+class LockfileError(BulkerError):
+    """ Error type for lockfiles that can't be written or restored. """
+    pass
+
+
 
 class _VersionInHelpParser(argparse.ArgumentParser):
     def format_help(self):
@@ -102,10 +176,20 @@ def build_argparser():
         "list": "List loaded bulker crates",
         "load": "Load a crate from a manifest",
         "unload": "Remove a loaded crate from disk and config",
+        "gc": "Free the disk space of unloaded crates",
         "reload": "Re-fetch and rebuild all loaded crates from their manifests",
         "activate": "Start a new shell with crate commands in PATH",
         "run": "Run a single command in a crate environment without starting a shell",
         "envvars": "List, add, or remove environment variables in bulker config",
+        "cache": "List, prune, or clear the local cache of remote manifests",
+        "images": "Pull, prefetch, list, or garbage-collect container images",
+        "which": "Show which loaded crates provide a command",
+        "search": "Search the commands of loaded crates",
+        "stats": "Summarize crate command calls recorded by telemetry",
+        "registry": "Import or export the registry of loaded crates as YAML",
+        "bundle": "Pack loaded crates into an archive to install elsewhere",
+        "freeze": "Write a lockfile describing the loaded crates",
+        "restore": "Load the crates recorded in a lockfile",
         "cwl2man": "Build a manifest from cwl tool descriptions"
     }
 
@@ -114,16 +198,25 @@ def build_argparser():
                 "  bulker init -c ~/bulker_config.yaml -e singularity",
         "inspect": "  bulker inspect                         # inspect the currently active crate\n"
                    "  bulker inspect bulker/demo\n"
-                   "  bulker inspect databio/pepatac:1.0.13",
+                   "  bulker inspect databio/pepatac:1.0.13\n"
+                   "  bulker inspect --args bulker/demo       # show host/tool args per command",
         "list": "  bulker list\n"
                 "  bulker list -s                         # simple format for scripting",
         "load": "  bulker load bulker/demo\n"
                 "  bulker load databio/pepatac:1.0.13\n"
                 "  bulker load -f bulker/demo             # overwrite existing\n"
                 "  bulker load -b bulker/demo             # also pull container images\n"
-                "  bulker load -m manifest.yaml my/crate  # load from local manifest file",
+                "  bulker load -b -j 8 databio/pepatac    # pull up to 8 images at once\n"
+                "  bulker load -m manifest.yaml my/crate  # load from local manifest file\n"
+                "  bulker load bulker/demo,bulker/pi      # load several crates at once\n"
+                "  bulker load --from-file crates.txt     # load the crates listed in a file\n"
+                "  bulker load --bundle demo.tar          # install a bundle made by 'bulker bundle'",
         "unload": "  bulker unload bulker/demo\n"
-                  "  bulker unload databio/pepatac:1.0.13",
+                  "  bulker unload databio/pepatac:1.0.13\n"
+                  "  bulker unload 'databio/*' --older-than 90  # not loaded in 90 days\n"
+                  "  bulker unload --gc bulker/demo,bulker/pi   # free disk space in the background",
+        "gc": "  bulker gc --dry-run\n"
+              "  bulker gc",
         "reload": "  bulker reload                          # reload all crates",
         "activate": "  bulker activate bulker/demo\n"
                     "  bulker activate databio/pepatac:1.0.13\n"
@@ -137,6 +230,26 @@ def build_argparser():
         "envvars": "  bulker envvars                         # list current variables\n"
                    "  bulker envvars -a MY_VAR              # add a variable\n"
                    "  bulker envvars -r MY_VAR              # remove a variable",
+        "cache": "  bulker cache list\n"
+                 "  bulker cache prune --older-than 7      # drop entries unused for a week\n"
+                 "  bulker cache clear",
+        "images": "  bulker images prefetch bulker/demo -j 8\n"
+                  "  bulker images pull nsheff/cowsay --path ~/simages/nsheff/cowsay\n"
+                  "  bulker images list\n"
+                  "  bulker images gc --dry-run",
+        "which": "  bulker which samtools",
+        "search": "  bulker search sam                      # commands or images containing 'sam'\n"
+                  "  bulker search 'bowtie*'",
+        "stats": "  bulker stats\n"
+                 "  bulker stats --clear",
+        "registry": "  bulker registry export -o crates.yaml\n"
+                    "  bulker registry import crates.yaml",
+        "bundle": "  bulker bundle bulker/demo -o demo.tar\n"
+                  "  bulker bundle --images bulker/demo,bulker/pi -o tools.tar  # with singularity images",
+        "freeze": "  bulker freeze -o bulker.lock\n"
+                  "  bulker freeze --no-digests > bulker.lock   # don't query registries",
+        "restore": "  bulker restore bulker.lock\n"
+                   "  bulker restore --prefetch -j 8 bulker.lock  # also fetch the images",
     }
 
     parser = _VersionInHelpParser(
@@ -153,6 +266,14 @@ def build_argparser():
             action="version",
             version="{}".format(" ".join(subparser_messages.keys())))
 
+    parser.add_argument(
+            "--profile", action='store_true', default=False,
+            help="Print a breakdown of where time was spent, by phase, to stderr")
+
+    parser.add_argument(
+            "--profile-json", metavar="FILE", default=None,
+            help="Append a JSON line per timed phase to FILE ('-' for stdout)")
+
     subparsers = parser.add_subparsers(dest="command") 
 
     def add_subparser(cmd, description):
@@ -169,7 +290,9 @@ def build_argparser():
         sps[cmd] = add_subparser(cmd, desc)
 
     # Add config option to relevant subparsers
-    for cmd in ["init", "list", "load", "unload", "reload", "activate", "run", "inspect", "envvars"]:
+    for cmd in ["init", "list", "load", "unload", "gc", "reload", "activate", "run", "inspect", "envvars",
+                "cache", "images", "which", "search", "stats", "registry", "bundle",
+                "freeze", "restore"]:
         sps[cmd].add_argument(
             "-c", "--config", required=(cmd == "init"),
             help="Bulker configuration file.")
@@ -178,11 +301,38 @@ def build_argparser():
             "-e", "--engine", choices={"docker", "singularity", }, default=None,
             help="Choose container engine. Default: 'guess'")
 
-    for cmd in ["run", "activate", "load", "unload"]:
+    for cmd in ["run", "activate"]:
         sps[cmd].add_argument(
             "crate_registry_paths", metavar="crate-registry-paths", type=str,
             help="Crate to use, e.g. bulker/demo or namespace/crate:tag")
 
+    sps["unload"].add_argument(
+            "crate_registry_paths", metavar="crate-registry-paths", type=str,
+            help="Crates to unload, e.g. bulker/demo or namespace/crate:tag, "
+            "or patterns such as 'databio/*'")
+
+    sps["unload"].add_argument(
+            "--older-than", type=float, default=None, metavar="DAYS",
+            help="Only unload the crates last loaded more than this many days ago")
+
+    sps["unload"].add_argument(
+            "--gc", action='store_true', default=False,
+            help="Free the unloaded crates' disk space in the background, "
+            "instead of at the next 'bulker gc'")
+
+    sps["load"].add_argument(
+            "crate_registry_paths", metavar="crate-registry-paths", type=str,
+            nargs="?", default=None,
+            help="Crate(s) to load, e.g. bulker/demo or bulker/demo,bulker/pi")
+
+    sps["load"].add_argument(
+            "--from-file", default=None,
+            help="File listing crates to load, one per line.")
+
+    sps["load"].add_argument(
+            "--bundle", default=None,
+            help="Install the crates in a bundle made by 'bulker bundle'.")
+
     # optional for inspect and cwl2man
     for cmd in ["inspect"]:
         sps[cmd].add_argument(
@@ -190,6 +340,16 @@ def build_argparser():
             nargs="?", default=os.getenv("BULKERCRATE", ""),
             help="Crate to inspect (defaults to active crate from BULKERCRATE)")
 
+    sps["inspect"].add_argument(
+            "--args", action='store_true', default=False,
+            help="Show the host/tool args (from 'tool_args') each command gets")
+
+    for cmd in ["run", "activate"]:
+        sps[cmd].add_argument(
+            "--warm", action='store_true', default=False,
+            help="Reuse one long-lived container per image, started on first "
+            "use and stopped when idle or when bulker exits (docker only)")
+
     for cmd in ["run", "activate"]:
         sps[cmd].add_argument(
             "-s", "--strict", action='store_true', default=False,
@@ -216,6 +376,16 @@ def build_argparser():
             help="Build/pull the actual containers, in addition to the"
             "executables. Default: False")
     
+    sps["load"].add_argument(
+            "-j", "--jobs", type=int, default=None,
+            help="Number of images to build/pull in parallel with -b. "
+            "Default: 'build_jobs' from config, or {}".format(DEFAULT_BUILD_JOBS))
+
+    sps["reload"].add_argument(
+            "-j", "--jobs", type=int, default=DEFAULT_LOAD_JOBS,
+            help="Number of crates to fetch and rebuild in parallel. "
+            "Default: {}".format(DEFAULT_LOAD_JOBS))
+
     sps["load"].add_argument(
             "-f", "--force", action='store_true', default=False,
             help="Force overwrite? Default: False")
@@ -224,6 +394,114 @@ def build_argparser():
             "-r", "--recurse", action='store_true', default=False,
             help="Recursively re-load imported manifests? Default: False")    
 
+    for cmd in ["load", "reload", "inspect"]:
+        sps[cmd].add_argument(
+            "--offline", action='store_true', default=False,
+            help="Use only cached manifests; don't contact the registry.")
+
+    sps["images"].add_argument(
+            "action", choices=["pull", "prefetch", "list", "gc"],
+            help="'pull' a single image, 'prefetch' the images of crates, "
+            "'list' singularity images, or 'gc' the ones no crate uses")
+
+    sps["images"].add_argument(
+            "target", metavar="image-or-crates", nargs="?", default=None,
+            help="With 'pull', a docker image; with 'prefetch', crate registry "
+            "paths, e.g. bulker/demo,bulker/pi")
+
+    sps["images"].add_argument(
+            "--dry-run", action='store_true', default=False,
+            help="With 'gc', only report what would be removed")
+
+    sps["images"].add_argument(
+            "--path", default=None,
+            help="With 'pull', where to put the singularity image. Default: "
+            "under the configured singularity_image_folder")
+
+    sps["images"].add_argument(
+            "-j", "--jobs", type=int, default=DEFAULT_BUILD_JOBS,
+            help="With 'prefetch', number of images to fetch at the same time. "
+            "Default: {}".format(DEFAULT_BUILD_JOBS))
+
+    sps["which"].add_argument(
+            "cmd", metavar="command", help="Command to look up")
+
+    sps["search"].add_argument(
+            "pattern", help="Text to find in command or image names, "
+            "or a pattern such as 'bowtie*'")
+
+    sps["gc"].add_argument(
+            "--dry-run", action='store_true', default=False,
+            help="Only report what would be removed")
+
+    sps["stats"].add_argument(
+            "--clear", action='store_true', default=False,
+            help="Delete the recorded calls")
+
+    sps["registry"].add_argument(
+            "action", choices=["import", "export"],
+            help="'import' crates from a YAML file, or 'export' them to one")
+
+    sps["registry"].add_argument(
+            "file", nargs="?", default=None,
+            help="With 'import', a file written by 'export' or a bulker config")
+
+    sps["registry"].add_argument(
+            "-o", "--output", default=None,
+            help="With 'export', file to write. Default: print to stdout")
+
+    sps["bundle"].add_argument(
+            "crate_registry_paths", metavar="crate-registry-paths", type=str,
+            help="Crate(s) to bundle, e.g. bulker/demo or bulker/demo,bulker/pi")
+
+    sps["bundle"].add_argument(
+            "-o", "--output", default=None,
+            help="Archive to write; compressed if it ends in .gz. "
+            "Default: <namespace>_<crate>_<tag>.tar")
+
+    sps["bundle"].add_argument(
+            "--images", action='store_true', default=False,
+            help="Also include the crates' singularity images")
+
+    sps["freeze"].add_argument(
+            "-o", "--output", default=None,
+            help="Lockfile to write. Default: print to stdout")
+
+    sps["freeze"].add_argument(
+            "--no-digests", action='store_false', dest="digests", default=True,
+            help="Don't ask image registries for image digests")
+
+    sps["restore"].add_argument(
+            "lockfile", help="Lockfile written by 'bulker freeze'")
+
+    sps["restore"].add_argument(
+            "-b", "--build", action='store_true', default=False,
+            help="Build/pull the images along with each crate")
+
+    sps["restore"].add_argument(
+            "--prefetch", action='store_true', default=False,
+            help="Fetch the images of all restored crates afterwards, in parallel")
+
+    sps["restore"].add_argument(
+            "-j", "--jobs", type=int, default=DEFAULT_BUILD_JOBS,
+            help="Number of images to build or prefetch in parallel. "
+            "Default: {}".format(DEFAULT_BUILD_JOBS))
+
+    sps["cache"].add_argument(
+            "action", choices=["list", "prune", "clear"],
+            help="Action to perform on the manifest cache")
+
+    sps["cache"].add_argument(
+            "--older-than", type=float, default=DEFAULT_CACHE_PRUNE_DAYS,
+            help="With 'prune', remove manifests not fetched in this many days. "
+            "Default: {}".format(DEFAULT_CACHE_PRUNE_DAYS))
+
+    sps["run"].add_argument(
+            "--supervise", action='store_true', default=False,
+            help="Run the command in a shell under a supervising bulker "
+            "process that cleans up its process group on interrupt, "
+            "instead of replacing bulker with the command")
+
     sps["run"].add_argument(
             "cmd", metavar="command", nargs=argparse.REMAINDER, 
             help="Command to run")
@@ -297,6 +575,12 @@ def _is_writable(folder, check_exist=False, create=False):
     return is_writable(folder, check_exist, create)
 
 
+def _is_default_config(cfg_path):
+    # The built-in config ships with the package; nothing is cached beside it
+    return not cfg_path or \
+        os.path.abspath(cfg_path) == os.path.abspath(DEFAULT_CONFIG_FILEPATH)
+
+
 def bulker_envvars_add(bulker_config, variable):
     """
     Add an environment variable to your bulker config.
@@ -315,7 +599,7 @@ def bulker_envvars_add(bulker_config, variable):
         else:
             _LOGGER.info("Adding variable '{}'".format(variable))
             bcfg["bulker"]["envvars"].append(variable)
-        bcfg.write()
+        write_bulker_config(bcfg)
 
 def bulker_envvars_remove(bulker_config, variable):
     """
@@ -335,7 +619,7 @@ def bulker_envvars_remove(bulker_config, variable):
             bcfg["bulker"]["envvars"].remove(variable)
         else:
             _LOGGER.info("Variable not found '{}'".format(variable))
-        bcfg.write()
+        write_bulker_config(bcfg)
 
 
 def bulker_init(config_path, template_config_path, container_engine=None):
@@ -399,7 +683,7 @@ def mkdir(path, exist_ok=True):
         else:
             raise IOError("Path exists: {}".format(path))
     else:
-        os.makedirs(path)
+        os.makedirs(path, exist_ok=True)
 
 def bulker_inspect(bcfg, manifest, cratevars, crate_path=None, 
                 build=False, force=False):
@@ -407,593 +691,2916 @@ def bulker_inspect(bcfg, manifest, cratevars, crate_path=None,
 
     return x
 
-def get_imports(manifest, bcfg, recurse=False):
-
-    imports = set()
-    if not manifest:
-        return imports
-    if "imports" in manifest["manifest"] and manifest["manifest"]["imports"]:
-        for imp in manifest["manifest"]["imports"]:
-            imp_manifest, imp_cratevars = load_remote_registry_path(bcfg, 
-                                                    imp, None)
-            imports.add(imp)
-            if recurse:
-                imports = imports.union(get_imports(imp_manifest, bcfg, recurse=recurse))
-    return imports
-
-
-def bulker_reload(bcfg):
+def crate_key(cratevars):
     """
-    Reloads all previously loaded crates in the bulker config.
+    :param dict cratevars: dict with crate metadata returned from parse_registry_path
+    :return str: canonical registry path of the crate, namespace/crate:tag
     """
+    return "{namespace}/{crate}:{tag}".format(
+        namespace=cratevars['namespace'],
+        crate=cratevars['crate'],
+        tag=cratevars['tag'])
 
-    fmt = "{namespace}/{crate}:{tag}"
-    all_manifests_to_load = set()
 
-    _LOGGER.info("Recursively identifying all loaded manifests...")
-    if bcfg["bulker"]["crates"]:
-            for namespace, crates in bcfg["bulker"]["crates"].items():
-                for crate, tags in crates.items():
-                    for tag, path in tags.items():
-                        crate_registry_path = fmt.format(namespace=namespace, crate=crate, 
-                                                        tag=tag, path=path)
-                        all_manifests_to_load.add(crate_registry_path)
-                        try:
-                            manifest, cratevars = load_remote_registry_path(bcfg, 
-                                                crate_registry_path,
-                                                None)
-                        except Exception as e:
-                            pass                
-                        all_manifests_to_load = all_manifests_to_load.union(get_imports(manifest, bcfg, recurse=True))
+@contextmanager
+def span(phase, **attrs):
+    """
+    Time a phase of work, such as rendering a command, when profiling.
 
-    print("Loading identified manifests...")
-    for crate_registry_path in all_manifests_to_load:
-        manifest, cratevars, exe_template_jinja, shell_template_jinja, build_template_jinja = prep_load(
-                                                                        bcfg, crate_registry_path, None, False)
-        _LOGGER.info("Loading manifest: {}".format(crate_registry_path))
-        if manifest:
-            bulker_load(manifest, cratevars, bcfg, 
-                    exe_jinja2_template=exe_template_jinja, 
-                    shell_jinja2_template=shell_template_jinja, 
-                    crate_path=None,
-                    build=build_template_jinja,
-                    force=True,
-                    recurse=False)
+    Costs next to nothing when not profiling. Spans may nest and may be
+    recorded from several threads at once.
 
+    :param str phase: name of the phase, e.g. 'render'
+    :param attrs: details to record with the span, e.g. crate='bulker/demo'
+    """
+    if _SPANS is None:
+        yield
+        return
+    start = time.time()
+    timer = time.perf_counter()
+    try:
+        yield
+    finally:
+        record = {"phase": phase, "start": start, "seconds": time.perf_counter() - timer,
+                  "thread": threading.current_thread().name}
+        record.update(attrs)
+        with _SPANS_LOCK:
+            _SPANS.append(record)
 
 
+def start_profile():
+    """ Start recording timing spans (see span) """
+    global _SPANS
+    _SPANS = []
 
 
-def bulker_load(manifest, cratevars, bcfg, exe_jinja2_template,
-                shell_jinja2_template, crate_path=None, 
-                build=False, force=False, recurse=False):
-    manifest_name = cratevars['crate']
-    # We store them in folder: namespace/crate/version
-    if not crate_path:
-        crate_path = os.path.join(bcfg["bulker"]["default_crate_folder"],
-                                  cratevars['namespace'],
-                                  manifest_name,
-                                  cratevars['tag'])
-    if not os.path.isabs(crate_path):
-        crate_path = os.path.join(os.path.dirname(bcfg.filepath), crate_path)
+def profile_report(spans, wall_seconds):
+    """
+    Prints a per-phase timing breakdown of recorded spans, to stderr.
 
-    _LOGGER.debug("Crate path: {}".format(crate_path))
-    _LOGGER.debug("cratevars: {}".format(cratevars))
-    # Update the config file
-    if not bcfg["bulker"]["crates"]:
-        bcfg["bulker"]["crates"] = {}
-    if not cratevars['namespace'] in bcfg["bulker"]["crates"]:
-        bcfg["bulker"]["crates"][cratevars['namespace']] = {}
-    if not cratevars['crate'] in bcfg["bulker"]["crates"][cratevars['namespace']]:
-        bcfg["bulker"]["crates"][cratevars['namespace']][cratevars['crate']] = {}
-    if cratevars['tag'] in bcfg["bulker"]["crates"][cratevars['namespace']][cratevars['crate']]:
-        _LOGGER.debug(bcfg["bulker"]["crates"][cratevars['namespace']][cratevars['crate']])
-        if not (force or query_yes_no("That manifest has already been loaded. Overwrite?")):
-            return
-        else:
-            bcfg["bulker"]["crates"][cratevars['namespace']][cratevars['crate']][str(cratevars['tag'])] = crate_path
-            _LOGGER.warning("Removing all executables in: {}".format(crate_path))
-            try:
-                shutil.rmtree(crate_path)
-            except:
-                _LOGGER.error("Error removing crate at {}. Did your crate path change? Remove it manually.".format(crate_path))
-    else:
-        bcfg["bulker"]["crates"][cratevars['namespace']][cratevars['crate']][str(cratevars['tag'])] = crate_path
+    Nested spans are counted in their own phase and in the enclosing one,
+    and spans from concurrent threads overlap, so phase totals can add up to
+    more than the wall time.
 
+    :param list spans: spans, as recorded by span
+    :param float wall_seconds: wall time of the whole run
+    """
+    phases = {}
+    for record in spans:
+        phases.setdefault(record["phase"], []).append(record["seconds"])
+    width = max([len("Phase")] + [len(phase) for phase in phases])
+    fmt = "{:<" + str(width) + "}  {:>6}  {:>9}  {:>9}  {:>9}"
+    out = sys.stderr
+    out.write(fmt.format("Phase", "Count", "Total", "Mean", "Max") + "\n")
+    for phase, times in sorted(phases.items(), key=lambda p: -sum(p[1])):
+        out.write(fmt.format(phase, len(times), "{:.3f}s".format(sum(times)),
+                             "{:.4f}s".format(sum(times) / len(times)),
+                             "{:.4f}s".format(max(times))) + "\n")
+    out.write("Wall time: {:.3f}s\n".format(wall_seconds))
+
+
+def write_spans(spans, path):
+    """
+    Write recorded spans as JSON lines, one span per line.
 
-    # Now make the crate
+    :param list spans: spans, as recorded by span
+    :param str path: file to append to, or '-' for stdout
+    """
+    lines = "".join(json.dumps(record, default=str) + "\n" for record in spans)
+    if path == "-":
+        sys.stdout.write(lines)
+    else:
+        with open(path, "a") as fh:
+            fh.write(lines)
 
-    # First add any imports
 
-    mkdir(crate_path, exist_ok=True)
-    imps = get_imports(manifest, bcfg, recurse)
-    for imp in imps: 
-        reload_import = recurse
-        imp_cratevars = parse_registry_path(imp)
-        imp_crate_path = os.path.join(bcfg["bulker"]["default_crate_folder"],
-                              imp_cratevars['namespace'],
-                              imp_cratevars['crate'],
-                              imp_cratevars['tag'])
-        if not os.path.isabs(imp_crate_path):
-            imp_crate_path = os.path.join(os.path.dirname(bcfg.filepath), imp_crate_path)            
-        if not os.path.exists(imp_crate_path):
-            _LOGGER.error("Nonexistent crate: '{}' from '{}'. Reloading...".format(imp, imp_crate_path))
-            reload_import = True
-        if reload_import:
-            # Recursively load imported crates.
-            _LOGGER.error("Recursively loading imported crate '{}' from '{}'".format(imp, imp_crate_path))
-            imp_manifest, imp_cratevars = load_remote_registry_path(bcfg, 
-                                                    imp, None)
-            _LOGGER.debug(imp_manifest)
-            _LOGGER.debug(imp_cratevars)
-            bulker_load(imp_manifest, imp_cratevars, bcfg, exe_jinja2_template,
-            shell_jinja2_template, crate_path=None, build=build, force=force, recurse=False)
-        _LOGGER.info("Importing crate '{}' from '{}'.".format(imp, imp_crate_path))
-        copytree(imp_crate_path, crate_path, dirs_exist_ok=True)
-
-    # should put this in a function
-    def host_tool_specific_args(bcfg, pkg, hosttool_arg_key):
-        _LOGGER.debug("Arg key: '{}'".format(hosttool_arg_key))
-        # Here we're parsing the *image*, not the crate registry path.
-        imvars = parse_registry_path_image(pkg['docker_image'])
-        _LOGGER.debug(imvars)
-        try:
-            amap = bcfg["bulker"]["tool_args"][imvars['namespace']][imvars['image']]
-            if imvars['tag'] != 'default' and imvars['tag'] in amap:
-                string = amap[imvars['tag']][hosttool_arg_key]
-            else:
-                string = amap["default"][hosttool_arg_key]
-            _LOGGER.debug(string)
-            return string
-        except:
-            _LOGGER.debug("No host/tool args found.")
-            return ""
+def loaded_crates(bcfg):
+    """
+    Iterates over the crates loaded in a bulker config.
 
-    cmdlist = []
-    cmd_count = 0
-    if "commands" in manifest["manifest"] and manifest["manifest"]["commands"]:
-        for pkg in manifest["manifest"]["commands"]:
-            _LOGGER.debug(pkg)
-            pkg.update(bcfg["bulker"]) # Add terms from the bulker config
-            pkg = copy.deepcopy(pkg)
-            # We have to deepcopy it so that changes we make to pkg aren't reflected in bcfg.
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return generator: (namespace, crate, tag, path) tuples
+    """
+    if not bcfg["bulker"]["crates"]:
+        return
+    for namespace, crates in bcfg["bulker"]["crates"].items():
+        for crate, tags in crates.items():
+            for tag, path in tags.items():
+                yield namespace, crate, tag, path
 
-            if pkg["container_engine"] == "singularity" and "singularity_image_folder" in pkg:
-                pkg["singularity_image"] = os.path.basename(pkg["docker_image"])
-                pkg["namespace"] = os.path.dirname(pkg["docker_image"])
 
-                if os.path.isabs(pkg["singularity_image_folder"]):
-                    sif = pkg["singularity_image_folder"]
-                else:
-                    sif = os.path.join(os.path.dirname(bcfg.filepath),
-                                       pkg["singularity_image_folder"])
+def _nested_crates(rows):
+    """ Nest (namespace, crate, tag, path) rows as the config's 'crates' section """
+    crates = {}
+    for namespace, crate, tag, path in rows:
+        crates.setdefault(namespace, {}).setdefault(crate, {})[tag] = path
+    return crates
 
-                pkg["singularity_fullpath"] = os.path.join(
-                                                sif,
-                                                pkg["namespace"],
-                                                pkg["singularity_image"])
 
-                mkdir(os.path.dirname(pkg["singularity_fullpath"]), exist_ok=True)
-            command = pkg["command"]
-            path = os.path.join(crate_path, command)
-            _LOGGER.debug("Writing {cmd}".format(cmd=path))
-            cmdlist.append(command)
+class CrateRegistry(object):
+    """
+    The loaded-crate registry of a config that sets 'crate_registry', kept in
+    an sqlite database instead of the config's 'crates' section.
 
-            # Add any host-specific tool-specific args
-            hosttool_arg_key = "{engine}_args".format(engine=bcfg["bulker"]["container_engine"])
-            hts = host_tool_specific_args(bcfg, pkg, hosttool_arg_key)
-            _LOGGER.debug("Adding host-tool args: {}".format(hts))
-            if hosttool_arg_key in pkg:
-                pkg[hosttool_arg_key] += " " + hts
+    The database runs in WAL mode, so readers never wait for writers, and
+    changes are committed in short transactions instead of rewriting the
+    whole config under its file lock. Crates registered by this process are
+    queued (see register_crate) until commit_crate_registry.
+    """
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.pending = {}  # (namespace, crate, tag) -> path, or None to remove
+        if readonly:
+            self.db = sqlite3.connect("file:{}?mode=ro".format(path), uri=True,
+                                      check_same_thread=False)
+            return
+        mkdir(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS crates (namespace TEXT NOT NULL, "
+            "crate TEXT NOT NULL, tag TEXT NOT NULL, path TEXT NOT NULL, "
+            "loaded REAL, PRIMARY KEY (namespace, crate, tag))")
+
+    @contextmanager
+    def transaction(self):
+        """ Hold the database's write lock, committing on success """
+        with _REGISTRY_LOCK:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+    def seeded(self):
+        """ Has the registry been created from the YAML config yet? """
+        return self.db.execute("PRAGMA user_version").fetchone()[0] > 0
+
+    def crates(self):
+        """
+        :return dict: namespace -> crate -> tag -> path, as in the config
+        """
+        with _REGISTRY_LOCK:
+            return _nested_crates(self.db.execute(
+                "SELECT namespace, crate, tag, path FROM crates "
+                "ORDER BY namespace, crate, tag"))
+
+    def loaded_times(self):
+        """
+        :return dict: crate key -> time the crate was last registered, for
+            crates registered since the registry was created
+        """
+        with _REGISTRY_LOCK:
+            return {"{}/{}:{}".format(namespace, crate, tag): loaded
+                    for namespace, crate, tag, loaded in self.db.execute(
+                        "SELECT namespace, crate, tag, loaded FROM crates "
+                        "WHERE loaded IS NOT NULL")}
+
+    def apply(self, changes, stamp=True):
+        """
+        Write registry changes; call within a transaction.
+
+        :param dict changes: (namespace, crate, tag) -> path, or None to remove
+        :param bool stamp: record now as the time the crates were loaded;
+            otherwise their load time is left unknown (NULL)
+        """
+        now = time.time() if stamp else None
+        for (namespace, crate, tag), path in changes.items():
+            if path is None:
+                self.db.execute("DELETE FROM crates WHERE namespace = ? AND crate = ? "
+                                "AND tag = ?", (namespace, crate, tag))
             else:
-                pkg[hosttool_arg_key] = hts
-                
+                self.db.execute("INSERT OR REPLACE INTO crates VALUES (?, ?, ?, ?, ?)",
+                                (namespace, crate, tag, path, now))
 
-            # Remove any excluded volumes from the package
-            exclude_vols = host_tool_specific_args(bcfg, pkg, "exclude_volumes")
-            _LOGGER.debug("Volume list: {}".format(pkg["volumes"]))
-            _LOGGER.debug("pkg: {}".format(pkg))
-            if len(exclude_vols) > 0:
-                for item in exclude_vols:
-                    _LOGGER.debug("Excluding volume: '{}'".format(item))
-                    try:
-                        pkg["volumes"].remove(item)
-                    except:
-                        pass
-                _LOGGER.debug("Volume list: {}".format(pkg["volumes"]))
-            else:
-                _LOGGER.debug("No excluded volumes")
 
+def crate_registry(bcfg):
+    """
+    Get the sqlite crate registry of a config.
 
-            with open(path, "w") as fh:
-                fh.write(exe_jinja2_template.render(pkg=pkg))
-                os.chmod(path, 0o755)
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return CrateRegistry: the registry, or None if the config keeps its
+        crates in the YAML 'crates' section
+    """
+    if not bcfg["bulker"].get("crate_registry") or not bcfg.filepath:
+        return None
+    path = mkabs(bcfg["bulker"]["crate_registry"], os.path.dirname(bcfg.filepath))
+    with _REGISTRY_LOCK:
+        if path not in _CRATE_REGISTRIES:
+            _CRATE_REGISTRIES[path] = CrateRegistry(path)
+        return _CRATE_REGISTRIES[path]
 
-            # shell commands
-            path_shell = os.path.join(crate_path, "_" + command)
-            _LOGGER.debug("Writing shell command: '{cmd}'".format(cmd=path_shell))
-            with open(path_shell, "w") as fh:
-                fh.write(shell_jinja2_template.render(pkg=pkg))
-                os.chmod(path_shell, 0o755)            
 
-            if build:
-                buildscript = build.render(pkg=pkg)
-                x = os.system(buildscript)
-                if x != 0:
-                    _LOGGER.error("------ Error building. Build script used: ------")
-                    _LOGGER.error(buildscript)
-                    _LOGGER.error("------------------------------------------------")
-                if pkg["container_engine"] == "singularity":
-                    _LOGGER.info("Image available at: {cmd}".format(cmd=pkg["singularity_fullpath"]))
-                else:
-                    _LOGGER.info("Docker image available as: {cmd}".format(cmd=pkg["docker_image"]))
+def load_crate_registry(bcfg):
+    """
+    Read the crates of a config with an sqlite registry into its 'crates'
+    section. A new registry is first filled with the crates listed in the
+    YAML config.
 
-    # host commands
-    host_cmdlist = []
-    if "host_commands" in manifest["manifest"] and manifest["manifest"]["host_commands"]:
-        _LOGGER.info("Populating host commands")
-        for cmd in manifest["manifest"]["host_commands"]:
-            _LOGGER.debug(cmd)
-            if not is_command_callable(cmd):
-                _LOGGER.warning("Requested host command is not callable and "
-                "therefore not created: '{}'".format(cmd))
-                continue
-            local_exe = which(cmd)
-            path = os.path.join(crate_path, cmd)
-            host_cmdlist.append(cmd)
-            try:
-                os.symlink(local_exe, path)
-            except FileExistsError:
-                _LOGGER.info("Overwriting existing file with link: {}, {}".format(path, local_exe))
-                os.unlink(path)
-                os.symlink(local_exe, path)
-
-            # The old way: TODO: REMOVE THIS
-            if False:
-                populated_template = LOCAL_EXE_TEMPLATE.format(cmd=local_exe)
-                with open(path, "w") as fh:
-                    fh.write(populated_template)
-                    os.chmod(path, 0o755)
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    """
+    registry = crate_registry(bcfg)
+    if not registry:
+        return
+    if not registry.seeded():
+        with registry.transaction():
+            if not registry.seeded():
+                _LOGGER.info("Creating crate registry: {}".format(registry.path))
+                # When these were loaded isn't known; see crate_loaded_times
+                registry.apply({(namespace, crate, str(tag)): path for
+                                namespace, crate, tag, path in loaded_crates(bcfg)},
+                               stamp=False)
+                registry.db.execute("PRAGMA user_version = 1")
+                write_registry_index(bcfg)
+    bcfg["bulker"]["crates"] = registry.crates()
+
+
+def register_crate(bcfg, cratevars, path):
+    """
+    Add a crate to the registry of a config, or with no path, remove it.
+    The change is saved with the config (see registry_update).
 
-    cmd_count = len(cmdlist)
-    host_cmd_count = len(host_cmdlist)
-    if cmd_count < 1 and host_cmd_count < 1:
-        _LOGGER.error("No commands provided. Crate not created.")
-        os.rmdir(crate_path)
-        crate_path_parent = os.path.dirname(crate_path)
-        if not os.listdir(crate_path_parent):
-            os.rmdir(crate_path_parent)
-        sys.exit(1)
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param dict cratevars: crate namespace, crate, and tag
+    :param str path: crate folder, or None to remove the crate
+    """
+    namespace, crate, tag = cratevars["namespace"], cratevars["crate"], str(cratevars["tag"])
+    registry = crate_registry(bcfg)
+    with _REGISTRY_LOCK:
+        if not bcfg["bulker"]["crates"]:
+            bcfg["bulker"]["crates"] = {}
+        crates = bcfg["bulker"]["crates"]
+        if path:
+            crates.setdefault(namespace, {}).setdefault(crate, {})[tag] = path
+        elif tag in crates.get(namespace, {}).get(crate, {}):
+            del crates[namespace][crate][tag]
+            if not crates[namespace][crate]:
+                del crates[namespace][crate]
+            if not crates[namespace]:
+                del crates[namespace]
+        if registry:
+            registry.pending[(namespace, crate, tag)] = path
+
+
+def commit_crate_registry(bcfg, on_commit=None):
+    """
+    Commit the queued changes to a config's sqlite registry in one
+    transaction, refresh the config's crates from it (picking up crates
+    other processes registered meanwhile), and rewrite the registry and
+    command indexes before the transaction ends, so they can't go stale.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param callable on_commit: called within the transaction, after the
+        changes are applied
+    """
+    registry = crate_registry(bcfg)
+    with span("config write"), registry.transaction():
+        registry.apply(registry.pending)
+        registry.pending.clear()
+        if on_commit:
+            on_commit()
+        bcfg["bulker"]["crates"] = registry.crates()
+        write_registry_index(bcfg)
+        command_index(bcfg)
+
+
+@contextmanager
+def registry_update(bcfg, on_commit=None):
+    """
+    Change the crate registry of a config, saving it when the block exits
+    without error. For a YAML registry, the config is write-locked
+    throughout; an sqlite registry is only locked while committing.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param callable on_commit: called with the registry still locked, just
+        before the changes are saved, for work that must happen together
+        with them
+    :return yacman.YAMLConfigManager: the config to change
+    """
+    if crate_registry(bcfg):
+        yield bcfg
+        commit_crate_registry(bcfg, on_commit)
+    else:
+        with write_lock(bcfg) as locked_cfg:
+            yield locked_cfg
+            if on_commit:
+                on_commit()
+            write_bulker_config(locked_cfg)
 
-    rp = "{namespace}/{crate}:{tag}".format(
-        namespace=cratevars['namespace'],
-        crate=cratevars['crate'],
-        tag=cratevars['tag'])
 
-    _LOGGER.info("Loading manifest: '{rp}'."
-                " Activate with 'bulker activate {rp}'.".format(rp=rp))
-    if cmd_count > 0:
-        _LOGGER.info("Commands available: {}".format(", ".join(cmdlist)))
-    if host_cmd_count > 0:
-        _LOGGER.info("Host commands available: {}".format(", ".join(host_cmdlist)))
+def save_crate_registry(bcfg):
+    """
+    Save the crate registry of a config, locking it as registry_update does.
 
+    :param yacman.YAMLConfigManager bcfg: bulker config object, not locked
+    """
+    with registry_update(bcfg):
+        pass
 
-    with write_lock(bcfg) as locked_cfg:
-        locked_cfg.write()
 
-def bulker_activate(bulker_config, cratelist, echo=False, strict=False, prompt=True):
+def bulker_registry_export(bcfg, path=None):
     """
-    Activates a given crate.
+    Write the loaded-crate registry of a config as YAML.
 
-    :param yacman.YAMLConfigManager bulker_config: The bulker configuration object.
-    :param list cratelist: a list of cratevars objects, which are dicts with
-        values for 'namespace', 'crate', and 'tag'.
-    :param bool echo: Should we just echo the new PATH to create? Otherwise, the
-        function will create a new shell and replace the current process with
-        it.
-    :param bool strict: Should we wipe out the PATH, such that the returned
-        environment contains strictly only commands listed in the bulker
-        manifests?
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param str path: file to write, or None for stdout
     """
-    # activating is as simple as adding a crate folder to the PATH env var.
+    import yaml
+    text = yaml.safe_dump({"crates": bcfg["bulker"]["crates"] or {}},
+                          default_flow_style=False)
+    if path:
+        with open(path, "w") as f:
+            f.write(text)
+        _LOGGER.info("Wrote {} crates to: {}".format(len(list(loaded_crates(bcfg))), path))
+    else:
+        sys.stdout.write(text)
 
-    new_env = os.environ
 
+def bulker_registry_import(bcfg, path):
+    """
+    Add the crates listed in a YAML file to the registry of a config.
 
-    if "shell_path" in bulker_config["bulker"]:
-        shellpath = os.path.expandvars(bulker_config["bulker"]["shell_path"])
-    else:
-        shellpath = os.path.expandvars("$SHELL")
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param str path: YAML file with a 'crates' section, as written by
+        bulker_registry_export, or a bulker config
+    :return int: number of crates imported
+    """
+    import yaml
+    with open(path, "r") as f:
+        data = yaml.safe_load(f) or {}
+    crates = data.get("crates") or (data.get("bulker") or {}).get("crates") or {}
+    count = 0
+    for namespace, names in crates.items():
+        for crate, tags in (names or {}).items():
+            for tag, crate_path in (tags or {}).items():
+                register_crate(bcfg, {"namespace": namespace, "crate": crate, "tag": tag},
+                               mkabs(crate_path, os.path.dirname(os.path.abspath(path))))
+                count += 1
+    _LOGGER.info("Imported {} crates from: {}".format(count, path))
+    return count
+
+
+def write_registry_index(bcfg, config_mtime=None):
+    """
+    Write the registry index that `bulker run` and `bulker activate` start
+    from, so they can skip parsing the YAML config (see bulker.runtime).
 
-    if not is_command_callable(shellpath):
-        bashpath = "/bin/bash"
-        _LOGGER.warning("Specified shell is not callable: '{}'. Using {}.".format(shellpath, bashpath))
-        shell_list = [bashpath, bashpath]
+    :param yacman.YAMLConfigManager bcfg: bulker config object, already
+        written to disk
+    :param int config_mtime: modification time (ns) of the config file when
+        bcfg was read; defaults to its current one
+    """
+    if _is_default_config(bcfg.filepath):
+        return
+    index = {key: bcfg["bulker"][key] for key in runtime.ACTIVATE_SETTINGS
+             if key in bcfg["bulker"]}
+    index["default_namespace"] = bcfg["bulker"].get("default_namespace", "bulker")
+    stores = crate_stores(bcfg)
+    index["crates"] = store_crates(bcfg)
+    index["crates"].update(("{}/{}:{}".format(namespace, crate, tag), path)
+                           for namespace, crate, tag, path in loaded_crates(bcfg))
+    # Store configs the index depends on, with their modification times
+    index["stores"] = {path: mtime for store in stores.values()
+                       for path, mtime in store["watch"].items()}
+    try:
+        index["config_mtime"] = config_mtime if config_mtime is not None \
+            else os.stat(bcfg.filepath).st_mtime_ns
+        _atomic_write(runtime.registry_index_path(bcfg.filepath),
+                      json.dumps(index, default=list))
+    except OSError as e:
+        _LOGGER.debug("Couldn't write registry index: {}".format(e))
 
 
-    if "shell_rc" in bulker_config["bulker"]:
-        shell_rc = os.path.expandvars(bulker_config["bulker"]["shell_rc"])
-    else:
-        if os.path.basename(shellpath) == "bash":
-            shell_rc = "$HOME/.bashrc"
-        elif os.path.basename(shellpath) == "zsh":
-            shell_rc = "$HOME/.zshrc"
-        else:
-            _LOGGER.warning("No shell RC specified shell")
+def refresh_registry_index(bcfg, config_mtime):
+    """
+    Rewrite the registry index of a config that was read without a lock.
 
-    if os.path.basename(shellpath) == "bash":
-        shell_list = [shellpath, shellpath, "--noprofile"]
-    elif os.path.basename(shellpath) == "zsh":
-        shell_list = [shellpath, shellpath]
-    else:
-        bashpath = "/bin/bash"
-        _LOGGER.warning("Shell must be bash or zsh. Specified shell was: '{}'. Using {}.".format(shellpath, bashpath))
-        shell_list = [bashpath, bashpath, "--noprofile"]
+    The index is stamped with the config's modification time from before it
+    was read, so a config written meanwhile leaves the index stale rather
+    than marked current. Crates of an sqlite registry are re-read within a
+    transaction, so the index can't overwrite a newer commit.
 
-           
-    newpath = get_new_PATH(bulker_config, cratelist, strict)
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param int config_mtime: modification time (ns) of the config file from
+        before bcfg was read
+    """
+    registry = crate_registry(bcfg)
+    if not registry:
+        write_registry_index(bcfg, config_mtime)
+        return
+    with registry.transaction():
+        bcfg["bulker"]["crates"] = registry.crates()
+        write_registry_index(bcfg, config_mtime)
 
-    # We can use lots of them. use the last one
-    name = "{namespace}/{crate}".format(
-        namespace=cratelist[-1]["namespace"],
-        crate=cratelist[-1]["crate"])
 
+def command_index_path(config_path):
+    """
+    Path of the command index kept beside a bulker config file.
 
-    _LOGGER.debug("Newpath: {}".format(newpath))
+    :param str config_path: path to the bulker config file
+    :return str: path to the index file
+    """
+    folder, name = os.path.split(os.path.abspath(config_path))
+    return os.path.join(folder, ".{}.commands.json".format(name))
 
 
-    if "shell_prompt" in bulker_config["bulker"]:
-        ps1 = bulker_config["bulker"]["shell_prompt"]
-    else:
-        if os.path.basename(shellpath) == "bash":
-            ps1 = "\\u@\\b:\\w\\a\\$ "
-            # With color:
-            ps1 = "\\[\\033[01;93m\\]\\b|\\[\\033[00m\\]\\[\\033[01;34m\\]\\w\\[\\033[00m\\]\\$ "
-        elif os.path.basename(shellpath) == "zsh":
-            ps1 = "%F{226}%b|%f%F{blue}%~%f %# "
-        else:
-            ps1 = ""
-            prompt = False
-            _LOGGER.warning("No built-in custom prompt for shells other than bash or zsh")        
-    
-    # \b is our bulker-specific code that we populate with the crate
-    # registry path
-    ps1 = ps1.replace("\\b", name)  # for bash
-    ps1 = ps1.replace("%b", name)  # for zsh
-    _LOGGER.debug(ps1)
-
-    if echo:
-        print("export BULKERCRATE=\"{}\"".format(name))
-        print("export BULKERPATH=\"{}\"".format(newpath))
-        print("export BULKERSHELLRC=\"{}\"".format(shell_rc))
-        if prompt:
-            print("export BULKERPROMPT=\"{}\"".format(ps1))
-            print("export PS1=\"{}\"".format(ps1))
-        print("export PATH={}".format(newpath))
-        return
-    else:
-        _LOGGER.debug("Shell list: {}". format(shell_list))
+def command_index(bcfg, write=True):
+    """
+    Get the index of which loaded crates provide which commands.
 
-        new_env["BULKERCRATE"] = name
-        new_env["BULKERPATH"] = newpath
-        if prompt:
-            new_env["BULKERPROMPT"] = ps1
+    The index is kept beside the config and built from the crate indexes of
+    the loaded crates (including those of crate stores); only crates whose
+    crate index changed since it was last written are read again.
 
-        new_env["BULKERSHELLRC"] = shell_rc
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param bool write: save the index if it changed?
+    :return dict: crate key -> {'path', 'mtime', 'commands'}, where
+        'commands' maps command name -> [image, crate imported from]; the
+        image is None for host commands
+    """
+    index_path = command_index_path(bcfg.filepath) if bcfg.filepath else None
+    previous = {}
+    if index_path:
+        try:
+            with open(index_path) as fh:
+                previous = json.load(fh)
+        except (OSError, ValueError):
+            pass
+    crates = store_crates(bcfg)
+    crates.update(("{}/{}:{}".format(namespace, crate, tag), path)
+                  for namespace, crate, tag, path in loaded_crates(bcfg))
+    index = {}
+    for key, path in crates.items():
+        try:
+            mtime = os.stat(os.path.join(path, CRATE_INDEX_FILENAME)).st_mtime_ns
+        except OSError:
+            mtime = None
+        entry = previous.get(key)
+        if entry and entry["path"] == path and entry["mtime"] == mtime:
+            index[key] = entry
+            continue
+        crate_index = read_crate_index(path)
+        commands = {name: [image, None] for name, image in
+                    crate_index.get("commands", {}).items()}
+        commands.update((name, [None, None]) for name in crate_index.get("host_commands", []))
+        for name, imp in crate_index.get("imported", {}).items():
+            if not name.startswith("_") and name not in commands:
+                commands[name] = [None, imp]
+        index[key] = {"path": path, "mtime": mtime, "commands": commands}
+    if write and index_path and index != previous:
+        try:
+            _atomic_write(index_path, json.dumps(index, sort_keys=True))
+        except OSError as e:
+            _LOGGER.debug("Couldn't write command index: {}".format(e))
+    return index
 
-        if strict:
-            for k in bulker_config["bulker"]["envvars"]:
-                new_env[k] = os.environ.get(k, "")
-        
-        if os.path.basename(shellpath) == "bash":    
-            if strict:
-                rcfile = mkabs(bulker_config["bulker"]["rcfile_strict"],
-                                 os.path.dirname(bulker_config.filepath))
-            else:
-                rcfile = mkabs(bulker_config["bulker"]["rcfile"],
-                             os.path.dirname(bulker_config.filepath))
-
-            shell_list.append("--rcfile")
-            shell_list.append(rcfile)
-            _LOGGER.debug("rcfile: {}".format(rcfile))
-            _LOGGER.debug(shell_list)
-
-        if os.path.basename(shellpath) == "zsh":
-            if strict:
-                rcfolder = mkabs(os.path.join(
-                    os.path.dirname(bulker_config["bulker"]["rcfile_strict"]),
-                    "zsh_start_strict"), os.path.dirname(bulker_config.filepath))     
-            else:
-                rcfolder = mkabs(os.path.join(
-                    os.path.dirname(bulker_config["bulker"]["rcfile_strict"]),
-                    "zsh_start"), os.path.dirname(bulker_config.filepath))   
 
-            new_env["ZDOTDIR"] = rcfolder
-            _LOGGER.debug("ZDOTDIR: {}".format(new_env["ZDOTDIR"]))
+def find_commands(bcfg, pattern, exact=False):
+    """
+    Find the loaded crates that provide commands matching a pattern.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param str pattern: command name; shell-style wildcards are allowed, and
+        without any, a case-insensitive substring of the command or its image
+        matches (unless exact)
+    :param bool exact: only match the command name exactly
+    :return list: (command, crate key, image, crate imported from) tuples,
+        sorted by command and crate
+    """
+    if exact:
+        def matches(name, image):
+            return name == pattern
+    elif _is_pattern(pattern):
+        def matches(name, image):
+            return fnmatchcase(name, pattern)
+    else:
+        needle = pattern.lower()
 
-        _LOGGER.debug(new_env)
-        #os.execv(shell_list[0], shell_list[1:])
-        os.execve(shell_list[0], shell_list[1:], env=new_env)
+        def matches(name, image):
+            return needle in name.lower() or needle in (image or "").lower()
+    found = []
+    for key, entry in command_index(bcfg).items():
+        for name, (image, imp) in entry["commands"].items():
+            if matches(name, image):
+                found.append((name, key, image, imp))
+    return sorted(found)
 
-         # The 'v' means 'pass a variable with a list of args' vs. 'l' which is 
-        # a list of separate args.
-        # The 'e' means add the 'env' to replace any environment variables
 
-def get_local_path(bulker_config, cratevars):
+def print_commands(found):
     """
-    :param dict cratevars: dict with crate metadata returned from parse_registry_path
-    :param YAMLConfigManager bulker_config: bulker config object
-    :return str: path to requested crate folder
+    Prints command search results, as returned by find_commands.
+
+    :param list found: (command, crate key, image, crate imported from) tuples
     """
-    _LOGGER.debug(cratevars)
-    _LOGGER.debug(bulker_config["bulker"]["crates"][cratevars["namespace"]][cratevars["crate"]])
+    rows = [(name, key, "imported from " + imp if imp else (image or "(host command)"))
+            for name, key, image, imp in found]
+    header = ("Command", "Crate", "Image")
+    widths = [max(len(row[i]) for row in rows + [header]) for i in range(2)]
+    fmt = "  ".join("{:<" + str(w) + "}" for w in widths) + "  {}"
+    for row in [header] + rows:
+        print(fmt.format(*row))
 
-    return bulker_config["bulker"]["crates"][cratevars["namespace"]][cratevars["crate"]][cratevars["tag"]]
 
-def get_new_PATH(bulker_config, cratelist, strict=False):
+def telemetry_log_path(bcfg):
     """
-    Returns local paths to crates
+    Get the log that crate commands append their calls to when 'telemetry'
+    is on: 'telemetry_log' if set, else telemetry.log next to the config.
 
-    :: param str crates :: string with a comma-separated list of crate identifiers
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return str: path to the log, or None for the built-in default config
     """
-    if not bulker_config["bulker"]["crates"]:
-        raise MissingCrateError("No crates exist")
+    cfg_path = bcfg.filepath
+    if _is_default_config(cfg_path):
+        return None
+    if bcfg["bulker"].get("telemetry_log"):
+        return mkabs(bcfg["bulker"]["telemetry_log"], os.path.dirname(cfg_path))
+    return os.path.join(os.path.dirname(os.path.abspath(cfg_path)),
+                        TELEMETRY_LOG_FILENAME)
 
-    cratepaths = ""
-    for cratevars in cratelist:
-        cratepaths += get_local_path(bulker_config, cratevars) + os.pathsep
-    
-    if strict:
-        newpath = cratepaths
-    else:
-        newpath = cratepaths + os.environ["PATH"]
 
-    return newpath
+def _telemetry_time(stamp):
+    # 'date +%s%N' gives nanoseconds; systems without %N leave seconds + 'N'
+    if stamp.endswith("N"):
+        return float(stamp[:-1])
+    return int(stamp) / 1e9
 
-def bulker_run(bulker_config, cratelist, command, strict=False):
-    _LOGGER.debug("Running.")
-    _LOGGER.debug("{}".format(command))
-    newpath = get_new_PATH(bulker_config, cratelist, strict)
 
-    def maybe_quote(item):
-        if ' ' in item:
-            return "\"{}\"".format(item)
-        else:
-            return item
-    
-    quoted_command = [maybe_quote(x) for x in command]
-    os.environ["PATH"] = newpath  
-    export = "export PATH=\"{}\"".format(newpath)
-    merged_command = "{export}; {command}".format(export=export, command=" ".join(quoted_command))
-    _LOGGER.debug("{}".format(merged_command))
-    # os.system(merged_command)
-    # os.execlp(command[0], merged_command)
-    import subprocess
-    import psutil
-    signal.signal(signal.SIGINT, _generic_signal_handler)
-    signal.signal(signal.SIGTERM, _generic_signal_handler)    
-    # process = subprocess.call(merged_command, shell=True)
-    global PROC
-    PROC = psutil.Popen(merged_command, shell=True, preexec_fn=os.setsid)
-    PROC.communicate()
-    sys.exit(PROC.returncode)
-    #command[0:0] = ["export", "PATH=\"{}\"".format(newpath)]
-    #subprocess.call(merged_command)
-
-def _generic_signal_handler(sig, frame):
-    """
-    Function for handling both SIGTERM and SIGINT
-    """
-
-    global PROC
-    message = "Interrupt received. Bulker (pid: {}) failing gracefully...".format(PROC.pid)
-    _LOGGER.info(message)
-    sys.stdout.flush()
-    try:
-        parent_process = psutil.Process(PROC.pid)
-        print("children:", [x for x in parent_process.children(recursive=False)])
-        for child_proc in parent_process.children(recursive=False):
-            _kill_process(child_proc.pid)
-    except psutil.NoSuchProcess:
-        print("already dead")
-        return    
-    _kill_process(PROC.pid)
-    PROC.wait(timeout=5)
-    sys.stdout.flush()
-    
-    sys.exit(1)
+def read_telemetry(path):
+    """
+    Read the calls recorded in a telemetry log and its rotated copy.
+
+    :param str path: path to the telemetry log
+    :return list[dict]: one dict per call, oldest first, with the command,
+        image, mode ('cold' or 'warm'), start time, wall time in seconds,
+        and exit status; malformed lines are skipped
+    """
+    calls = []
+    for log in [path + ".1", path]:
+        if not os.path.exists(log):
+            continue
+        with open(log, "r") as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 6:
+                    continue
+                try:
+                    start, end = _telemetry_time(fields[0]), _telemetry_time(fields[1])
+                    status = int(fields[5])
+                except ValueError:
+                    continue
+                calls.append({"command": fields[2], "image": fields[3], "mode": fields[4],
+                              "start": start, "seconds": max(end - start, 0.0),
+                              "status": status})
+    return calls
+
+
+def _percentile(values, percent):
+    """ Nearest-rank percentile of a sorted, non-empty list """
+    return values[max(int(math.ceil(percent / 100.0 * len(values))) - 1, 0)]
+
+
+def telemetry_stats(calls):
+    """
+    Aggregate telemetry calls per command.
+
+    Container startup is estimated per command as its median cold call less
+    its median warm call, since a warm call does the same work without
+    starting a container. Commands never run warm fall back to the fastest
+    cold call on their image, which includes the tool's own work and so is
+    only an upper bound. Commands with many calls and a large startup
+    overhead are the ones that benefit most from warm mode or a host command.
+
+    :param list[dict] calls: calls, as returned by read_telemetry
+    :return list[dict]: per command and image: calls, failures (non-zero
+        exit), warm calls, p50 and p95 wall time, estimated startup (and
+        whether it is only an upper bound), and overhead (startup times cold
+        calls), largest overhead first
+    """
+    fastest_cold = {}
+    groups = {}
+    for call in calls:
+        groups.setdefault((call["command"], call["image"]), []).append(call)
+        if call["mode"] == "cold":
+            fastest_cold[call["image"]] = min(
+                fastest_cold.get(call["image"], call["seconds"]), call["seconds"])
+    rows = []
+    for (command, image), group in groups.items():
+        times = sorted(call["seconds"] for call in group)
+        cold_times = sorted(call["seconds"] for call in group if call["mode"] == "cold")
+        warm_times = sorted(call["seconds"] for call in group if call["mode"] != "cold")
+        if cold_times and warm_times:
+            startup = max(0.0, _percentile(cold_times, 50) - _percentile(warm_times, 50))
+        else:
+            startup = fastest_cold.get(image, 0.0)
+        rows.append({"command": command, "image": image, "calls": len(group),
+                     "failures": sum(1 for call in group if call["status"] != 0),
+                     "warm": len(warm_times),
+                     "p50": _percentile(times, 50), "p95": _percentile(times, 95),
+                     "total": sum(times), "startup": startup,
+                     "startup_bound": bool(cold_times) and not warm_times,
+                     "overhead": startup * len(cold_times)})
+    return sorted(rows, key=lambda row: (-row["overhead"], row["command"]))
+
+
+def bulker_stats(bcfg, clear=False):
+    """
+    Prints per-command call counts, latencies, and estimated container
+    startup overhead from the telemetry log.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param bool clear: delete the log (and its rotated copy) instead
+    :return list[dict]: the rows printed, as returned by telemetry_stats
+    """
+    path = telemetry_log_path(bcfg)
+    if not path:
+        raise BulkerError("Telemetry needs a bulker config file.")
+    if clear:
+        for log in [path, path + ".1"]:
+            if os.path.exists(log):
+                os.remove(log)
+        _LOGGER.info("Cleared telemetry log: {}".format(path))
+        return []
+    rows = telemetry_stats(read_telemetry(path))
+    if not rows:
+        if not bcfg["bulker"].get("telemetry"):
+            _LOGGER.info("Telemetry is off. Set 'telemetry: true' in your bulker "
+                         "config and run 'bulker reload' to record command calls.")
+        else:
+            _LOGGER.info("No command calls recorded yet in {}".format(path))
+        return rows
+    header = ("Command", "Image", "Calls", "Failed", "Warm", "p50", "p95",
+              "Startup", "Overhead")
+    table = [(row["command"], row["image"], str(row["calls"]), str(row["failures"]),
+              str(row["warm"]), "{:.2f}s".format(row["p50"]), "{:.2f}s".format(row["p95"]),
+              ("<" if row["startup_bound"] else "") + "{:.2f}s".format(row["startup"]),
+              ("<" if row["startup_bound"] else "") + "{:.2f}s".format(row["overhead"]))
+             for row in rows]
+    widths = [max(len(r[i]) for r in table + [header]) for i in range(len(header))]
+    fmt = "  ".join("{:<" + str(w) + "}" if i < 2 else "{:>" + str(w) + "}"
+                    for i, w in enumerate(widths))
+    for row in [header] + table:
+        print(fmt.format(*row))
+    print("Startup: median cold call less median warm call. '<': never run warm, so "
+          "the fastest cold call on the image, an upper bound. "
+          "Overhead: startup x cold calls.")
+    return rows
+
+
+def write_bulker_config(bcfg):
+    """
+    Write a locked bulker config to disk, along with its registry and
+    command indexes. Crates queued for an sqlite registry are committed too;
+    the config's 'crates' section is then only a snapshot of the registry.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object, write-locked
+    """
+    registry = crate_registry(bcfg)
+    with span("config write"):
+        bcfg.write()
+        if not registry:
+            write_registry_index(bcfg)
+            command_index(bcfg)
+    if registry:
+        commit_crate_registry(bcfg)
+
+
+class ImportGraph(object):
+    """
+    The manifests of a set of crates and everything they import.
+
+    Each manifest is fetched once, no matter how many crates import it, and
+    crates that have been loaded through the graph are remembered so each is
+    built only once per invocation.
+    """
+    def __init__(self, bcfg, offline=False):
+        self.bcfg = bcfg
+        self.offline = offline
+        self.manifests = {}  # crate key -> (manifest, cratevars)
+        self.imports = {}  # crate key -> crate keys it imports directly
+        self.failed = {}  # crate key -> reason the manifest is unavailable
+        self.loaded = set()
+
+    def _fetch(self, cratevars):
+        try:
+            with span("import resolution", crate=crate_key(cratevars)):
+                manifest, fetched_cratevars = load_remote_registry_path(
+                    self.bcfg, crate_key(cratevars), None, self.offline)
+        except Exception as e:
+            return None, cratevars, str(e)
+        if manifest is None:
+            return None, cratevars, "manifest not found"
+        return manifest, fetched_cratevars, None
+
+    def _insert(self, key, manifest, cratevars, failure=None):
+        """ Records a fetched manifest and returns cratevars of its imports """
+        self.manifests[key] = (manifest, cratevars)
+        if failure:
+            self.failed[key] = failure
+        imports = []
+        if manifest and "imports" in manifest["manifest"] and manifest["manifest"]["imports"]:
+            imports = [parse_registry_path(imp) for imp in manifest["manifest"]["imports"]]
+        self.imports[key] = [crate_key(imp) for imp in imports]
+        return imports
+
+    def add(self, registry_path=None, manifest=None, cratevars=None):
+        """
+        Adds a crate, and recursively its imports, to the graph.
+
+        :param str registry_path: registry path of the crate to fetch
+        :param yacman.YAMLConfigManager manifest: an already-loaded manifest
+        :param dict cratevars: crate metadata for an already-loaded manifest
+        :return str: crate key of the added crate
+        """
+        if cratevars is None:
+            cratevars = parse_registry_path(registry_path)
+        key = crate_key(cratevars)
+        if key in self.manifests:
+            return key
+        failure = None
+        if manifest is None:
+            manifest, cratevars, failure = self._fetch(cratevars)
+        for imp in self._insert(key, manifest, cratevars, failure):
+            self.add(cratevars=imp)
+        return key
+
+    def add_known(self, manifests):
+        """
+        Adds crates whose manifests are already at hand, then fetches any of
+        their imports that aren't.
+
+        :param dict manifests: crate key -> (manifest, cratevars)
+        """
+        for key, (manifest, cratevars) in manifests.items():
+            if key not in self.manifests:
+                self._insert(key, manifest, cratevars)
+        for key in manifests:
+            for imp in self.imports[key]:
+                self.add(imp)
+
+    def add_all(self, registry_paths, jobs=DEFAULT_LOAD_JOBS):
+        """
+        Adds several crates and their imports, fetching manifests concurrently.
+
+        :param list registry_paths: registry paths of the crates to fetch
+        :param int jobs: maximum number of manifests to fetch at the same time
+        :return list: crate keys of the given crates
+        """
+        pending = [parse_registry_path(path) for path in registry_paths]
+        keys = [crate_key(cratevars) for cratevars in pending]
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            while pending:
+                batch = {}
+                for cratevars in pending:
+                    key = crate_key(cratevars)
+                    if key not in self.manifests:
+                        batch.setdefault(key, cratevars)
+                pending = []
+                for key, fetched in zip(batch, executor.map(self._fetch, batch.values())):
+                    pending.extend(self._insert(key, *fetched))
+        return keys
+
+    def order(self, keys=None):
+        """
+        Sorts crates so that every crate comes after the crates it imports.
+
+        :param list keys: crate keys to sort, along with everything they
+            import; defaults to the whole graph
+        :return list: crate keys in load order
+        :raise ImportCycleError: if crates import each other in a cycle
+        """
+        ordered = []
+        done = set()
+        visiting = []
+
+        def visit(key):
+            if key in done:
+                return
+            if key in visiting:
+                cycle = visiting[visiting.index(key):] + [key]
+                raise ImportCycleError("Cyclic manifest imports: {}".format(" -> ".join(cycle)))
+            visiting.append(key)
+            for imp in self.imports.get(key, []):
+                visit(imp)
+            visiting.pop()
+            done.add(key)
+            ordered.append(key)
+
+        for key in (list(self.manifests) if keys is None else keys):
+            visit(key)
+        return ordered
+
+
+def load_import_graph(bcfg, graph, keys=None, jobs=DEFAULT_LOAD_JOBS, in_place=(),
+                      **load_kwargs):
+    """
+    Loads crates from an import graph concurrently.
+
+    Each crate is loaded once all the crates it imports have been loaded, and
+    a failure only affects that crate and the crates importing it. The config
+    file is not written; that's left to the caller.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param ImportGraph graph: graph holding the manifests to load
+    :param list keys: crate keys to load, with everything they import;
+        defaults to the whole graph
+    :param int jobs: maximum number of crates to load at the same time
+    :param Iterable[str] in_place: imported crate keys that are already
+        loaded and shouldn't be loaded again
+    :param load_kwargs: additional arguments passed on to bulker_load
+    :return dict: crate key -> (status, seconds, details), in load order
+    """
+    results = {key: ("ok", 0.0, "") for key in in_place}
+    roots = list(graph.manifests) if keys is None else keys
+    ok_roots = []
+    for key in roots:
+        try:
+            graph.order([key])
+            ok_roots.append(key)
+        except ImportCycleError as e:
+            results[key] = ("failed", 0.0, str(e))
+    pending = [key for key in graph.order(ok_roots) if key not in in_place]
+    load_order = list(pending)
+
+    def _timed_load(key):
+        manifest, cratevars = graph.manifests[key]
+        start = time.time()
+        try:
+            bulker_load(manifest, cratevars, bcfg, graph=graph,
+                        write_config=False, relink=False, **load_kwargs)
+        except Exception as e:
+            _LOGGER.debug("Error loading {}".format(key), exc_info=True)
+            return "failed", time.time() - start, str(e)
+        return "ok", time.time() - start, ""
+
+    futures = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        while pending or futures:
+            for key in [k for k in pending if all(d in results for d in graph.imports[k])]:
+                pending.remove(key)
+                bad_imports = [d for d in graph.imports[key] if results[d][0] != "ok"]
+                if key in graph.failed:
+                    results[key] = ("failed", 0.0, graph.failed[key])
+                elif bad_imports:
+                    results[key] = ("skipped", 0.0,
+                                    "import not loaded: {}".format(", ".join(bad_imports)))
+                else:
+                    futures[executor.submit(_timed_load, key)] = key
+            if futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[futures.pop(future)] = future.result()
+    ordered_results = {key: results[key] for key in load_order}
+    ordered_results.update((k, r) for k, r in results.items() if k not in in_place)
+    relink_dependents(bcfg, [k for k, r in ordered_results.items() if r[0] == "ok"],
+                      exclude=ordered_results)
+    return ordered_results
+
+
+def report_load_results(results):
+    """
+    Prints a table of crate load results, as returned by load_import_graph.
+
+    :param dict results: crate key -> (status, seconds, details)
+    :return int: number of crates that were not loaded
+    """
+    width = max([len("Crate")] + [len(key) for key in results])
+    fmt = "{:<" + str(width) + "}  {:<7}  {:>7}  {}"
+    print(fmt.format("Crate", "Status", "Time", "Details"))
+    for key, (status, seconds, details) in results.items():
+        print(fmt.format(key, status, "{:.2f}s".format(seconds), details).rstrip())
+    failures = len([r for r in results.values() if r[0] != "ok"])
+    _LOGGER.info("Loaded {} of {} crates.".format(len(results) - failures, len(results)))
+    return failures
+
+
+def bulker_inspect_args(bcfg, manifest):
+    """
+    Prints the host/tool args (see 'tool_args') each of a manifest's commands
+    gets in this config.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param yacman.YAMLConfigManager manifest: the crate's manifest
+    """
+    hosttool_arg_key = "{engine}_args".format(engine=bcfg["bulker"]["container_engine"])
+    tool_args = ToolArgs(bcfg)
+    rows = []
+    for pkg in manifest["manifest"].get("commands") or []:
+        exclude_vols = tool_args.get(pkg["docker_image"], "exclude_volumes")
+        rows.append((pkg["command"], pkg["docker_image"],
+                     tool_args.get(pkg["docker_image"], hosttool_arg_key) or "-",
+                     ", ".join(exclude_vols) if exclude_vols else "-"))
+    header = ("Command", "Image", hosttool_arg_key, "exclude_volumes")
+    widths = [max(len(row[i]) for row in rows + [header]) for i in range(3)]
+    fmt = "  ".join("{:<" + str(w) + "}" for w in widths) + "  {}"
+    for row in [header] + rows:
+        print(fmt.format(*row))
+
+
+def bulker_reload(bcfg, offline=False, jobs=DEFAULT_LOAD_JOBS, write_config=True):
+    """
+    Reloads all previously loaded crates in the bulker config.
+
+    Every loaded crate and everything it imports is fetched once, then the
+    crates are rebuilt concurrently in import order, and the config is
+    written once at the end.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param bool offline: only use cached manifests
+    :param int jobs: maximum number of crates to fetch or load at the same time
+    :param bool write_config: write the updated config file when done?
+    :return dict: crate key -> (status, seconds, details)
+    """
+
+    _LOGGER.info("Recursively identifying all loaded manifests...")
+    graph = ImportGraph(bcfg, offline)
+    graph.add_all(["{}/{}:{}".format(namespace, crate, tag)
+                   for namespace, crate, tag, path in loaded_crates(bcfg)], jobs=jobs)
+
+    exe_template_jinja, shell_template_jinja, build_template_jinja = load_templates(bcfg)
+
+    print("Loading identified manifests...")
+    results = load_import_graph(bcfg, graph, jobs=jobs,
+                                exe_jinja2_template=exe_template_jinja,
+                                shell_jinja2_template=shell_template_jinja,
+                                build=build_template_jinja,
+                                force=True,
+                                offline=offline)
+    if write_config:
+        save_crate_registry(bcfg)
+    report_load_results(results)
+    return results
+
+
+def read_crate_list(path):
+    """
+    Read crate registry paths from a file, one or more (comma-separated) per
+    line; blank lines and '#' comments are ignored.
+
+    :param str path: path to the file
+    :return list[str]: registry paths, in file order
+    """
+    registry_paths = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            registry_paths.extend(p.strip() for p in line.split(",") if p.strip())
+    return registry_paths
+
+
+def bulker_load_batch(bcfg, registry_paths, build=False, force=False, recurse=False,
+                      jobs=DEFAULT_LOAD_JOBS, build_jobs=None, offline=False,
+                      write_config=True):
+    """
+    Loads several crates in one go.
+
+    Manifests are fetched concurrently into one import graph, templates are
+    compiled once, crates are loaded concurrently in import order, and the
+    config is written once at the end.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param list[str] registry_paths: registry paths of the crates to load
+    :param bool build: also build/pull the images
+    :param bool force: overwrite already-loaded crates without asking
+    :param bool recurse: also reload all (recursively) imported crates;
+        otherwise only imported crates missing from disk are loaded
+    :param int jobs: maximum number of crates to fetch or load at the same time
+    :param int build_jobs: number of images to build in parallel, per crate
+    :param bool offline: only use cached manifests
+    :param bool write_config: write the updated config file when done?
+    :return dict: crate key -> (status, seconds, details)
+    """
+    graph = ImportGraph(bcfg, offline)
+    keys = list(dict.fromkeys(graph.add_all(registry_paths, jobs=jobs)))
+    registered = {"{}/{}:{}".format(namespace, crate, tag): path
+                  for namespace, crate, tag, path in loaded_crates(bcfg)}
+    existing = [key for key in keys if key in registered]
+    if existing and not force:
+        if not query_yes_no("{} of these crates are already loaded ({}). Overwrite?".format(
+                len(existing), ", ".join(existing))):
+            keys = [key for key in keys if key not in existing]
+    in_place = []
+    if not recurse:
+        try:
+            closure = graph.order(keys)
+        except ImportCycleError:
+            closure = []  # reported per crate by load_import_graph
+        in_place = [key for key in closure if key not in keys and key in registered
+                    and os.path.exists(registered[key])]
+
+    exe_template_jinja, shell_template_jinja, build_template_jinja = load_templates(bcfg, build)
+    results = load_import_graph(bcfg, graph, keys=keys, jobs=jobs, in_place=in_place,
+                                exe_jinja2_template=exe_template_jinja,
+                                shell_jinja2_template=shell_template_jinja,
+                                build=build_template_jinja,
+                                build_jobs=build_jobs,
+                                force=True,
+                                offline=offline)
+    if write_config:
+        save_crate_registry(bcfg)
+    report_load_results(results)
+    return results
+
+
+def bulker_freeze(bcfg, digests=True, jobs=DEFAULT_BUILD_JOBS):
+    """
+    Describes the loaded crates completely enough to rebuild them elsewhere.
+
+    Each crate's manifest is the one it was loaded from, as recorded in its
+    crate index; crates loaded by older versions of bulker, and imports that
+    aren't loaded, are fetched (from the manifest cache if possible).
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param bool digests: ask registries for the digest of each image?
+    :param int jobs: maximum number of registries to query at the same time
+    :return dict: lockfile contents, with crates in import order
+    :raise LockfileError: if a manifest in the import closure is unavailable
+    """
+    graph = ImportGraph(bcfg)
+    known, unrecorded = {}, []
+    for namespace, crate, tag, path in loaded_crates(bcfg):
+        key = "{}/{}:{}".format(namespace, crate, tag)
+        manifest = read_crate_index(path).get("manifest")
+        if manifest:
+            known[key] = (yacman.YAMLConfigManager.from_obj(manifest),
+                          parse_registry_path(key))
+        else:
+            _LOGGER.warning("No recorded manifest for '{}'; using the registry's. "
+                            "Reload it to record the manifest.".format(key))
+            unrecorded.append(key)
+    graph.add_known(known)
+    graph.add_all(unrecorded)
+    if graph.failed:
+        raise LockfileError("Unavailable manifests: {}".format(", ".join(
+            "{} ({})".format(key, reason) for key, reason in graph.failed.items())))
+
+    crates = []
+    for key in graph.order():
+        manifest, _ = graph.manifests[key]
+        crates.append({"crate": key, "imports": graph.imports[key],
+                       "images": sorted({pkg["docker_image"] for pkg in
+                                         manifest["manifest"].get("commands") or []}),
+                       "manifest": manifest.to_dict()})
+    images = sorted({image for crate in crates for image in crate["images"]})
+    image_digests = dict.fromkeys(images)
+    if digests and images:
+        _LOGGER.info("Resolving {} image digests...".format(len(images)))
+        with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+            image_digests = dict(zip(images, executor.map(docker_image_digest, images)))
+        missing = [image for image, digest in image_digests.items() if not digest]
+        if missing:
+            _LOGGER.warning("No digest for {} images: {}".format(
+                len(missing), ", ".join(missing)))
+    for crate in crates:
+        crate["images"] = {image: image_digests[image] for image in crate["images"]}
+    return {"bulker_lock": LOCKFILE_VERSION, "bulker_version": __version__,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "crates": crates}
+
+
+def write_lockfile(lock, path=None):
+    """
+    Write lockfile contents as YAML.
+
+    :param dict lock: lockfile contents, as returned by bulker_freeze
+    :param str path: file to write; stdout if not given
+    """
+    import yaml
+    text = yaml.safe_dump(lock, default_flow_style=False, sort_keys=False)
+    if path:
+        _atomic_write(path, text)
+        _LOGGER.info("Wrote {} crates to lockfile: {}".format(len(lock["crates"]), path))
+    else:
+        sys.stdout.write(text)
+
+
+def read_lockfile(path):
+    """
+    Read a lockfile written by bulker freeze.
+
+    :param str path: path to the lockfile
+    :return dict: crate key -> (manifest, cratevars, images), in import order;
+        images maps each docker image to its frozen digest, or None
+    :raise LockfileError: if the file isn't a lockfile this version can read
+    """
+    import yaml
+    with open(path, "r") as fh:
+        lock = yaml.safe_load(fh)
+    if not isinstance(lock, dict) or "crates" not in lock:
+        raise LockfileError("Not a bulker lockfile: {}".format(path))
+    if lock.get("bulker_lock", 0) > LOCKFILE_VERSION:
+        raise LockfileError("Lockfile {} needs a newer version of bulker".format(path))
+    return {crate["crate"]: (yacman.YAMLConfigManager.from_obj(crate["manifest"]),
+                             parse_registry_path(crate["crate"]),
+                             dict(crate.get("images") or {}))
+            for crate in lock["crates"]}
+
+
+def lockfile_digests(locked):
+    """
+    The frozen image digests of the crates read from a lockfile.
+
+    :param dict locked: crate key -> (manifest, cratevars, images), as
+        returned by read_lockfile
+    :return dict: docker image -> digest, for images frozen with one
+    """
+    return {image: digest for _, _, images in locked.values()
+            for image, digest in images.items() if digest}
+
+
+def bulker_restore(bcfg, lockfile_path, build=False, jobs=DEFAULT_LOAD_JOBS,
+                   build_jobs=None, write_config=True):
+    """
+    Loads the crates recorded in a lockfile, exactly as they were frozen.
+
+    Manifests come from the lockfile only, so the registry isn't contacted.
+    Crates are loaded concurrently in import order, and the config is written
+    once at the end. Images are pinned to their frozen digests only when
+    fetched with bulker_images_prefetch (see lockfile_digests).
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param str lockfile_path: path to a lockfile written by bulker freeze
+    :param bool build: also build/pull the images with each crate
+    :param int jobs: maximum number of crates to load at the same time
+    :param int build_jobs: number of images to build in parallel, per crate
+    :param bool write_config: write the updated config file when done?
+    :return dict: crate key -> (status, seconds, details)
+    """
+    manifests = {key: (manifest, cratevars) for key, (manifest, cratevars, _)
+                 in read_lockfile(lockfile_path).items()}
+    graph = ImportGraph(bcfg, offline=True)
+    graph.add_known(manifests)
+    exe_template_jinja, shell_template_jinja, build_template_jinja = load_templates(bcfg, build)
+    results = load_import_graph(bcfg, graph, keys=list(manifests), jobs=jobs,
+                                exe_jinja2_template=exe_template_jinja,
+                                shell_jinja2_template=shell_template_jinja,
+                                build=build_template_jinja,
+                                build_jobs=build_jobs,
+                                force=True,
+                                offline=True)
+    if write_config:
+        save_crate_registry(bcfg)
+    report_load_results(results)
+    return results
+
+
+def bulker_load(manifest, cratevars, bcfg, exe_jinja2_template,
+                shell_jinja2_template, crate_path=None, 
+                build=False, force=False, recurse=False, build_jobs=None,
+                offline=False, graph=None, write_config=True, relink=True):
+    """
+    Builds a crate from a manifest and registers it in the bulker config.
+
+    :param yacman.YAMLConfigManager manifest: the crate manifest
+    :param dict cratevars: crate metadata returned from parse_registry_path
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param jinja2.Template exe_jinja2_template: executable template
+    :param jinja2.Template shell_jinja2_template: shell template
+    :param str crate_path: destination folder; defaults to the crate's folder
+        under 'default_crate_folder'
+    :param jinja2.Template build: build template, to also build the images
+    :param bool force: overwrite an already-loaded crate without asking
+    :param bool recurse: also reload all (recursively) imported crates;
+        otherwise only imported crates missing from disk are loaded
+    :param int build_jobs: number of images to build in parallel
+    :param bool offline: only use cached manifests
+    :param ImportGraph graph: import graph shared across loads; crates
+        already loaded through it are not loaded again
+    :param bool write_config: write the updated config file when done?
+    :param bool relink: refresh the imported files of other loaded crates
+        that import this one?
+    """
+    with span("load", crate=crate_key(cratevars)):
+        _bulker_load(manifest, cratevars, bcfg, exe_jinja2_template,
+                     shell_jinja2_template, crate_path, build, force, recurse,
+                     build_jobs, offline, graph, write_config, relink)
+
+
+def _bulker_load(manifest, cratevars, bcfg, exe_jinja2_template,
+                 shell_jinja2_template, crate_path, build, force, recurse,
+                 build_jobs, offline, graph, write_config, relink):
+    """ Does the work of bulker_load, inside its profiling span """
+    if graph is None:
+        graph = ImportGraph(bcfg, offline)
+    key = graph.add(manifest=manifest, cratevars=cratevars)
+    load_order = graph.order([key])
+    # We store them in folder: namespace/crate/version
+    default_path = not crate_path
+    if not crate_path:
+        crate_path = crate_folder(bcfg, cratevars)
+    if not os.path.isabs(crate_path):
+        crate_path = os.path.join(os.path.dirname(bcfg.filepath), crate_path)
+
+    _LOGGER.debug("Crate path: {}".format(crate_path))
+    _LOGGER.debug("cratevars: {}".format(cratevars))
+    # Update the config file
+    with _REGISTRY_LOCK:
+        tags = ((bcfg["bulker"]["crates"] or {}).get(cratevars['namespace']) or {}) \
+            .get(cratevars['crate']) or {}
+        already_loaded = str(cratevars['tag']) in tags
+    if already_loaded:
+        _LOGGER.debug(tags)
+        if not (force or query_yes_no("That manifest has already been loaded. Overwrite?")):
+            return
+        _LOGGER.info("Updating executables in: {}".format(crate_path))
+
+
+    # Now make the crate
+
+    # First add any imports
+
+    if recurse:
+        imps_to_load = load_order[:-1]
+    else:
+        imps_to_load = graph.imports[key]
+    for imp in imps_to_load:
+        imp_manifest, imp_cratevars = graph.manifests[imp]
+        if imp in graph.loaded:
+            continue
+        if imp in graph.failed:
+            _LOGGER.error("Unable to load imported crate '{}': {}".format(imp, graph.failed[imp]))
+            continue
+        imp_crate_path = find_crate(bcfg, imp_cratevars) or crate_folder(bcfg, imp_cratevars)
+        if recurse or not os.path.exists(imp_crate_path):
+            if not os.path.exists(imp_crate_path):
+                _LOGGER.error("Nonexistent crate: '{}' from '{}'. Reloading...".format(imp, imp_crate_path))
+            # Recursively load imported crates.
+            _LOGGER.info("Recursively loading imported crate '{}' from '{}'".format(imp, imp_crate_path))
+            _LOGGER.debug(imp_manifest)
+            _LOGGER.debug(imp_cratevars)
+            bulker_load(imp_manifest, imp_cratevars, bcfg, exe_jinja2_template,
+            shell_jinja2_template, crate_path=None, build=build, force=force,
+            recurse=False, build_jobs=build_jobs, offline=offline, graph=graph,
+            write_config=write_config, relink=relink)
+
+    # Everything the crate folder should contain: file name -> entry.
+    # Local commands take precedence over imported ones.
+    entries, imported = import_entries(
+        bcfg, [imp for imp in graph.imports[key] if imp not in graph.failed])
+
+    hosttool_arg_key = "{engine}_args".format(engine=bcfg["bulker"]["container_engine"])
+    base = render_base(bcfg)
+    tool_args = ToolArgs(bcfg)
+
+    cmdlist = []
+    images = {}
+    build_pkgs = []
+    cmd_count = 0
+    if "commands" in manifest["manifest"] and manifest["manifest"]["commands"]:
+        for fields in manifest["manifest"]["commands"]:
+            _LOGGER.debug(fields)
+            # Values computed for this command, over the config, over the
+            # manifest's fields. Writes only touch the first layer.
+            pkg = ChainMap({}, base, fields)
+
+            if pkg["container_engine"] == "singularity" and "singularity_image_folder" in pkg:
+                pkg["singularity_image"] = os.path.basename(pkg["docker_image"])
+                pkg["namespace"] = os.path.dirname(pkg["docker_image"])
+                pkg["singularity_fullpath"] = store_image_path(bcfg, pkg["docker_image"])
+                if not pkg["singularity_fullpath"]:
+                    pkg["singularity_fullpath"] = singularity_image_path(
+                        bcfg, pkg["docker_image"], pkg["singularity_image_folder"])
+                    mkdir(os.path.dirname(pkg["singularity_fullpath"]), exist_ok=True)
+            command = pkg["command"]
+            cmdlist.append(command)
+            images[command] = pkg["docker_image"]
+            if command in imported:
+                _LOGGER.info("Command '{}' overrides the one imported from '{}'".format(
+                    command, imported[command]))
+            imported.pop(command, None)
+            imported.pop("_" + command, None)
+
+            # Add any host-specific tool-specific args
+            hts = tool_args.get(pkg["docker_image"], hosttool_arg_key)
+            exclude_vols = tool_args.get(pkg["docker_image"], "exclude_volumes")
+            _LOGGER.debug("Adding host-tool args: {}".format(hts))
+            if hosttool_arg_key in pkg:
+                pkg[hosttool_arg_key] = pkg[hosttool_arg_key] + " " + hts
+            else:
+                pkg[hosttool_arg_key] = hts
+
+            # Remove any excluded volumes from the package
+            if len(exclude_vols) > 0:
+                _LOGGER.debug("Excluding volumes: {}".format(exclude_vols))
+                pkg["volumes"] = [v for v in pkg["volumes"] if v not in exclude_vols]
+            else:
+                _LOGGER.debug("No excluded volumes")
+
+            if warm_capable(pkg):
+                pkg["warm_name"] = warm_container_name(pkg)
+                pkg["warm_exec_args"] = " ".join(
+                    arg for arg in docker_arg_list(pkg) if arg in WARM_EXEC_FLAGS)
+
+            entries[command] = {"kind": "render", "template": exe_jinja2_template, "pkg": pkg}
+            # shell commands
+            entries["_" + command] = {"kind": "render", "template": shell_jinja2_template,
+                                      "pkg": pkg}
+
+            if build:
+                build_pkgs.append(pkg)
+
+    # host commands
+    host_cmdlist = []
+    if "host_commands" in manifest["manifest"] and manifest["manifest"]["host_commands"]:
+        _LOGGER.info("Populating host commands")
+        for cmd in manifest["manifest"]["host_commands"]:
+            _LOGGER.debug(cmd)
+            if not is_command_callable(cmd):
+                _LOGGER.warning("Requested host command is not callable and "
+                "therefore not created: '{}'".format(cmd))
+                continue
+            host_cmdlist.append(cmd)
+            entries[cmd] = {"kind": "link", "target": which(cmd)}
+            imported.pop(cmd, None)
+
+    cmd_count = len(cmdlist)
+    host_cmd_count = len(host_cmdlist)
+    if cmd_count < 1 and host_cmd_count < 1:
+        _LOGGER.error("No commands provided. Crate not created.")
+        raise BulkerError("No commands provided. Crate not created.")
+
+    index = {"crate": key, "imports": graph.imports[key], "commands": images,
+             "host_commands": host_cmdlist, "imported": imported,
+             "manifest": manifest.to_dict()}
+    store_path = None
+    if default_path and not already_loaded:
+        store_path = store_crates(bcfg).get(key)
+    if store_path and crate_folder_matches(store_path, entries):
+        # Nothing to build: use the crate store's copy instead of our own
+        _LOGGER.info("Using identical crate from crate store: {}".format(store_path))
+    else:
+        # Build the new crate beside the live one and swap it in, so commands
+        # on a PATH never see a half-built crate.
+        staging_path = stage_crate_folder(crate_path)
+        try:
+            unchanged, updated, removed = sync_crate_folder(staging_path, entries, index)
+        except BaseException:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            raise
+        with span("crate swap", crate=key):
+            swap_crate_folder(crate_path, staging_path)
+        # Only registered once its folder is in place, so a failed load
+        # leaves the registry as it was
+        register_crate(bcfg, cratevars, crate_path)
+        _LOGGER.info("Crate files: {} unchanged, {} updated, {} removed.".format(
+            unchanged, updated, removed))
+    record_image_folder_user(bcfg)
+
+    if build_pkgs:
+        if not build_jobs:
+            build_jobs = bcfg["bulker"]["build_jobs"] if "build_jobs" in bcfg["bulker"] \
+                else DEFAULT_BUILD_JOBS
+        build_images(build, build_pkgs, jobs=build_jobs)
+
+    rp = "{namespace}/{crate}:{tag}".format(
+        namespace=cratevars['namespace'],
+        crate=cratevars['crate'],
+        tag=cratevars['tag'])
+
+    _LOGGER.info("Loading manifest: '{rp}'."
+                " Activate with 'bulker activate {rp}'.".format(rp=rp))
+    if cmd_count > 0:
+        _LOGGER.info("Commands available: {}".format(", ".join(cmdlist)))
+    if host_cmd_count > 0:
+        _LOGGER.info("Host commands available: {}".format(", ".join(host_cmdlist)))
+
+
+    graph.loaded.add(key)
+    if relink:
+        relink_dependents(bcfg, [key], exclude=graph.loaded)
+    if write_config:
+        save_crate_registry(bcfg)
+
+def docker_arg_list(pkg):
+    """ Split the extra docker arguments of a package into a list """
+    return " ".join(pkg.get(key) or "" for key in ["dockerargs", "docker_args"]).split()
+
+
+def warm_capable(pkg):
+    """
+    Can a command be dispatched into a warm container with `docker exec`?
+    Not if the manifest opts out with 'no_warm', or if the image relies on its
+    own entrypoint (a blank 'docker_command', or an --entrypoint argument),
+    which exec would bypass.
+
+    :param dict pkg: rendered package settings for one command
+    :return bool: whether the command may use warm mode
+    """
+    if pkg.get("no_warm"):
+        return False
+    if pkg.get("docker_command") is not None and not str(pkg["docker_command"]).strip():
+        return False
+    return not any(arg.startswith("--entrypoint") for arg in docker_arg_list(pkg))
+
+
+def warm_container_name(pkg):
+    """
+    Name of the warm container a command can share with others: commands on
+    the same image with the same container settings share one.
+
+    :param dict pkg: rendered package settings for one command
+    :return str: warm container name, unique per image and settings
+    """
+    settings = json.dumps([pkg.get(key) for key in WARM_CONTAINER_KEYS],
+                          default=list)
+    image = "".join(c if c.isalnum() or c in "_.-" else "_"
+                    for c in pkg["docker_image"])
+    return "{}-{}".format(image, hashlib.sha1(settings.encode()).hexdigest()[:8])
+
+
+def render_base(bcfg):
+    """
+    The config values every command's render context shares.
+
+    Copied once per crate rather than merged into each command, and without
+    the crate registry, so rendering cost doesn't grow with the number of
+    crates loaded.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return Mapping: read-only view of the 'bulker' config section, less
+        'crates', with 'telemetry_log' resolved to a path (or None)
+    """
+    with _REGISTRY_LOCK:
+        base = {key: copy.deepcopy(value) for key, value in bcfg["bulker"].items()
+                if key != "crates"}
+    # Executables only log calls when telemetry is on (see bulker_stats)
+    base["telemetry_log"] = telemetry_log_path(bcfg) if base.get("telemetry") else None
+    base.setdefault("telemetry_max_kb", DEFAULT_TELEMETRY_MAX_KB)
+    return MappingProxyType(base)
+
+
+def _is_pattern(key):
+    return any(c in str(key) for c in "*?[")
+
+
+class ToolArgs(object):
+    """
+    The 'tool_args' section of a bulker config, compiled for lookups by image.
+
+    Namespace, image, and tag keys may be shell-style patterns, like
+    'bioconductor_*' or '*'. Exact keys win over patterns, and patterns are
+    tried in the order they appear in the config. An image's settings are its
+    'default' settings updated with those of its tag. Lookups are cached, so
+    each distinct image is resolved once.
+    """
+    def __init__(self, bcfg):
+        self.exact = {}  # (namespace, image) -> tag table
+        self.patterns = []  # (namespace pattern, image pattern, tag table)
+        self._resolved = {}
+        tool_args = bcfg["bulker"].get("tool_args") or {}
+        with _REGISTRY_LOCK:
+            for namespace, images in tool_args.items():
+                for image, tags in (images or {}).items():
+                    tags = self._compile_tags(tags or {})
+                    if _is_pattern(namespace) or _is_pattern(image):
+                        self.patterns.append((str(namespace), str(image), tags))
+                    else:
+                        self.exact[(str(namespace), str(image))] = tags
+
+    @staticmethod
+    def _compile_tags(tags):
+        exact, patterns = {}, []
+        for tag, settings in tags.items():
+            settings = copy.deepcopy(dict(settings or {}))
+            if _is_pattern(tag):
+                patterns.append((str(tag), settings))
+            else:
+                exact[str(tag)] = settings
+        return exact, patterns
+
+    def _tag_table(self, namespace, image):
+        if (namespace, image) in self.exact:
+            return self.exact[(namespace, image)]
+        for namespace_pattern, image_pattern, tags in self.patterns:
+            if fnmatchcase(namespace, namespace_pattern) and \
+                    fnmatchcase(image, image_pattern):
+                return tags
+        return None
+
+    def resolve(self, docker_image):
+        """
+        Get the settings that apply to an image.
+
+        :param str docker_image: the image, e.g. 'nsheff/cowsay:latest'
+        :return dict: settings, e.g. 'docker_args' and 'exclude_volumes';
+            empty if none apply
+        """
+        if docker_image not in self._resolved:
+            # Here we're parsing the *image*, not the crate registry path.
+            imvars = parse_registry_path_image(docker_image)
+            settings = {}
+            table = imvars and self._tag_table(imvars["namespace"], imvars["image"])
+            if table:
+                exact, patterns = table
+                settings.update(exact.get("default", {}))
+                tag = str(imvars["tag"])
+                if tag != "default":
+                    if tag in exact:
+                        settings.update(exact[tag])
+                    else:
+                        settings.update(next((s for p, s in patterns
+                                              if fnmatchcase(tag, p)), {}))
+            _LOGGER.debug("Tool args for '{}': {}".format(docker_image, settings))
+            self._resolved[docker_image] = settings
+        return self._resolved[docker_image]
+
+    def get(self, docker_image, key):
+        """
+        Look up one host-specific setting for an image.
+
+        :param str docker_image: the image, e.g. 'nsheff/cowsay:latest'
+        :param str key: setting to look up, e.g. 'docker_args'
+        :return str|list: the setting, or "" if there isn't one
+        """
+        return self.resolve(docker_image).get(key, "")
+
+
+def crate_folder(bcfg, cratevars):
+    """
+    Get the default folder for a crate, under 'default_crate_folder'.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param dict cratevars: dict with crate metadata returned from parse_registry_path
+    :return str: absolute path to the crate folder
+    """
+    path = os.path.join(bcfg["bulker"]["default_crate_folder"],
+                        cratevars['namespace'],
+                        cratevars['crate'],
+                        cratevars['tag'])
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(bcfg.filepath), path)
+    return path
+
+
+def read_crate_store(store_path):
+    """
+    Read a crate store: another bulker config, typically a site-wide one,
+    whose loaded crates are available read-only to configs that list it
+    under 'crate_stores'. Stores are re-read only when they change.
+
+    :param str store_path: absolute path to the store's bulker config
+    :return dict: with 'crates' (crate key -> crate folder),
+        'singularity_image_folder' (None for docker stores), and 'watch'
+        (path -> modification time of the files the store was read from);
+        None if the store can't be read
+    """
+    try:
+        mtime = os.stat(store_path).st_mtime_ns
+        store = _CRATE_STORES.get(store_path)
+        if store and all(os.stat(path).st_mtime_ns == watched
+                         for path, watched in store["watch"].items()):
+            return store
+    except OSError as e:
+        _LOGGER.warning("Crate store unavailable: {}".format(e))
+        return None
+    store_cfg = yacman.YAMLConfigManager.from_yaml_file(store_path)
+    store = {"watch": {store_path: mtime}, "singularity_image_folder": None}
+    if store_cfg["bulker"].get("crate_registry"):
+        # Opened read-only. Its registry index is rewritten on every change.
+        db_path = mkabs(store_cfg["bulker"]["crate_registry"], os.path.dirname(store_path))
+        index_path = runtime.registry_index_path(store_path)
+        try:
+            store["watch"][index_path] = os.stat(index_path).st_mtime_ns
+            registry = CrateRegistry(db_path, readonly=True)
+            store_cfg["bulker"]["crates"] = registry.crates()
+            registry.db.close()
+        except (OSError, sqlite3.Error) as e:
+            _LOGGER.warning("Crate store unavailable: {}".format(e))
+            return None
+    store["crates"] = {"{}/{}:{}".format(namespace, crate, tag): path
+                       for namespace, crate, tag, path in loaded_crates(store_cfg)}
+    if store_cfg["bulker"].get("container_engine") == "singularity":
+        store["singularity_image_folder"] = mkabs(
+            store_cfg["bulker"]["singularity_image_folder"], os.path.dirname(store_path))
+    _CRATE_STORES[store_path] = store
+    return store
+
+
+def crate_stores(bcfg):
+    """
+    The crate stores a config lists under 'crate_stores', in priority order.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return dict: store config path -> store, as returned by read_crate_store
+    """
+    stores = {}
+    for store_path in bcfg["bulker"].get("crate_stores") or []:
+        store_path = mkabs(store_path, os.path.dirname(bcfg.filepath))
+        store = read_crate_store(store_path)
+        if store:
+            stores[store_path] = store
+    return stores
+
+
+def store_crates(bcfg):
+    """
+    Crates available from a config's crate stores. Where several stores have
+    the same crate, the one listed first wins.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return dict: crate key -> crate folder
+    """
+    crates = {}
+    for store in reversed(list(crate_stores(bcfg).values())):
+        crates.update(store["crates"])
+    return crates
+
+
+def find_crate(bcfg, cratevars):
+    """
+    Find a crate's folder, in the config's own crates first and then in its
+    crate stores.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param dict cratevars: dict with crate metadata returned from parse_registry_path
+    :return str: path to the crate folder, or None if the crate isn't loaded
+    """
+    try:
+        return bcfg["bulker"]["crates"][cratevars["namespace"]][cratevars["crate"]][str(cratevars["tag"])]
+    except (KeyError, TypeError):
+        return store_crates(bcfg).get(crate_key(cratevars))
+
+
+def store_image_path(bcfg, docker_image):
+    """
+    Find a singularity image that one of the config's crate stores already has.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param str docker_image: docker image, e.g. 'nsheff/cowsay:latest'
+    :return str: path to the image file, or None if no store has it
+    """
+    for store in crate_stores(bcfg).values():
+        if store["singularity_image_folder"]:
+            path = os.path.join(store["singularity_image_folder"],
+                                os.path.dirname(docker_image),
+                                os.path.basename(docker_image))
+            if os.path.isfile(path):
+                return path
+    return None
+
+
+def crate_folder_matches(crate_path, entries):
+    """
+    Does a crate folder hold exactly the files the given entries would make?
+
+    :param str crate_path: path to a crate folder
+    :param dict entries: file name -> entry dict, as for sync_crate_folder
+    :return bool: whether building the entries there would change nothing
+    """
+    try:
+        names = {name for name in os.listdir(crate_path) if not name.startswith(".")}
+    except OSError:
+        return False
+    if names != set(entries):
+        return False
+    for name, entry in entries.items():
+        path = os.path.join(crate_path, name)
+        if entry["kind"] == "link":
+            if not os.path.islink(path) or os.readlink(path) != entry["target"]:
+                return False
+            continue
+        if entry["kind"] == "render":
+            # Keep the text; if the crate is built after all, it's written as is
+            entry["text"] = entry["template"].render(pkg=entry["pkg"])
+            expected = entry["text"].encode("utf-8")
+        elif entry["kind"] == "copy":
+            with open(entry["source"], "rb") as fh:
+                expected = fh.read()
+        else:
+            return False
+        try:
+            with open(path, "rb") as fh:
+                if fh.read() != expected:
+                    return False
+        except OSError:
+            return False
+    return True
+
+
+def import_entries(bcfg, imports):
+    """
+    Get the crate folder entries that bring in the commands of imported crates.
+
+    Depending on 'import_mode', imported files are symlinked (the default)
+    or copied. When several imports provide the same command, the one
+    listed later wins.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param list imports: crate keys of the imported crates, in manifest order
+    :return tuple: file name -> entry dict, and file name -> crate key it
+        was imported from
+    """
+    mode = bcfg["bulker"]["import_mode"] if "import_mode" in bcfg["bulker"] \
+        else DEFAULT_IMPORT_MODE
+    entries = {}
+    imported = {}
+    for imp in imports:
+        imp_cratevars = parse_registry_path(imp)
+        imp_crate_path = find_crate(bcfg, imp_cratevars) or crate_folder(bcfg, imp_cratevars)
+        if not os.path.isdir(imp_crate_path):
+            _LOGGER.error("Imported crate '{}' not found at '{}'".format(imp, imp_crate_path))
+            continue
+        _LOGGER.info("Importing crate '{}' from '{}'.".format(imp, imp_crate_path))
+        for name in sorted(os.listdir(imp_crate_path)):
+            if name.startswith("."):
+                continue
+            if name in imported:
+                _LOGGER.debug("'{}' from '{}' overrides the one from '{}'".format(
+                    name, imp, imported[name]))
+            source = os.path.join(imp_crate_path, name)
+            if mode == "copy":
+                entries[name] = {"kind": "copy", "source": source}
+            else:
+                entries[name] = {"kind": "link", "target": source}
+            imported[name] = imp
+    return entries, imported
+
+
+def relink_dependents(bcfg, keys, exclude=()):
+    """
+    Refresh the imported files of loaded crates that import the given crates.
+
+    This picks up commands added to or removed from a re-imported crate
+    without reloading the crates that import it. Changes cascade to crates
+    that import those, in turn.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param list keys: crate keys of crates that have changed
+    :param exclude: crate keys of crates to leave alone
+    """
+    pending = list(keys)
+    done = set(exclude) | set(keys)
+    while pending:
+        changed = pending.pop(0)
+        for namespace, crate, tag, path in list(loaded_crates(bcfg)):
+            dep_key = "{}/{}:{}".format(namespace, crate, tag)
+            if dep_key in done:
+                continue
+            path = mkabs(path, os.path.dirname(bcfg.filepath))
+            index = read_crate_index(path)
+            if changed not in index.get("imports", []):
+                continue
+            done.add(dep_key)
+            entries, imported = import_entries(bcfg, index["imports"])
+            previously_imported = index.get("imported", {})
+            for name, file_key in index.get("files", {}).items():
+                if name not in previously_imported:
+                    entries[name] = {"kind": "keep", "key": file_key}
+                    imported.pop(name, None)
+            index["imported"] = imported
+            staging_path = stage_crate_folder(path)
+            try:
+                unchanged, updated, removed = sync_crate_folder(staging_path, entries, index)
+            except BaseException:
+                shutil.rmtree(staging_path, ignore_errors=True)
+                raise
+            if not (updated or removed):
+                shutil.rmtree(staging_path)
+                continue
+            swap_crate_folder(path, staging_path)
+            _LOGGER.info("Refreshed imports of '{}': {} updated, {} removed.".format(
+                dep_key, updated, removed))
+            pending.append(dep_key)
+
+
+def crate_generations(crate_path):
+    """
+    List the generation folders of a crate, oldest first.
+
+    A loaded crate folder is a symlink to the current generation, a sibling
+    folder named .<name>.<generation>.
+
+    :param str crate_path: path to the crate folder (the symlink)
+    :return list: paths to the crate's generation folders
+    """
+    parent, name = os.path.split(crate_path)
+    prefix = ".{}.".format(name)
+    if not os.path.isdir(parent):
+        return []
+    # Other dot folders beside the crate, like '.default.backup', aren't ours
+    generations = [os.path.join(parent, f) for f in os.listdir(parent)
+                   if f.startswith(prefix) and re.fullmatch("[0-9a-f]+", f[len(prefix):])]
+    return sorted(generations, key=lambda path: int(path.rsplit(".", 1)[1], 16))
+
+
+def _new_generation_path(crate_path):
+    parent, name = os.path.split(crate_path)
+    return os.path.join(parent, ".{}.{:x}".format(name, time.time_ns()))
+
+
+def stage_crate_folder(crate_path):
+    """
+    Create a new generation folder for a crate, seeded with the current files.
+
+    Current files are hard-linked rather than copied; files are only ever
+    replaced (never modified in place), so the live generation isn't touched.
+
+    :param str crate_path: path to the crate folder
+    :return str: path to the new, staged generation folder
+    """
+    staging_path = _new_generation_path(crate_path)
+    mkdir(staging_path, exist_ok=False)
+    if os.path.isdir(crate_path):
+        current = os.path.realpath(crate_path)
+        for name in os.listdir(current):
+            source = os.path.join(current, name)
+            dest = os.path.join(staging_path, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), dest)
+            elif os.path.isdir(source):
+                copytree(source, dest, symlinks=True)
+            else:
+                try:
+                    os.link(source, dest)
+                except OSError:
+                    shutil.copy2(source, dest)
+    return staging_path
+
+
+def swap_crate_folder(crate_path, staging_path):
+    """
+    Atomically point a crate folder at a staged generation.
+
+    The generation that was live until now is kept, in case running
+    commands are still reading from it; older ones are removed.
+
+    :param str crate_path: path to the crate folder
+    :param str staging_path: generation folder to make live
+    """
+    if os.path.isdir(crate_path) and not os.path.islink(crate_path):
+        # A crate from before generations existed: move it aside first
+        os.rename(crate_path, _new_generation_path(crate_path))
+    previous = os.path.realpath(crate_path) if os.path.islink(crate_path) else None
+    tmp_link = "{}.tmp{}.{}".format(crate_path, os.getpid(), threading.get_ident())
+    os.symlink(os.path.basename(staging_path), tmp_link)
+    os.replace(tmp_link, crate_path)
+    keep = {os.path.realpath(staging_path), previous}
+    for generation in crate_generations(crate_path):
+        if os.path.realpath(generation) not in keep:
+            _LOGGER.debug("Removing old crate generation: {}".format(generation))
+            shutil.rmtree(generation, ignore_errors=True)
+
+
+def remove_crate_folder(crate_path):
+    """
+    Remove a crate folder, including all of its generations.
+
+    :param str crate_path: path to the crate folder
+    """
+    if os.path.islink(crate_path):
+        for generation in crate_generations(crate_path):
+            shutil.rmtree(generation)
+        os.unlink(crate_path)
+    else:
+        shutil.rmtree(crate_path)
+
+
+def trash_folder(bcfg):
+    """
+    Get the folder unloaded crates are moved to until 'bulker gc' removes them.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return str: absolute path to the trash folder, in 'default_crate_folder'
+    """
+    path = os.path.join(bcfg["bulker"]["default_crate_folder"], TRASH_SUBDIR)
+    if not os.path.isabs(path):
+        path = os.path.join(os.path.dirname(bcfg.filepath), path)
+    return path
+
+
+def trash_crate_folder(bcfg, crate_path):
+    """
+    Move a crate folder, with all of its generations, into the trash.
+
+    Renames are instant even for large crates on network file systems. A
+    crate on another file system than the trash is removed right away.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param str crate_path: path to the crate folder
+    """
+    trash = os.path.join(trash_folder(bcfg), "{}.{:x}".format(
+        os.path.basename(crate_path), time.time_ns()))
+    try:
+        mkdir(trash, exist_ok=False)
+        if os.path.islink(crate_path):
+            generations = crate_generations(crate_path)
+            os.unlink(crate_path)
+        else:
+            generations = [crate_path]
+        for generation in generations:
+            os.rename(generation, os.path.join(trash, os.path.basename(generation)))
+    except OSError as e:
+        _LOGGER.debug("Couldn't move crate to the trash ({}); removing it".format(e))
+        shutil.rmtree(trash, ignore_errors=True)
+        if os.path.lexists(crate_path):
+            remove_crate_folder(crate_path)
+        else:
+            for generation in crate_generations(crate_path):
+                shutil.rmtree(generation)
+
+
+def empty_trash(trash, dry_run=False):
+    """
+    Remove the unloaded crates in a trash folder.
+
+    :param str trash: path to the trash folder
+    :param bool dry_run: only report what would be removed
+    :return tuple: number of crates removed, and bytes reclaimed; crates that
+        couldn't be removed are logged and not counted
+    """
+    removed, reclaimed = 0, 0
+    if not os.path.isdir(trash):
+        return removed, reclaimed
+    for name in sorted(os.listdir(trash)):
+        path = os.path.join(trash, name)
+        size = 0
+        for folder, _, files in os.walk(path):
+            for f in files:
+                try:
+                    size += os.lstat(os.path.join(folder, f)).st_size
+                except OSError:
+                    pass
+        _LOGGER.debug("{}Removing unloaded crate: {}".format(
+            "(dry run) " if dry_run else "", path))
+        if not dry_run:
+            shutil.rmtree(path, ignore_errors=True)
+            if os.path.lexists(path):
+                _LOGGER.warning("Couldn't remove unloaded crate: {}".format(path))
+                continue
+        removed += 1
+        reclaimed += size
+    return removed, reclaimed
+
+
+def bulker_gc(bcfg, dry_run=False):
+    """
+    Reclaim the disk space of unloaded crates, by emptying the trash.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param bool dry_run: only report what would be removed
+    :return tuple: number of crates removed, and bytes reclaimed
+    """
+    removed, reclaimed = empty_trash(trash_folder(bcfg), dry_run)
+    _LOGGER.info("{} {} unloaded crates, {}.".format(
+        "Would remove" if dry_run else "Removed", removed, _format_size(reclaimed)))
+    return removed, reclaimed
+
+
+def start_background_gc(bcfg):
+    """
+    Empty the trash in a detached process, which outlives this one.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    """
+    gc = "import sys; from bulker.bulker import empty_trash; empty_trash(sys.argv[1])"
+    subprocess.Popen([sys.executable, "-c", gc, trash_folder(bcfg)],
+                     start_new_session=True, stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def read_crate_index(crate_path):
+    """
+    Read the index bulker keeps in a crate folder.
+
+    :param str crate_path: path to a crate folder
+    :return dict: the crate index; empty if there is none
+    """
+    try:
+        with open(os.path.join(crate_path, CRATE_INDEX_FILENAME)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def _entry_key(entry):
+    """ Content key of a crate folder entry; equal keys mean equal files """
+    if entry["kind"] == "keep":
+        return entry["key"]
+    if entry["kind"] == "link":
+        return "link:" + entry["target"]
+    if entry["kind"] == "copy":
+        if os.path.islink(entry["source"]):
+            return "link:" + os.readlink(entry["source"])
+        with open(entry["source"], "rb") as fh:
+            return "copy:" + hashlib.sha256(fh.read()).hexdigest()
+    template_hash = getattr(entry["template"], "bulker_hash", None)
+    if not template_hash:
+        # Without a known template source, key on the rendered text
+        with span("render", command=entry["pkg"].get("command")):
+            entry["text"] = entry["template"].render(pkg=entry["pkg"])
+        return "text:" + hashlib.sha256(entry["text"].encode("utf-8")).hexdigest()
+    pkg = {k: v for k, v in entry["pkg"].items() if k != "crates"}
+    pkg_json = json.dumps(pkg, sort_keys=True, default=str)
+    return "render:" + hashlib.sha256(
+        (template_hash + pkg_json).encode("utf-8")).hexdigest()
+
+
+def _write_entry(path, entry):
+    """ Atomically replace a crate folder file with the given entry """
+    tmp_path = "{}.tmp{}.{}".format(path, os.getpid(), threading.get_ident())
+    if entry["kind"] == "copy" and os.path.islink(entry["source"]):
+        entry = {"kind": "link", "target": os.readlink(entry["source"])}
+    if entry["kind"] == "link":
+        os.symlink(entry["target"], tmp_path)
+    elif entry["kind"] == "copy":
+        shutil.copy2(entry["source"], tmp_path)
+    else:
+        text = entry.get("text")
+        if text is None:
+            with span("render", command=os.path.basename(path)):
+                text = entry["template"].render(pkg=entry["pkg"])
+        with open(tmp_path, "w") as fh:
+            fh.write(text)
+        os.chmod(tmp_path, 0o755)
+    os.replace(tmp_path, path)
+
+
+def sync_crate_folder(crate_path, entries, index=None):
+    """
+    Make a crate folder match the desired set of files, touching only what changed.
+
+    Each entry's content key is compared with the key recorded in the crate
+    index by the previous load; only new or changed files are written, and
+    files no longer wanted are removed.
+
+    :param str crate_path: path to the crate folder
+    :param dict entries: file name -> entry dict, with 'kind' one of
+        'render' (with 'template' and 'pkg'), 'copy' (with 'source'),
+        'link' (with 'target'), or 'keep' (with the recorded 'key')
+    :param dict index: additional data to record in the crate index
+    :return tuple: number of files unchanged, updated, and removed
+    """
+    mkdir(crate_path, exist_ok=True)
+    previous = read_crate_index(crate_path).get("files", {})
+    keys = {}
+    unchanged = updated = removed = 0
+    for name, entry in entries.items():
+        path = os.path.join(crate_path, name)
+        keys[name] = _entry_key(entry)
+        if previous.get(name) == keys[name] and os.path.lexists(path):
+            unchanged += 1
+            continue
+        if entry["kind"] == "keep":
+            # Nothing to rebuild a lost file from; the next load restores it
+            del keys[name]
+            continue
+        _LOGGER.debug("Writing {}".format(path))
+        with span("file write", file=name):
+            _write_entry(path, entry)
+        updated += 1
+    for name in os.listdir(crate_path):
+        if name not in entries and name != CRATE_INDEX_FILENAME:
+            path = os.path.join(crate_path, name)
+            _LOGGER.debug("Removing {}".format(path))
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            removed += 1
+    index = dict(index or {})
+    index["files"] = keys
+    _atomic_write(os.path.join(crate_path, CRATE_INDEX_FILENAME),
+                  json.dumps(index, indent=1, sort_keys=True))
+    return unchanged, updated, removed
+
+
+def build_images(build_template, pkgs, jobs=DEFAULT_BUILD_JOBS):
+    """
+    Builds (or pulls) the container images for a set of commands in parallel.
+
+    Commands that share an image are only built once.
+
+    :param jinja2.Template build_template: template that renders a build script
+        for a command
+    :param list pkgs: populated command dicts, as passed to the templates
+    :param int jobs: maximum number of images to build at the same time
+    :return list: images that failed to build
+    """
+    images = {}
+    for pkg in pkgs:
+        images.setdefault(pkg["docker_image"], pkg)
+    total = len(images)
+    jobs = max(1, min(int(jobs), total))
+    _LOGGER.info("Building {} images ({} at a time)...".format(total, jobs))
+
+    def _build(pkg):
+        buildscript = build_template.render(pkg=pkg)
+        _LOGGER.info("Building image: {}".format(pkg["docker_image"]))
+        with span("image build", image=pkg["docker_image"]):
+            proc = subprocess.run(buildscript, shell=True, stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT)
+        return buildscript, proc.returncode, proc.stdout.decode(errors="replace")
+
+    failures = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(_build, pkg): image for image, pkg in images.items()}
+        for done, future in enumerate(as_completed(futures), 1):
+            image = futures[future]
+            try:
+                buildscript, returncode, output = future.result()
+            except Exception as e:
+                buildscript, returncode, output = None, None, str(e)
+            if returncode == 0:
+                pkg = images[image]
+                if pkg["container_engine"] == "singularity":
+                    where = "available at: {}".format(pkg["singularity_fullpath"])
+                else:
+                    where = "available as: {}".format(image)
+                _LOGGER.info("[{}/{}] Image {}".format(done, total, where))
+            else:
+                _LOGGER.info("[{}/{}] Failed to build image: {}".format(done, total, image))
+                failures.append((image, buildscript, output))
+
+    _LOGGER.info("Built {} of {} images.".format(total - len(failures), total))
+    for image, buildscript, output in failures:
+        _LOGGER.error("------ Error building '{}'. Build script used: ------".format(image))
+        _LOGGER.error(buildscript)
+        _LOGGER.error("------ Build output: ------")
+        _LOGGER.error(output.strip())
+        _LOGGER.error("------------------------------------------------")
+    return [image for image, _, _ in failures]
+
+
+def singularity_image_path(bcfg, docker_image, image_folder=None):
+    """
+    Local path of the singularity image file for a docker image.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param str docker_image: docker image, e.g. 'nsheff/cowsay:latest'
+    :param str image_folder: singularity image folder; defaults to the config's
+        'singularity_image_folder'. Relative paths are relative to the config.
+    :return str: absolute path to the image file
+    """
+    image_folder = image_folder or bcfg["bulker"]["singularity_image_folder"]
+    return os.path.join(mkabs(image_folder, os.path.dirname(bcfg.filepath)),
+                        os.path.dirname(docker_image),
+                        os.path.basename(docker_image))
 
 
-def _attend_process( proc, sleeptime):
+def docker_image_digest(docker_image, timeout=10):
     """
-    Waits on a process for a given time to see if it finishes, returns True
-    if it's still running after the given time or False as soon as it 
-    returns.
+    Ask an image's registry for the digest of its manifest, so the same image
+    under different names or tags can be recognized before pulling it.
 
-    :param psutil.Popen proc: Process object opened by psutil.Popen()
-    :param float sleeptime: Time to wait
-    :return bool: True if process is still running; otherwise false
+    :param str docker_image: docker image, e.g. 'nsheff/cowsay:latest'
+    :param float timeout: seconds to wait for each request
+    :return str: digest such as 'sha256:ab12...', or None if the registry
+        can't tell us (offline, private, or unusual registries)
     """
-    # print("attend:{}".format(proc.pid))
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+    name, _, digest = docker_image.partition("@")
+    if digest:
+        return digest
+    tag = "latest"
+    if ":" in name.rsplit("/", 1)[-1]:
+        name, tag = name.rsplit(":", 1)
+    host, _, repo = name.partition("/")
+    if not repo or not ("." in host or ":" in host or host == "localhost"):
+        host, repo = "docker.io", name
+    if host == "docker.io":
+        host = "registry-1.docker.io"
+        if "/" not in repo:
+            repo = "library/" + repo
+    url = "https://{}/v2/{}/manifests/{}".format(host, repo, tag)
+    headers = {"Accept": ", ".join(REGISTRY_MANIFEST_TYPES)}
     try:
-        proc.wait(timeout=sleeptime)
-    except psutil.TimeoutExpired:
+        try:
+            response = urlopen(Request(url, headers=headers, method="HEAD"),
+                               timeout=timeout)
+        except HTTPError as e:
+            challenge = e.headers.get("WWW-Authenticate", "")
+            if e.code != 401 or not challenge.startswith("Bearer "):
+                return None
+            # Anonymous token, as for public images on docker hub
+            params = dict(part.split("=", 1) for part in
+                          challenge[len("Bearer "):].replace('"', "").split(","))
+            realm = params.pop("realm")
+            query = "&".join("{}={}".format(k, v) for k, v in params.items())
+            with urlopen("{}?{}".format(realm, query), timeout=timeout) as token:
+                headers["Authorization"] = "Bearer " + json.load(token)["token"]
+            response = urlopen(Request(url, headers=headers, method="HEAD"),
+                               timeout=timeout)
+    except (URLError, OSError, ValueError, KeyError) as e:
+        _LOGGER.debug("Couldn't get digest of '{}': {}".format(docker_image, e))
+        return None
+    return response.headers.get("Docker-Content-Digest")
+
+
+def image_store_folder(docker_image, image_path):
+    """
+    The content-addressed store for an image path laid out by
+    singularity_image_path, or None for a path outside that layout.
+
+    :param str docker_image: docker image
+    :param str image_path: path to the singularity image file
+    :return str: path to the store folder
+    """
+    suffix = os.sep + os.path.normpath(docker_image)
+    if not image_path.endswith(suffix):
+        return None
+    return os.path.join(image_path[:-len(suffix)], IMAGE_STORE_SUBDIR)
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return "sha256:" + digest.hexdigest()
+
+
+def _link_image(blob, image_path):
+    """ Point an image name at a stored image, replacing any old link """
+    tmp_link = "{}.tmp{}".format(image_path, os.getpid())
+    os.symlink(os.path.relpath(blob, os.path.dirname(image_path)), tmp_link)
+    os.replace(tmp_link, image_path)
+
+
+def pull_singularity_image(docker_image, image_path, digest=None):
+    """
+    Pull a docker image into a singularity image file, once.
+
+    Concurrent callers share one pull: the first takes a lock beside the
+    image and pulls into a temporary file that is renamed into place when
+    complete; the rest wait on the lock and then find the finished image.
+
+    Under the singularity image folder, images are kept in a content-addressed
+    store keyed by digest, and the image path is a link into it; an image
+    already stored under another name or tag is linked instead of pulled.
+    Once its digest is known the image is pulled by digest, so a tag pushed
+    meanwhile can't be stored under the old digest. If the registry can't
+    tell the digest, the image is stored under the sha256 of the image file;
+    that is no registry digest, so such a copy isn't shared with a pull of
+    the same image by digest.
+
+    :param str docker_image: docker image to pull, e.g. 'nsheff/cowsay'
+    :param str image_path: where the singularity image file belongs
+    :param str digest: pull the image with this digest rather than whatever
+        its tag points to now
+    :return bool: whether the image is now available
+    """
+    import fcntl
+    if os.path.isfile(image_path):
+        _check_image_digest(image_path, digest)
         return True
+    mkdir(os.path.dirname(image_path), exist_ok=True)
+    store = image_store_folder(docker_image, image_path)
+    # The lock file stays behind; removing it would let a waiter and a new
+    # caller each hold a lock on a different file.
+    with open(image_path + ".lock", "a") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            _LOGGER.info("Waiting for another pull of image: {}".format(docker_image))
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.isfile(image_path):
+            _check_image_digest(image_path, digest)
+            return True
+        if store and not digest:
+            digest = docker_image_digest(docker_image)
+        source = pinned_image(docker_image, digest) if digest else docker_image
+        if store and digest and os.path.isfile(os.path.join(store, *digest.split(":", 1))):
+            _LOGGER.info("Image already stored: {} ({})".format(docker_image, digest))
+            _link_image(os.path.join(store, *digest.split(":", 1)), image_path)
+            return True
+        if store:
+            mkdir(store, exist_ok=True)
+            tmp_path = os.path.join(store, "{}.tmp{}".format(
+                os.path.basename(image_path), os.getpid()))
+        else:
+            tmp_path = "{}.tmp{}".format(image_path, os.getpid())
+        _LOGGER.info("Pulling image: {}".format(docker_image))
+        try:
+            # Keep the wrapped command's stdout clean
+            proc = subprocess.run(["singularity", "pull", tmp_path,
+                                   "docker://" + source], stdout=sys.stderr)
+            if proc.returncode == 0 and os.path.isfile(tmp_path):
+                if not store:
+                    os.replace(tmp_path, image_path)
+                    return True
+                blob = os.path.join(store, *(digest or _file_digest(tmp_path)).split(":", 1))
+                if not os.path.isfile(blob):
+                    mkdir(os.path.dirname(blob), exist_ok=True)
+                    os.replace(tmp_path, blob)
+                _link_image(blob, image_path)
+                return True
+        except OSError as e:
+            _LOGGER.error("Couldn't run singularity: {}".format(e))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    _LOGGER.error("Failed to pull image: {}".format(docker_image))
     return False
 
-def _kill_process(pid, sig=signal.SIGINT, proc_name=None):
+
+def _check_image_digest(image_path, digest):
+    """ Warn if an image already on disk is stored under another digest """
+    if digest and os.path.islink(image_path):
+        blob = os.path.realpath(image_path)
+        if [os.path.basename(os.path.dirname(blob)), os.path.basename(blob)] != \
+                digest.split(":", 1):
+            _LOGGER.warning("Image {} isn't the frozen digest {}; remove it to fetch "
+                            "that one.".format(image_path, digest))
+
+
+def crate_images(bcfg, cratelist):
     """
-    Pypiper spawns subprocesses. We need to kill them to exit gracefully,
-    in the event of a pipeline termination or interrupt signal.
-    By default, child processes are not automatically killed when python
-    terminates, so Pypiper must clean these up manually.
-    Given a process ID, this function just kills it.
+    Container images used by crates, including the crates they import.
 
-    :param int pid: Process id.
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param list cratelist: cratevars dicts of loaded crates
+    :return list: docker images, sorted
     """
+    images = set()
+    for key, (path, index) in crate_closure(bcfg, cratelist).items():
+        if not index:
+            _LOGGER.warning("Crate '{}' has no crate index; run 'bulker reload' "
+                            "to list its images.".format(key))
+        images.update(index.get("commands", {}).values())
+    return sorted(images)
 
-    # When we kill process, it turns into a zombie, and we have to reap it.
-    # So we can't just kill it and then let it go; we call wait
-    import time
 
-    if pid is None:
-        return
+def crate_closure(bcfg, cratelist):
+    """
+    Loaded crates, along with all the crates they (recursively) import,
+    whether loaded in the config itself or in one of its crate stores.
 
-    try:
-        parent_process = psutil.Process(pid)
-        sys.stdout.flush()
-        time_waiting = 0
-        sleeptime = .25
-        still_running = _attend_process(psutil.Process(pid), 0)
-
-        while still_running and time_waiting < 3:
-            if time_waiting > 2:
-                sig = signal.SIGKILL
-            elif time_waiting > 1:
-                sig = signal.SIGTERM
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param list cratelist: cratevars dicts of loaded crates
+    :return dict: crate key -> (crate folder, crate index)
+    :raise MissingCrateError: if one of the crates isn't loaded
+    """
+    paths = store_crates(bcfg)
+    paths.update((crate_key({"namespace": namespace, "crate": crate, "tag": tag}), path)
+                 for namespace, crate, tag, path in loaded_crates(bcfg))
+    keys = [crate_key(cratevars) for cratevars in cratelist]
+    closure = {}
+    while keys:
+        key = keys.pop(0)
+        if key in closure:
+            continue
+        if key not in paths:
+            raise MissingCrateError(key)
+        closure[key] = (paths[key], read_crate_index(paths[key]))
+        keys.extend(closure[key][1].get("imports", []))
+    return closure
+
+
+def pinned_image(docker_image, digest):
+    """
+    Refer to a docker image by digest instead of by tag.
+
+    :param str docker_image: docker image, e.g. 'nsheff/cowsay:latest'
+    :param str digest: digest such as 'sha256:ab12...'
+    :return str: image reference such as 'nsheff/cowsay@sha256:ab12...'
+    """
+    name = docker_image.partition("@")[0]
+    if ":" in name.rsplit("/", 1)[-1]:
+        name = name.rsplit(":", 1)[0]
+    return "{}@{}".format(name, digest)
+
+
+def bulker_images_prefetch(bcfg, cratelist, jobs=DEFAULT_BUILD_JOBS, digests=None):
+    """
+    Fetch the images of loaded crates ahead of time, in parallel, so the first
+    use of a command doesn't wait on a pull.
+
+    For singularity, images are pulled into the 'singularity_image_folder'
+    with the same locking as the executables use; for docker, the build
+    template pulls them.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param list cratelist: cratevars dicts of loaded crates
+    :param int jobs: maximum number of images to fetch at the same time
+    :param dict digests: docker image -> digest to fetch it by, as frozen in
+        a lockfile; the image is then available under its usual name
+    :return list: images that failed to fetch
+    """
+    images = crate_images(bcfg, cratelist)
+    digests = digests or {}
+    if not images:
+        _LOGGER.info("No images to fetch.")
+        return []
+    if bcfg["bulker"]["container_engine"] != "singularity":
+        _, _, build_template = load_templates(bcfg, build=True)
+        refs = {image: pinned_image(image, digests[image]) if image in digests else image
+                for image in images}
+        failed = build_images(build_template, [
+            {"docker_image": ref, "container_engine": bcfg["bulker"]["container_engine"]}
+            for ref in refs.values()], jobs)
+        failures = [image for image, ref in refs.items() if ref in failed]
+        for image, ref in refs.items():
+            if ref != image and ref not in failed and subprocess.run(
+                    [bcfg["bulker"]["container_engine"], "tag", ref, image]).returncode:
+                _LOGGER.error("Couldn't tag {} as {}".format(ref, image))
+                failures.append(image)
+        return failures
+
+    shared = [image for image in images if store_image_path(bcfg, image)]
+    if shared:
+        _LOGGER.info("{} images are available from crate stores.".format(len(shared)))
+        images = [image for image in images if image not in shared]
+        if not images:
+            return []
+    total = len(images)
+    jobs = max(1, min(int(jobs), total))
+    _LOGGER.info("Fetching {} images ({} at a time)...".format(total, jobs))
+    failures = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(pull_singularity_image, image,
+                                   singularity_image_path(bcfg, image),
+                                   digests.get(image)): image
+                   for image in images}
+        for done, future in enumerate(as_completed(futures), 1):
+            image = futures[future]
+            if future.result():
+                _LOGGER.info("[{}/{}] Image available: {}".format(done, total, image))
             else:
-                sig = signal.SIGINT
+                _LOGGER.info("[{}/{}] Failed to fetch image: {}".format(done, total, image))
+                failures.append(image)
+    _LOGGER.info("Fetched {} of {} images.".format(total - len(failures), total))
+    return failures
+
+
+def _format_size(size):
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = "TB"
+    return "{:.1f} {}".format(size, unit) if unit != "B" else "{} B".format(size)
+
+
+def singularity_image_folder(bcfg):
+    """
+    Absolute path to a config's singularity image folder.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return str: path to the image folder
+    """
+    return mkabs(bcfg["bulker"]["singularity_image_folder"],
+                 os.path.dirname(bcfg.filepath))
 
-            _LOGGER.debug("Sending sig {} to proc {}".format(sig, pid))
-            parent_process.send_signal(sig)
 
-            # Now see if it's still running
-            time_waiting = time_waiting + sleeptime
-            if not _attend_process(psutil.Process(pid), sleeptime):
-                still_running = False
+def image_folder_users(folder):
+    """
+    The bulker configs recorded as using a singularity image folder.
 
+    :param str folder: singularity image folder
+    :return list: paths to the config files
+    """
+    try:
+        with open(os.path.join(folder, IMAGE_STORE_SUBDIR, IMAGE_USERS_FILENAME)) as f:
+            return [line.strip() for line in f if line.strip()]
     except OSError:
-        # This would happen if the child process ended between the check
-        # and the next kill step
-        still_running = False
-        time_waiting = time_waiting + sleeptime
-        print("proc {} already dead 1".format(pid))
-    except psutil.NoSuchProcess:
-        still_running = False
-        time_waiting = time_waiting + sleeptime
-        print("proc {} already dead 1".format(pid))
-
-    if proc_name:
-        proc_string = " ({proc_name})".format(proc_name=proc_name)
-    else:
-        proc_string = " "
- 
-    if still_running:
-        # still running!?
-        _LOGGER.warning("Bulker child process {pid}{proc_string} never responded"
-            "I just can't take it anymore. I don't know what to do...".format(pid=pid,
-                proc_string=proc_string))
-    else:
-        if time_waiting > 0:
-            note = "terminated after {time} sec".format(time=int(time_waiting))
+        return []
+
+
+_IMAGE_USERS_RECORDED = set()
+
+
+def record_image_folder_user(bcfg):
+    """
+    Record that a singularity config uses its image folder, so that
+    'bulker images gc' from any config sharing the folder keeps its images.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    """
+    if bcfg["bulker"]["container_engine"] != "singularity" or not bcfg.filepath:
+        return
+    folder = singularity_image_folder(bcfg)
+    cfg_path = os.path.abspath(bcfg.filepath)
+    if (folder, cfg_path) in _IMAGE_USERS_RECORDED:
+        return
+    if cfg_path not in image_folder_users(folder):
+        store = os.path.join(folder, IMAGE_STORE_SUBDIR)
+        mkdir(store, exist_ok=True)
+        with open(os.path.join(store, IMAGE_USERS_FILENAME), "a") as f:
+            f.write(cfg_path + "\n")
+    _IMAGE_USERS_RECORDED.add((folder, cfg_path))
+
+
+def image_references(bcfg):
+    """
+    Which crates use each singularity image in a config's image folder: the
+    crates loaded in the config and in its crate stores, and those of every
+    other config recorded as using the same folder.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return dict: image path -> list of keys of the crates that use it
+    :raise BulkerError: if another config using the folder can't be read
+    """
+    folder = singularity_image_folder(bcfg)
+    configs = [bcfg]
+    for cfg_path in image_folder_users(folder):
+        if os.path.abspath(cfg_path) == os.path.abspath(bcfg.filepath) or \
+                not os.path.isfile(cfg_path):
+            continue
+        try:
+            other = yacman.YAMLConfigManager.from_yaml_file(cfg_path)
+            load_crate_registry(other)
+        except Exception as e:
+            raise BulkerError("Can't read config {}, which shares the image folder "
+                              "{}: {}".format(cfg_path, folder, e))
+        if other["bulker"].get("container_engine") == "singularity" and \
+                singularity_image_folder(other) == folder:
+            configs.append(other)
+    refs = {}
+    for cfg in configs:
+        crates = [(crate_key({"namespace": namespace, "crate": crate, "tag": tag}), path)
+                  for namespace, crate, tag, path in loaded_crates(cfg)]
+        crates.extend(store_crates(cfg).items())
+        for key, path in crates:
+            for image in set(read_crate_index(path).get("commands", {}).values()):
+                users = refs.setdefault(singularity_image_path(bcfg, image), [])
+                if key not in users:
+                    users.append(key)
+    return refs
+
+
+def image_store_usage(bcfg):
+    """
+    Inventory the singularity image folder: each image name, what it points
+    to, its size, and the loaded crates that use it.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return tuple: (names, blobs). names maps each image path to a dict with
+        'blob' (stored image it links to, or None for a plain file), 'size',
+        and 'crates'; blobs maps each stored image to its size.
+    :raise BulkerError: if the config doesn't use singularity
+    """
+    if bcfg["bulker"]["container_engine"] != "singularity":
+        raise BulkerError("'bulker images list' and 'gc' manage singularity images, "
+                          "but this config uses {}.".format(bcfg["bulker"]["container_engine"]))
+    folder = singularity_image_folder(bcfg)
+    store = os.path.join(folder, IMAGE_STORE_SUBDIR)
+    refs = image_references(bcfg)
+    names, blobs = {}, {}
+    for root, dirs, files in os.walk(folder):
+        if root == folder and IMAGE_STORE_SUBDIR in dirs:
+            dirs.remove(IMAGE_STORE_SUBDIR)
+        for filename in files:
+            if filename.endswith(".lock") or ".tmp" in filename:
+                continue
+            path = os.path.join(root, filename)
+            blob = os.path.realpath(path) if os.path.islink(path) else None
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                size = 0  # dangling link
+            names[path] = {"blob": blob, "size": size, "crates": refs.get(path, [])}
+    for root, _, files in os.walk(store):
+        if root == store:
+            continue  # stored images are in digest folders
+        for filename in files:
+            if ".tmp" not in filename:
+                path = os.path.join(root, filename)
+                blobs[os.path.realpath(path)] = os.path.getsize(path)
+    return names, blobs
+
+
+def bulker_images_list(bcfg):
+    """
+    Print the singularity images on disk, with their sizes and the number of
+    loaded crates using each.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    """
+    names, blobs = image_store_usage(bcfg)
+    folder = singularity_image_folder(bcfg)
+    _LOGGER.info("Singularity images in: {}".format(folder))
+    fmt = "{:<50} {:<14} {:>10} {:>6}"
+    print(fmt.format("IMAGE", "DIGEST", "SIZE", "CRATES"))
+    for path, info in sorted(names.items()):
+        digest = os.path.basename(info["blob"])[:12] if info["blob"] else "-"
+        print(fmt.format(os.path.relpath(path, folder), digest,
+                         _format_size(info["size"]), len(info["crates"])))
+    plain = sum(info["size"] for info in names.values() if not info["blob"])
+    _LOGGER.info("{} names, {} stored images; {} on disk.".format(
+        len(names), len(blobs), _format_size(sum(blobs.values()) + plain)))
+
+
+def bulker_images_gc(bcfg, dry_run=False):
+    """
+    Remove singularity images that no loaded crate uses.
+
+    Image names no crate refers to are removed, then stored images that no
+    remaining name links to. The crates of the config's crate stores count,
+    as do those of every config that has loaded crates with the same image
+    folder (see image_references). Lock files beside the names are kept.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param bool dry_run: only report what would be removed
+    :return tuple: number of image files removed (not counting links), and
+        bytes reclaimed
+    :raise BulkerError: if the config doesn't use singularity, or another
+        config using the image folder can't be read
+    """
+    names, blobs = image_store_usage(bcfg)
+    unused_names, removed, reclaimed = 0, 0, 0
+    kept_blobs = set()
+    for path, info in sorted(names.items()):
+        if info["crates"]:
+            kept_blobs.add(info["blob"])
+            continue
+        _LOGGER.info("{}Removing unused image: {}".format(
+            "(dry run) " if dry_run else "", path))
+        unused_names += 1
+        if not info["blob"]:
+            removed += 1
+            reclaimed += info["size"]
+        if not dry_run and os.path.lexists(path):
+            # The lock file stays, as in pull_singularity_image
+            os.remove(path)
+    for blob, size in sorted(blobs.items()):
+        if blob in kept_blobs:
+            continue
+        _LOGGER.debug("Removing stored image: {}".format(blob))
+        removed += 1
+        reclaimed += size
+        if not dry_run:
+            os.remove(blob)
+    _LOGGER.info("{} {} unused image names and {} image files, {}.".format(
+        "Would remove" if dry_run else "Removed", unused_names, removed,
+        _format_size(reclaimed)))
+    return removed, reclaimed
+
+
+def bulker_bundle(bcfg, cratelist, output, images=False):
+    """
+    Pack loaded crates into a single tar archive that 'bulker load --bundle'
+    can install on another machine without rendering or fetching anything.
+
+    The archive holds the crate folders (wrappers, crate index, and the
+    manifest it records) of the crates and everything they import, metadata
+    to relocate them, and optionally their singularity images.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param list cratelist: cratevars dicts of loaded crates
+    :param str output: path of the archive to write; compressed if it ends
+        in .gz or .tgz
+    :param bool images: also include the singularity images?
+    :return dict: the bundle metadata
+    :raise MissingCrateError: if one of the crates isn't loaded
+    """
+    import tarfile
+    closure = crate_closure(bcfg, cratelist)
+    meta = {"bulker_bundle": BUNDLE_VERSION, "bulker_version": __version__,
+            "container_engine": bcfg["bulker"]["container_engine"],
+            "crates": {}, "images": {}, "singularity_image_folder": None}
+    for key, (path, index) in closure.items():
+        if not index:
+            raise BulkerError("Crate '{}' has no crate index; reload it before "
+                              "bundling.".format(key))
+        cratevars = parse_registry_path(key)
+        meta["crates"][key] = {
+            "path": path, "imports": index.get("imports", []),
+            "folder": "/".join(["crates", cratevars["namespace"],
+                                cratevars["crate"], str(cratevars["tag"])])}
+    if bcfg["bulker"]["container_engine"] == "singularity":
+        meta["singularity_image_folder"] = mkabs(
+            bcfg["bulker"]["singularity_image_folder"], os.path.dirname(bcfg.filepath))
+    if images:
+        if meta["singularity_image_folder"] is None:
+            _LOGGER.warning("Only singularity images can be bundled; skipping images.")
         else:
-            note = "was already terminated"
+            for image in crate_images(bcfg, cratelist):
+                image_path = singularity_image_path(bcfg, image)
+                if os.path.isfile(image_path):
+                    meta["images"][image] = "images/" + image
+                else:
+                    _LOGGER.warning("Image not pulled, so not bundled: {}".format(image))
+
+    mode = "w:gz" if output.endswith((".gz", ".tgz")) else "w"
+    tmp_output = "{}.tmp{}".format(output, os.getpid())
+    try:
+        with tarfile.open(tmp_output, mode) as tar:
+            data = json.dumps(meta, indent=1, sort_keys=True).encode("utf-8")
+            info = tarfile.TarInfo(BUNDLE_META_FILENAME)
+            info.size, info.mtime = len(data), time.time()
+            tar.addfile(info, io.BytesIO(data))
+            for key, crate in meta["crates"].items():
+                tar.add(os.path.realpath(crate["path"]), arcname=crate["folder"])
+            for image, member in meta["images"].items():
+                # Store the image itself, not the link into the image store
+                tar.add(os.path.realpath(singularity_image_path(bcfg, image)),
+                        arcname=member)
+        os.replace(tmp_output, output)
+    finally:
+        if os.path.exists(tmp_output):
+            os.remove(tmp_output)
+    _LOGGER.info("Bundled {} crates and {} images into: {}".format(
+        len(meta["crates"]), len(meta["images"]), output))
+    return meta
+
+
+def _install_bundled_image(tar, member, docker_image, image_path):
+    """ Put a bundled singularity image in place, in the image store if there is one """
+    if os.path.isfile(image_path):
+        return
+    mkdir(os.path.dirname(image_path), exist_ok=True)
+    store = image_store_folder(docker_image, image_path)
+    folder = store or os.path.dirname(image_path)
+    mkdir(folder, exist_ok=True)
+    tmp_path = os.path.join(folder, "{}.tmp{}".format(os.path.basename(image_path), os.getpid()))
+    try:
+        with open(tmp_path, "wb") as fh:
+            shutil.copyfileobj(tar.extractfile(member), fh)
+        if not store:
+            os.replace(tmp_path, image_path)
+            return
+        blob = os.path.join(store, *_file_digest(tmp_path).split(":", 1))
+        mkdir(os.path.dirname(blob), exist_ok=True)
+        os.replace(tmp_path, blob)
+        _link_image(blob, image_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _path_within(path, folders):
+    """ Is a path inside (or equal to) one of the given folders? """
+    return any(os.path.commonpath([path, folder]) == folder for folder in folders)
+
+
+def bulker_load_bundle(bcfg, bundle_path, force=False):
+    """
+    Install the crates in a bundle made by bulker_bundle.
+
+    Crates go in this config's 'default_crate_folder', and paths in their
+    wrappers and links that pointed at the crate and singularity image
+    folders of the machine the bundle was made on are rewritten to this
+    machine's. The config file is not written; that's left to the caller.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param str bundle_path: path to the bundle archive
+    :param bool force: overwrite already-loaded crates without asking
+    :return list[str]: crate keys of the installed crates
+    :raise BulkerError: if the bundle can't be installed with this config
+    """
+    import tarfile
+    with tarfile.open(bundle_path, "r:*") as tar:
+        try:
+            meta = json.load(tar.extractfile(BUNDLE_META_FILENAME))
+        except (KeyError, ValueError):
+            raise BulkerError("Not a bulker bundle: {}".format(bundle_path))
+        if meta.get("bulker_bundle", 0) > BUNDLE_VERSION:
+            raise BulkerError("Bundle {} needs a newer version of bulker".format(bundle_path))
+        if meta["container_engine"] != bcfg["bulker"]["container_engine"]:
+            raise BulkerError("Bundle was built for {}, but this config uses {}".format(
+                meta["container_engine"], bcfg["bulker"]["container_engine"]))
+        registered = ["{}/{}:{}".format(namespace, crate, tag)
+                      for namespace, crate, tag, path in loaded_crates(bcfg)]
+        existing = [key for key in meta["crates"] if key in registered]
+        if existing and not force and not query_yes_no(
+                "{} of these crates are already loaded ({}). Overwrite?".format(
+                    len(existing), ", ".join(existing))):
+            return []
+
+        # Old absolute path -> new one, longest first so nested paths win
+        moves = {crate["path"]: crate_folder(bcfg, parse_registry_path(key))
+                 for key, crate in meta["crates"].items()}
+        if meta["singularity_image_folder"]:
+            moves[meta["singularity_image_folder"]] = mkabs(
+                bcfg["bulker"]["singularity_image_folder"], os.path.dirname(bcfg.filepath))
+        moves = sorted(((old + "/", new + "/") for old, new in moves.items()),
+                       key=lambda move: len(move[0]), reverse=True)
+
+        def relocate(text):
+            for old, new in moves:
+                text = text.replace(old, new)
+            return text
+
+        # Links may only point into the crate and image folders they were
+        # relocated to, apart from links to host commands
+        link_roots = [os.path.normpath(new) for _, new in moves]
+        members = tar.getmembers()
+        for key, crate in meta["crates"].items():
+            crate_path = crate_folder(bcfg, parse_registry_path(key))
+            mkdir(os.path.dirname(crate_path), exist_ok=True)
+            staging_path = _new_generation_path(crate_path)
+            mkdir(staging_path, exist_ok=False)
+            prefix = crate["folder"] + "/"
+            try:
+                host_commands = json.load(tar.extractfile(
+                    prefix + CRATE_INDEX_FILENAME)).get("host_commands", [])
+            except (KeyError, ValueError):
+                host_commands = []
+            try:
+                for member in members:
+                    if not member.name.startswith(prefix):
+                        continue
+                    name = member.name[len(prefix):]
+                    if not name or name.startswith("/") or ".." in name.split("/"):
+                        continue
+                    path = os.path.join(staging_path, name)
+                    # Never write through a link from an earlier member
+                    if not _path_within(os.path.realpath(os.path.dirname(path)),
+                                        [os.path.realpath(staging_path)]) or \
+                            (os.path.lexists(path) and not member.isdir()):
+                        raise BulkerError("Bundle member escapes its crate folder: {}".format(
+                            member.name))
+                    if member.isdir():
+                        mkdir(path, exist_ok=True)
+                    elif member.issym():
+                        target = relocate(member.linkname)
+                        resolved = os.path.normpath(os.path.join(
+                            crate_path, os.path.dirname(name), target))
+                        if not _path_within(resolved, link_roots) and \
+                                not (os.path.isabs(target) and name in host_commands):
+                            raise BulkerError("Bundle link points outside the crate and "
+                                              "image folders: {} -> {}".format(
+                                                  member.name, member.linkname))
+                        os.symlink(target, path)
+                    elif member.isfile():
+                        data = tar.extractfile(member).read()
+                        if name != CRATE_INDEX_FILENAME:
+                            try:
+                                data = relocate(data.decode("utf-8")).encode("utf-8")
+                            except UnicodeDecodeError:
+                                pass
+                        with open(path, "wb") as fh:
+                            fh.write(data)
+                        os.chmod(path, member.mode & 0o7777)
+            except BaseException:
+                shutil.rmtree(staging_path, ignore_errors=True)
+                raise
+            swap_crate_folder(crate_path, staging_path)
+            cratevars = parse_registry_path(key)
+            register_crate(bcfg, cratevars, crate_path)
+            _LOGGER.info("Installed crate '{}' in: {}".format(key, crate_path))
+
+        for image, member in meta["images"].items():
+            _install_bundled_image(tar, member, image, singularity_image_path(bcfg, image))
+    record_image_folder_user(bcfg)
+    return list(meta["crates"])
+
+
+def bulker_activate(bulker_config, cratelist, echo=False, strict=False, prompt=True,
+                    warm=False):
+    """
+    Activates a given crate.
+
+    :param yacman.YAMLConfigManager bulker_config: The bulker configuration object.
+    :param list cratelist: a list of cratevars objects, which are dicts with
+        values for 'namespace', 'crate', and 'tag'.
+    :param bool echo: Should we just echo the new PATH to create? Otherwise, the
+        function will create a new shell and replace the current process with
+        it.
+    :param bool strict: Should we wipe out the PATH, such that the returned
+        environment contains strictly only commands listed in the bulker
+        manifests?
+    :param bool warm: Should crate commands reuse long-lived containers for as
+        long as the shell lasts?
+    """
+    newpath = get_new_PATH(bulker_config, cratelist, strict)
+
+    # We can use lots of them. use the last one
+    name = "{namespace}/{crate}".format(
+        namespace=cratelist[-1]["namespace"],
+        crate=cratelist[-1]["crate"])
+
+    runtime.activate(bulker_config["bulker"], os.path.dirname(bulker_config.filepath),
+                     newpath, name, echo=echo, strict=strict, prompt=prompt,
+                     warm=warm)
 
-        msg = "Bulker child process {pid}{proc_string} {note}.".format(
-            pid=pid, proc_string=proc_string, note=note)
-        _LOGGER.info(msg)
+def get_local_path(bulker_config, cratevars):
+    """
+    :param dict cratevars: dict with crate metadata returned from parse_registry_path
+    :param YAMLConfigManager bulker_config: bulker config object
+    :return str: path to requested crate folder
+    """
+    _LOGGER.debug(cratevars)
+    path = find_crate(bulker_config, cratevars)
+    if path is None:
+        raise KeyError(crate_key(cratevars))
+    return path
+
+def get_new_PATH(bulker_config, cratelist, strict=False):
+    """
+    Returns local paths to crates
+
+    :: param str crates :: string with a comma-separated list of crate identifiers
+    """
+    if not bulker_config["bulker"]["crates"] and not store_crates(bulker_config):
+        raise MissingCrateError("No crates exist")
+
+    return runtime.crate_search_path(
+        [get_local_path(bulker_config, cratevars) for cratevars in cratelist],
+        strict)
 
-def load_remote_registry_path(bulker_config, registry_path, filepath=None):
+def bulker_run(bulker_config, cratelist, command, strict=False, supervise=False,
+               warm=False):
+    newpath = get_new_PATH(bulker_config, cratelist, strict)
+    if warm:
+        runtime.start_warm_session(bulker_config["bulker"], os.getpid())
+    runtime.run(newpath, command, supervise=supervise)
+
+def load_remote_registry_path(bulker_config, registry_path, filepath=None,
+                              offline=False):
     cratevars = parse_registry_path(registry_path)
     if cratevars:
         # assemble the query string
@@ -1019,24 +3626,15 @@ def load_remote_registry_path(bulker_config, registry_path, filepath=None):
 
     if is_url(filepath):
         _LOGGER.debug("Got URL: {}".format(filepath))
-        try: #python3
-            from urllib.request import urlopen
-            from urllib.error import HTTPError
-        except: #python2
-            from urllib2 import urlopen       
-            from urllib2 import URLError as HTTPError
-        try:
-            response = urlopen(filepath)
-        except HTTPError as e:
+        with span("manifest fetch", crate=registry_path):
+            text = fetch_remote_manifest(bulker_config, filepath, registry_path, offline)
+        if text is None:
             if cratevars:
                 _LOGGER.error("The requested remote manifest '{}' is not found. Not loaded.".format(
                     filepath))
-                response=None
                 return None, None
             else:
                 raise Exception("No remote manifest found")
-        data = response.read()      # a `bytes` object
-        text = data.decode('utf-8')
         manifest_lines = yacman.YAMLConfigManager.from_yaml_data(text)
     else:
         manifest_lines = yacman.YAMLConfigManager.from_yaml_file(filepath)
@@ -1044,37 +3642,279 @@ def load_remote_registry_path(bulker_config, registry_path, filepath=None):
     return manifest_lines, cratevars
 
 
-def mkabs(path, reldir=None):
+def manifest_cache_folder(bulker_config):
     """
-    Makes sure a path is absolute; if not already absolute, it's made absolute
-    relative to a given directory. Also expands ~ and environment variables for
-    kicks.
+    Get the folder used to cache remote manifests for a bulker config.
+
+    The cache lives next to the config file, unless 'manifest_cache_folder'
+    is set. The built-in default config has no cache.
+
+    :param yacman.YAMLConfigManager bulker_config: bulker config object
+    :return str: path to the cache folder, or None if caching is disabled
+    """
+    cfg_path = bulker_config.filepath
+    if _is_default_config(cfg_path):
+        return None
+    if "manifest_cache_folder" in bulker_config["bulker"]:
+        return mkabs(bulker_config["bulker"]["manifest_cache_folder"],
+                     os.path.dirname(cfg_path))
+    return os.path.join(os.path.dirname(os.path.abspath(cfg_path)),
+                        MANIFEST_CACHE_SUBDIR)
 
-    :param str path: Path to make absolute
-    :param str reldir: Relative directory to make path absolute from if it's
-        not already absolute
 
-    :return str: Absolute path
+def _manifest_cache_paths(cache_folder, url):
+    key = hashlib.sha1(url.encode("utf-8")).hexdigest()
+    base = os.path.join(cache_folder, key)
+    return base + ".yaml", base + ".json"
+
+
+def _atomic_write(path, contents, mode="w"):
+    """ Write a file by replacing it, so readers never see a partial file """
+    tmp_path = "{}.tmp{}.{}".format(path, os.getpid(), threading.get_ident())
+    with open(tmp_path, mode) as fh:
+        fh.write(contents)
+    os.replace(tmp_path, path)
+
+
+def read_manifest_cache(cache_folder):
     """
-    def xpand(path):
-        return os.path.expandvars(os.path.expanduser(path))
+    List the entries in a manifest cache.
 
-    if os.path.isabs(xpand(path)):
-        return xpand(path)
+    :param str cache_folder: path to the manifest cache
+    :return list: metadata dicts, one per cached manifest
+    """
+    entries = []
+    if not cache_folder or not os.path.isdir(cache_folder):
+        return entries
+    for filename in sorted(os.listdir(cache_folder)):
+        if not filename.endswith(".json"):
+            continue
+        meta_path = os.path.join(cache_folder, filename)
+        try:
+            with open(meta_path) as fh:
+                meta = json.load(fh)
+        except (OSError, ValueError):
+            continue
+        meta["meta_path"] = meta_path
+        meta["manifest_path"] = meta_path[:-len(".json")] + ".yaml"
+        entries.append(meta)
+    return entries
 
-    if not reldir:
-        return os.path.abspath(xpand(path))
 
-    return os.path.join(xpand(reldir), xpand(path))
+def fetch_remote_manifest(bulker_config, url, registry_path=None, offline=False):
+    """
+    Retrieve the text of a remote manifest, using the local manifest cache.
+
+    A cached manifest younger than 'manifest_cache_ttl' seconds is used
+    as-is; an older one is revalidated with a conditional request
+    (ETag/Last-Modified). If the registry can't be reached or answers with a
+    server error (5xx), a cached copy is used if there is one.
+
+    :param yacman.YAMLConfigManager bulker_config: bulker config object
+    :param str url: URL of the manifest
+    :param str registry_path: registry path the URL was built from, recorded
+        in the cache for 'bulker cache list'
+    :param bool offline: only use the cache, never touch the network
+    :return str: manifest text, or None if it's not available
+    """
+    from urllib.request import Request, urlopen
+    from urllib.error import HTTPError, URLError
+
+    cache_folder = manifest_cache_folder(bulker_config)
+    meta = None
+    if cache_folder:
+        manifest_path, meta_path = _manifest_cache_paths(cache_folder, url)
+        if os.path.exists(manifest_path) and os.path.exists(meta_path):
+            try:
+                with open(meta_path) as fh:
+                    meta = json.load(fh)
+                with open(manifest_path) as fh:
+                    cached_text = fh.read()
+            except (OSError, ValueError):
+                meta = None
+
+    if offline:
+        if meta is None:
+            _LOGGER.error("Offline, and no cached manifest for: {}".format(url))
+            return None
+        _LOGGER.debug("Offline; using cached manifest: {}".format(url))
+        return cached_text
+
+    if meta:
+        ttl = bulker_config["bulker"]["manifest_cache_ttl"] \
+            if "manifest_cache_ttl" in bulker_config["bulker"] \
+            else DEFAULT_MANIFEST_CACHE_TTL
+        if time.time() - meta["fetched"] < ttl:
+            _LOGGER.debug("Using cached manifest: {}".format(url))
+            return cached_text
+
+    request = Request(url)
+    if meta and meta.get("etag"):
+        request.add_header("If-None-Match", meta["etag"])
+    if meta and meta.get("last_modified"):
+        request.add_header("If-Modified-Since", meta["last_modified"])
+    try:
+        response = urlopen(request)
+        text = response.read().decode("utf-8")
+        headers = response.headers
+    except HTTPError as e:
+        if e.code == 304 and meta:
+            _LOGGER.debug("Cached manifest still current: {}".format(url))
+            meta["fetched"] = time.time()
+            _atomic_write(meta_path, json.dumps(meta))
+            return cached_text
+        if e.code >= 500 and meta:
+            _LOGGER.warning("Registry error ({}); using cached manifest: {}".format(
+                e.code, url))
+            return cached_text
+        _LOGGER.debug("HTTP error {} fetching {}".format(e.code, url))
+        return None
+    except URLError as e:
+        if meta:
+            _LOGGER.warning("Can't reach registry ({}); using cached manifest: {}".format(
+                e.reason, url))
+            return cached_text
+        raise
+
+    if cache_folder:
+        try:
+            mkdir(cache_folder, exist_ok=True)
+            _atomic_write(manifest_path, text)
+            _atomic_write(meta_path, json.dumps({
+                "registry_path": registry_path,
+                "url": url,
+                "etag": headers.get("ETag"),
+                "last_modified": headers.get("Last-Modified"),
+                "fetched": time.time()}))
+        except OSError as e:
+            _LOGGER.debug("Unable to cache manifest {}: {}".format(url, e))
+    return text
+
+
+def bulker_cache(bulker_config, action, older_than=None):
+    """
+    List, prune, or clear the local manifest cache.
 
-def prep_load(bulker_config, crate_registry_paths, manifest=None, build=False):
+    :param yacman.YAMLConfigManager bulker_config: bulker config object
+    :param str action: one of 'list', 'prune', or 'clear'
+    :param float older_than: for 'prune', remove entries that haven't been
+        fetched or revalidated in this many days
+    """
+    cache_folder = manifest_cache_folder(bulker_config)
+    entries = read_manifest_cache(cache_folder)
+    if action == "list":
+        _LOGGER.info("Manifest cache: {}".format(cache_folder))
+        fmt = "{registry_path} -- {url} (fetched {age:.0f}s ago)"
+        for meta in entries:
+            print(fmt.format(age=time.time() - meta["fetched"], **meta))
+        return
+    if action == "prune":
+        cutoff = time.time() - 86400 * (older_than or 0)
+        entries = [meta for meta in entries if meta["fetched"] < cutoff]
+    for meta in entries:
+        for path in [meta["manifest_path"], meta["meta_path"]]:
+            if os.path.exists(path):
+                os.remove(path)
+    _LOGGER.info("Removed {} cached manifests.".format(len(entries)))
+
+
+def prep_load(bulker_config, crate_registry_paths, manifest=None, build=False,
+              offline=False):
     """ 
     Prepares stuff for a bulker load
     """
     
     manifest, cratevars = load_remote_registry_path(bulker_config, 
                                                     crate_registry_paths,
-                                                    manifest)
+                                                    manifest, offline)
+    exe_template_jinja, shell_template_jinja, build_template_jinja = load_templates(
+        bulker_config, build)
+    return manifest, cratevars, exe_template_jinja, shell_template_jinja, build_template_jinja
+
+
+def template_cache_folder(bulker_config):
+    """
+    Get the folder where compiled templates are cached for a bulker config.
+
+    Like the manifest cache, it lives next to the config file unless
+    'template_cache_folder' is set. There is none for the built-in default
+    config, or if the folder can't be written.
+
+    :param yacman.YAMLConfigManager bulker_config: bulker config object
+    :return str: path to the cache folder, or None if caching is disabled
+    """
+    cfg_path = bulker_config.filepath
+    if _is_default_config(cfg_path):
+        return None
+    if "template_cache_folder" in bulker_config["bulker"]:
+        folder = mkabs(bulker_config["bulker"]["template_cache_folder"],
+                       os.path.dirname(cfg_path))
+    else:
+        folder = os.path.join(os.path.dirname(os.path.abspath(cfg_path)),
+                              TEMPLATE_CACHE_SUBDIR)
+    try:
+        mkdir(folder, exist_ok=True)
+    except OSError:
+        return None
+    return folder if os.access(folder, os.W_OK) else None
+
+
+def template_environment(template_folder, cache_folder=None):
+    """
+    Get the shared jinja2 environment for a folder of templates.
+
+    Environments are created once per folder and cache folder, and keep
+    compiled templates in memory (recompiling only if a template file
+    changes). With a cache folder, the compiled bytecode is also kept on
+    disk, keyed by template source, so later runs skip compiling too.
+
+    :param str template_folder: folder the templates are loaded from
+    :param str cache_folder: folder for the on-disk bytecode cache
+    :return jinja2.Environment: the environment
+    """
+    # Only loading needs jinja2; keep it off the run/activate import path
+    import jinja2
+    key = (template_folder, cache_folder)
+    with _TEMPLATE_LOCK:
+        if key not in _TEMPLATE_ENVIRONMENTS:
+            bytecode_cache = jinja2.FileSystemBytecodeCache(cache_folder) \
+                if cache_folder else None
+            _TEMPLATE_ENVIRONMENTS[key] = jinja2.Environment(
+                loader=jinja2.FileSystemLoader(template_folder),
+                bytecode_cache=bytecode_cache)
+        return _TEMPLATE_ENVIRONMENTS[key]
+
+
+def get_template(bulker_config, path):
+    """
+    Get a compiled template, reusing it across crates and runs when unchanged.
+
+    The template gets a 'bulker_hash' attribute, the hash of its source, which
+    crate indexes record to tell whether executables need re-rendering.
+
+    :param yacman.YAMLConfigManager bulker_config: bulker config object
+    :param str path: absolute path to the template file
+    :return jinja2.Template: compiled template
+    """
+    with span("template compile", template=os.path.basename(path)):
+        env = template_environment(os.path.dirname(path),
+                                   template_cache_folder(bulker_config))
+        template = env.get_template(os.path.basename(path))
+        if not hasattr(template, "bulker_hash"):
+            source = env.loader.get_source(env, os.path.basename(path))[0]
+            template.bulker_hash = hashlib.sha256(source.encode("utf-8")).hexdigest()
+    return template
+
+
+def load_templates(bulker_config, build=False):
+    """
+    Compiles the executable, shell, and (optionally) build templates.
+
+    :param yacman.YAMLConfigManager bulker_config: bulker config object
+    :param bool build: also compile the build template?
+    :return tuple: executable, shell, and build templates; the build template
+        is None unless requested
+    """
     exe_template_jinja = None
     build_template_jinja = None
     shell_template_jinja = None
@@ -1097,10 +3937,7 @@ def prep_load(bulker_config, crate_registry_paths, manifest=None, build=False):
         _LOGGER.error("Bulker config points to a missing executable template: {}".format(exe_template))
         sys.exit(1)
 
-    with open(exe_template, 'r') as f:
-    # with open(DOCKER_TEMPLATE, 'r') as f:
-        contents = f.read()
-        exe_template_jinja = jinja2.Template(contents)
+    exe_template_jinja = get_template(bulker_config, exe_template)
 
     try:
         assert(os.path.exists(shell_template))
@@ -1108,10 +3945,7 @@ def prep_load(bulker_config, crate_registry_paths, manifest=None, build=False):
         _LOGGER.error("Bulker config points to a missing shell template: {}".format(shell_template))
         sys.exit(1)
 
-    with open(shell_template, 'r') as f:
-    # with open(DOCKER_TEMPLATE, 'r') as f:
-        contents = f.read()
-        shell_template_jinja = jinja2.Template(contents)
+    shell_template_jinja = get_template(bulker_config, shell_template)
 
 
     if build:
@@ -1122,11 +3956,9 @@ def prep_load(bulker_config, crate_registry_paths, manifest=None, build=False):
             sys.exit(1)
 
         _LOGGER.info("Building images with template: {}".format(build_template))
-        with open(build_template, 'r') as f:
-            contents = f.read()
-            build_template_jinja = jinja2.Template(contents)
+        build_template_jinja = get_template(bulker_config, build_template)
     
-    return manifest, cratevars, exe_template_jinja, shell_template_jinja, build_template_jinja
+    return exe_template_jinja, shell_template_jinja, build_template_jinja
 
 
 
@@ -1199,42 +4031,128 @@ def parse_cwl(cwl_file):
             "docker_command": base_command}
 
 
-def bulker_unload(bulker_config, crate_registry_paths):
-    cratelist = parse_registry_paths(crate_registry_paths,
-                                     bulker_config["bulker"]["default_namespace"])
+def match_crates(bcfg, registry_paths):
+    """
+    Find the loaded crates that registry paths refer to. A path may be a
+    shell-style pattern, like 'databio/*'; a pattern without a tag matches
+    every tag, while a plain path without one means the 'default' tag.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :param str | list registry_paths: registry paths or patterns,
+        comma-separated or as a list
+    :return list: (crate key, cratevars, crate folder) tuples, sorted by key
+    """
+    if isinstance(registry_paths, str):
+        registry_paths = registry_paths.split(",")
+    namespace = bcfg["bulker"]["default_namespace"]
+    patterns = []
+    for path in registry_paths:
+        if _is_pattern(path):
+            crate, _, tag = path.partition(":")
+            if "/" not in crate:
+                crate = namespace + "/" + crate
+            patterns.append("{}:{}".format(crate, tag or "*"))
+        else:
+            patterns.append("{namespace}/{crate}:{tag}".format(
+                **parse_registry_path(path, namespace)))
+    found = []
+    for ns, crate, tag, path in loaded_crates(bcfg):
+        key = "{}/{}:{}".format(ns, crate, tag)
+        if any(fnmatchcase(key, pattern) for pattern in patterns):
+            found.append((key, {"namespace": ns, "crate": crate, "tag": tag}, path))
+    return sorted(found, key=lambda crate: crate[0])
+
+
+def crate_loaded_times(bcfg):
+    """
+    When each loaded crate was last loaded: as recorded by an sqlite
+    registry, or else (as for crates the registry was seeded with) when its
+    current generation folder was created.
+
+    :param yacman.YAMLConfigManager bcfg: bulker config object
+    :return dict: crate key -> time, in seconds since the epoch; crates
+        missing from disk are left out
+    """
+    registry = crate_registry(bcfg)
+    recorded = registry.loaded_times() if registry else {}
+    times = {}
+    for namespace, crate, tag, path in loaded_crates(bcfg):
+        key = "{}/{}:{}".format(namespace, crate, tag)
+        if key in recorded:
+            times[key] = recorded[key]
+            continue
+        try:
+            times[key] = os.stat(path).st_mtime
+        except OSError:
+            pass
+    return times
+
+
+def bulker_unload(bulker_config, crate_registry_paths, older_than=None, gc=False):
+    """
+    Unloads crates: removes them from the registry and moves their folders
+    to the trash, for 'bulker gc' to delete, in one locked update.
+
+    :param yacman.YAMLConfigManager bulker_config: bulker config object, not
+        locked
+    :param str | list crate_registry_paths: crates to unload; registry paths
+        or shell-style patterns such as 'databio/*' (see match_crates)
+    :param float older_than: only unload those of the crates last loaded
+        more than this many days ago
+    :param bool gc: empty the trash in the background afterwards
+    :return list[str]: keys of the unloaded crates
+    """
     _LOGGER.info("Unloading crates: {}".format(crate_registry_paths))
-    removed_crates = []
-    for cratemeta in cratelist:
-        namespace = cratemeta['namespace']
-        if namespace in bulker_config["bulker"]["crates"]:
-            crate = cratemeta['crate']
-            # print(bulker_config["bulker"].crates[namespace])
-            if crate in bulker_config["bulker"]["crates"][namespace]:
-                tag = cratemeta['tag']
-                # print(bulker_config["bulker"].crates[namespace][crate])
-                if tag in bulker_config["bulker"]["crates"][namespace][crate]:
-                    regpath = "{namespace}/{crate}:{tag}".format(
-                        namespace=namespace,
-                        crate=crate, 
-                        tag=tag)
-                    _LOGGER.info("Removing crate: '{}'".format(regpath))
-                    crate_path = bulker_config["bulker"]["crates"][namespace][crate][tag]
-                    with write_lock(bulker_config) as locked_cfg:
-                        del locked_cfg["bulker"]["crates"][namespace][crate][tag]
-                        if len(locked_cfg["bulker"]["crates"][namespace][crate]) == 0:
-                            _LOGGER.info("Last tag!")
-                            del locked_cfg["bulker"]["crates"][namespace][crate]
-                        locked_cfg.write()
-                    try:
-                        shutil.rmtree(crate_path)
-                    except:
-                        _LOGGER.error("Error removing crate at {}. Did your crate path change? Remove it manually.".format(crate_path))
-                    removed_crates.append(regpath)
+    found = []
+
+    def trash_found():
+        # Still locked, so a crate loaded again at the same path by another
+        # process can't be trashed in place of the one unloaded here
+        for key, cratevars, crate_path in found:
+            try:
+                trash_crate_folder(bulker_config, crate_path)
+            except OSError:
+                _LOGGER.error("Error removing crate at {}. Did your crate path change? Remove it manually.".format(crate_path))
+
+    with registry_update(bulker_config, on_commit=trash_found) as locked_cfg:
+        found.extend(match_crates(locked_cfg, crate_registry_paths))
+        if older_than is not None:
+            cutoff = time.time() - older_than * 86400
+            loaded = crate_loaded_times(locked_cfg)
+            found[:] = [crate for crate in found if loaded.get(crate[0], 0) < cutoff]
+        for key, cratevars, crate_path in found:
+            _LOGGER.info("Removing crate: '{}'".format(key))
+            register_crate(locked_cfg, cratevars, None)
+    removed_crates = [key for key, cratevars, crate_path in found]
 
     if len(removed_crates) > 0:
         _LOGGER.info("Removed crates: {}".format(str(removed_crates)))
+        if gc:
+            start_background_gc(bulker_config)
+        else:
+            _LOGGER.info("Run 'bulker gc' to free their disk space.")
+        if bulker_config["bulker"]["container_engine"] == "singularity":
+            _LOGGER.info("Run 'bulker images gc' to remove images no crate uses.")
     else:
         _LOGGER.info("No crates found with that name to remove.")
+    return removed_crates
+
+
+def _finish_profile(args, started):
+    """ Report the spans recorded during this run, as requested on the command line """
+    global _SPANS
+    wall_seconds = time.perf_counter() - started
+    with _SPANS_LOCK:
+        if _SPANS is None:
+            return  # already reported, before exec
+        spans, _SPANS = _SPANS, None
+    if args.profile_json:
+        try:
+            write_spans(spans, args.profile_json)
+        except OSError as e:
+            _LOGGER.error("Couldn't write profile: {}".format(e))
+    if args.profile:
+        profile_report(spans, wall_seconds)
 
 
 def main():
@@ -1249,6 +4167,13 @@ def main():
 
     _LOGGER.debug("Command given: {}".format(args.command))
 
+    if args.profile or args.profile_json:
+        start_profile()
+        finish = partial(_finish_profile, args, time.perf_counter())
+        atexit.register(finish)
+        # run and activate replace the process, so atexit never gets to it
+        runtime.before_exec(finish)
+
     if not args.command:
         parser.print_help()
         _LOGGER.error("No command given")
@@ -1288,10 +4213,21 @@ def main():
         bm_cfg.write_copy(args.manifest)
         sys.exit(0)
 
+    if args.command == "images" and args.action == "pull" and args.path:
+        # What every singularity wrapper runs for a missing image; the image
+        # path is all it needs, so skip reading (and maybe seeding) a config
+        if not args.target:
+            parser.error("'bulker images pull' needs a target")
+        sys.exit(0 if pull_singularity_image(args.target, args.path) else 1)
+
     # Any remaining commands require config so we process it now.
 
     bulkercfg = select_bulker_config(args.config)
-    bulker_config = yacman.YAMLConfigManager.from_yaml_file(bulkercfg)
+    with span("config parse"):
+        # Taken before parsing, so a write in between can't be missed
+        config_mtime = os.stat(bulkercfg).st_mtime_ns
+        bulker_config = yacman.YAMLConfigManager.from_yaml_file(bulkercfg)
+        load_crate_registry(bulker_config)
     # _LOGGER.info("Bulker config: {}".format(bulkercfg))
 
     if args.command == "envvars":
@@ -1313,14 +4249,8 @@ def main():
             sys.exit(1)
         manifest, cratevars = load_remote_registry_path(bulker_config, 
                                                     args.crate_registry_paths,
-                                                    None)
-        manifest_name = cratevars['crate']
-        crate_path = os.path.join(bulker_config["bulker"]["default_crate_folder"],
-                                  cratevars['namespace'],
-                                  manifest_name,
-                                  cratevars['tag'])
-        if not os.path.isabs(crate_path):
-            crate_path = os.path.join(os.path.dirname(bulker_config.filepath), crate_path)
+                                                    None, args.offline)
+        crate_path = crate_folder(bulker_config, cratevars)
         print("Crate path: {}".format(crate_path))
 
         
@@ -1331,6 +4261,8 @@ def main():
         available_commands.sort(key=lambda y: y.lower())
 
         print("Available commands: {}".format(available_commands))
+        if args.args:
+            bulker_inspect_args(bulker_config, manifest)
 
     if args.command == "list":
         # Output header via logger and content via print so the user can
@@ -1345,6 +4277,8 @@ def main():
                         for tag, path in tags.items():
                             crateslist.append(fmt.format(namespace=namespace, crate=crate, 
                                             tag=tag, path=path))
+            crateslist.extend(key for key in store_crates(bulker_config)
+                              if key not in crateslist)
 
             print(" ".join(crateslist))
 
@@ -1352,25 +4286,35 @@ def main():
             _LOGGER.info("Available crates:")
             fmt = "{namespace}/{crate}:{tag} -- {path}"
 
+            shared = store_crates(bulker_config)
             if bulker_config["bulker"]["crates"]:
                 for namespace, crates in bulker_config["bulker"]["crates"].items():
                     for crate, tags in crates.items():
                         for tag, path in tags.items():
                             print(fmt.format(namespace=namespace, crate=crate, 
                                             tag=tag, path=path))
-            else:
+                            shared.pop("{}/{}:{}".format(namespace, crate, tag), None)
+            elif not shared:
                 _LOGGER.info("No crates available. Use 'bulker load' to load a crate.")
+            for key, path in shared.items():
+                print("{} -- {} (crate store)".format(key, path))
         sys.exit(1)
 
     # For all remaining commands we need a crate identifier
 
+    if args.command in ["activate", "run"] and \
+            not runtime.read_registry_index(bulkercfg):
+        # Refresh the index so the next call can skip the YAML config
+        refresh_registry_index(bulker_config, config_mtime)
+
     if args.command == "activate":
         try:
             cratelist = parse_registry_paths(args.crate_registry_paths,
                                              bulker_config["bulker"]["default_namespace"])
             _LOGGER.debug(cratelist)
             _LOGGER.info("Activating bulker crate: {}{}".format(args.crate_registry_paths, " (Strict)" if args.strict else ""))
-            bulker_activate(bulker_config, cratelist, echo=args.echo, strict=args.strict, prompt=args.no_prompt)
+            bulker_activate(bulker_config, cratelist, echo=args.echo, strict=args.strict,
+                            prompt=args.no_prompt, warm=args.warm)
         except KeyError as e:
             parser.print_help(sys.stderr)
             _LOGGER.error("{} is not an available crate. Run 'bulker list' to see loaded crates.".format(e))
@@ -1386,7 +4330,8 @@ def main():
         try:
             cratelist = parse_registry_paths(args.crate_registry_paths)
             _LOGGER.info("Activating crate: {}\n".format(args.crate_registry_paths))
-            bulker_run(bulker_config, cratelist, args.cmd, strict=args.strict)
+            bulker_run(bulker_config, cratelist, args.cmd, strict=args.strict,
+                       supervise=args.supervise, warm=args.warm)
         except KeyError as e:
             parser.print_help(sys.stderr)
             _LOGGER.error("{} is not an available crate. Run 'bulker list' to see loaded crates.".format(e))
@@ -1395,10 +4340,40 @@ def main():
             _LOGGER.error("Missing crate: {}. Run 'bulker list' to see loaded crates, or 'bulker load' to add one.".format(e))
             sys.exit(1)        
 
+    if args.command == "load" and args.bundle:
+        try:
+            with registry_update(bulker_config) as locked_cfg:
+                bulker_load_bundle(locked_cfg, args.bundle, force=args.force)
+        except BulkerError as e:
+            _LOGGER.error(str(e))
+            sys.exit(1)
+        sys.exit(0)
+
     if args.command == "load":
-        with write_lock(bulker_config) as _:
+        registry_paths = []
+        if args.crate_registry_paths:
+            registry_paths = [p for p in args.crate_registry_paths.split(",") if p]
+        if args.from_file:
+            registry_paths.extend(read_crate_list(args.from_file))
+        if not registry_paths:
+            parser.error("Specify crates to load, or --from-file")
+        if len(registry_paths) > 1 or args.from_file:
+            if args.manifest or args.path:
+                parser.error("-m/--manifest and -p/--path load a single crate")
+            with registry_update(bulker_config) as locked_cfg:
+                results = bulker_load_batch(locked_cfg, registry_paths, build=args.build,
+                                            force=args.force, recurse=args.recurse,
+                                            build_jobs=args.jobs, offline=args.offline,
+                                            write_config=False)
+            sys.exit(1 if any(r[0] != "ok" for r in results.values()) else 0)
+        args.crate_registry_paths = registry_paths[0]
+
+        # Locks aren't re-entrant, so lock once here and save the registry
+        # ourselves rather than from bulker_load.
+        with registry_update(bulker_config) as locked_cfg:
             manifest, cratevars, exe_template_jinja, shell_template_jinja, build_template_jinja = prep_load(
-                bulker_config, args.crate_registry_paths, args.manifest, args.build)
+                bulker_config, args.crate_registry_paths, args.manifest, args.build,
+                args.offline)
 
             try:
                 bulker_load(manifest, cratevars, bulker_config, 
@@ -1407,7 +4382,10 @@ def main():
                         crate_path=args.path,
                         build=build_template_jinja,
                         force=args.force,
-                        recurse=args.recurse)
+                        recurse=args.recurse,
+                        build_jobs=args.jobs,
+                        offline=args.offline,
+                        write_config=False)
             except Exception as e:
                 print(f'Bulker load failed: {e}')
                 sys.exit(1)
@@ -1415,11 +4393,114 @@ def main():
 
     if args.command == "reload":
         _LOGGER.info("Reloading all manifests")
-        with write_lock(bulker_config) as _:
-            bulker_reload(bulker_config)
+        with registry_update(bulker_config) as locked_cfg:
+            results = bulker_reload(locked_cfg, offline=args.offline, jobs=args.jobs,
+                                    write_config=False)
+        if any(status != "ok" for status, _, _ in results.values()):
+            sys.exit(1)
 
     if args.command == "unload":
-        bulker_unload(bulker_config, args.crate_registry_paths)
+        bulker_unload(bulker_config, args.crate_registry_paths,
+                      older_than=args.older_than, gc=args.gc)
+
+    if args.command == "gc":
+        bulker_gc(bulker_config, dry_run=args.dry_run)
+        sys.exit(0)
+
+    if args.command in ["which", "search"]:
+        if args.command == "which":
+            found = find_commands(bulker_config, args.cmd, exact=True)
+        else:
+            found = find_commands(bulker_config, args.pattern)
+        if not found:
+            _LOGGER.info("No loaded crate provides a matching command.")
+            sys.exit(1)
+        print_commands(found)
+        sys.exit(0)
+
+    if args.command == "stats":
+        try:
+            bulker_stats(bulker_config, clear=args.clear)
+        except BulkerError as e:
+            _LOGGER.error(str(e))
+            sys.exit(1)
+        sys.exit(0)
+
+    if args.command == "registry":
+        if args.action == "export":
+            bulker_registry_export(bulker_config, args.output)
+        elif not args.file:
+            parser.error("Specify a YAML file to import")
+        else:
+            with registry_update(bulker_config) as locked_cfg:
+                bulker_registry_import(locked_cfg, args.file)
+        sys.exit(0)
+
+    if args.command == "bundle":
+        cratelist = parse_registry_paths(args.crate_registry_paths,
+                                         bulker_config["bulker"]["default_namespace"])
+        output = args.output or "{namespace}_{crate}_{tag}.tar".format(**cratelist[0])
+        try:
+            bulker_bundle(bulker_config, cratelist, output, images=args.images)
+        except MissingCrateError as e:
+            _LOGGER.error("Missing crate: {}. Run 'bulker list' to see loaded crates.".format(e))
+            sys.exit(1)
+        except BulkerError as e:
+            _LOGGER.error(str(e))
+            sys.exit(1)
+
+    if args.command == "freeze":
+        try:
+            write_lockfile(bulker_freeze(bulker_config, digests=args.digests), args.output)
+        except LockfileError as e:
+            _LOGGER.error(str(e))
+            sys.exit(1)
+
+    if args.command == "restore":
+        try:
+            with registry_update(bulker_config) as locked_cfg:
+                results = bulker_restore(locked_cfg, args.lockfile, build=args.build,
+                                         build_jobs=args.jobs, write_config=False)
+        except LockfileError as e:
+            _LOGGER.error(str(e))
+            sys.exit(1)
+        restored = [parse_registry_path(key) for key, r in results.items() if r[0] == "ok"]
+        failed_images = []
+        if args.prefetch and restored:
+            # After releasing the config lock, since pulls can take a while.
+            # Images are fetched by their frozen digests, not their tags.
+            failed_images = bulker_images_prefetch(
+                bulker_config, restored, jobs=args.jobs,
+                digests=lockfile_digests(read_lockfile(args.lockfile)))
+        sys.exit(1 if len(restored) < len(results) or failed_images else 0)
+
+    if args.command == "cache":
+        bulker_cache(bulker_config, args.action, older_than=args.older_than)
+
+    if args.command == "images":
+        if args.action in ["list", "gc"]:
+            try:
+                if args.action == "list":
+                    bulker_images_list(bulker_config)
+                else:
+                    bulker_images_gc(bulker_config, dry_run=args.dry_run)
+            except BulkerError as e:
+                _LOGGER.error(str(e))
+                sys.exit(1)
+            sys.exit(0)
+        if not args.target:
+            parser.error("'bulker images {}' needs a target".format(args.action))
+        if args.action == "pull":
+            image_path = singularity_image_path(bulker_config, args.target)
+            sys.exit(0 if pull_singularity_image(args.target, image_path) else 1)
+        try:
+            cratelist = parse_registry_paths(args.target,
+                                             bulker_config["bulker"]["default_namespace"])
+            failed = bulker_images_prefetch(bulker_config, cratelist, jobs=args.jobs)
+        except MissingCrateError as e:
+            _LOGGER.error("Missing crate: {}. Run 'bulker list' to see loaded crates.".format(e))
+            sys.exit(1)
+        sys.exit(1 if failed else 0)
 
 
 if __name__ == '__main__':
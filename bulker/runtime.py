@@ -0,0 +1,730 @@
+""" Activating crates and running crate commands, with minimal start-up cost.
+
+`bulker run` and `bulker activate` are called far more often than anything
+else, so they start here. This module may only import the standard library at
+module level; when the registry index written beside the config is current,
+these commands never import yacman, jinja2, logmuse or ubiquerg at all.
+Anything unusual falls through to the full CLI in `bulker.bulker`.
+"""
+
+import json
+import logging
+import os
+import signal
+import sys
+
+from shutil import which
+
+_LOGGER = logging.getLogger(__name__)
+
+PROC = -1
+
+# Called just before the process is replaced by a command or shell, since
+# exec skips atexit handlers; see before_exec
+_BEFORE_EXEC = []
+
+# Config settings `bulker activate` needs, copied verbatim into the index.
+ACTIVATE_SETTINGS = ["shell_path", "shell_rc", "shell_prompt", "rcfile",
+                     "rcfile_strict", "envvars", "warm_idle_timeout"]
+
+# Setting this to anything non-empty disables the fast path.
+NO_FASTPATH_ENVVAR = "BULKER_NO_FASTPATH"
+
+DEFAULT_WARM_IDLE_TIMEOUT = 600  # seconds
+WARM_POLL_INTERVAL = 5  # seconds
+WARM_LOCK_TIMEOUT = 120  # seconds before a container start is presumed dead
+WARM_LOCK_GRACE = 5  # seconds before a lock whose wrapper has exited is cleared
+# Processes in an idle warm container: docker's init and the keep-alive tail
+WARM_IDLE_PROCESSES = 2
+
+
+def mkabs(path, reldir=None):
+    """
+    Makes sure a path is absolute; if not already absolute, it's made absolute
+    relative to a given directory. Also expands ~ and environment variables for
+    kicks.
+
+    :param str path: Path to make absolute
+    :param str reldir: Relative directory to make path absolute from if it's
+        not already absolute
+
+    :return str: Absolute path
+    """
+    def xpand(path):
+        return os.path.expandvars(os.path.expanduser(path))
+
+    if os.path.isabs(xpand(path)):
+        return xpand(path)
+
+    if not reldir:
+        return os.path.abspath(xpand(path))
+
+    return os.path.join(xpand(reldir), xpand(path))
+
+
+def registry_index_path(config_path):
+    """
+    Path of the registry index kept beside a bulker config file.
+
+    :param str config_path: path to the bulker config file
+    :return str: path to the index file
+    """
+    folder, name = os.path.split(os.path.abspath(config_path))
+    return os.path.join(folder, ".{}.index.json".format(name))
+
+
+def read_registry_index(config_path):
+    """
+    Read the registry index for a config, if it is still current.
+
+    The index records the modification time of the config it was built from,
+    and of any crate stores it lists; if one has changed since (say, edited by
+    hand), the index is ignored.
+
+    :param str config_path: path to the bulker config file
+    :return dict: the index, or None if it is missing or stale
+    """
+    try:
+        with open(registry_index_path(config_path)) as f:
+            index = json.load(f)
+        if index["config_mtime"] != os.stat(config_path).st_mtime_ns:
+            _LOGGER.debug("Registry index is stale: {}".format(config_path))
+            return None
+        for store_path, mtime in index.get("stores", {}).items():
+            if os.stat(store_path).st_mtime_ns != mtime:
+                _LOGGER.debug("Crate store changed: {}".format(store_path))
+                return None
+        index["crates"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    return index
+
+
+def crate_search_path(crate_paths, strict=False):
+    """
+    Build a PATH value with the given crate folders in front.
+
+    :param list crate_paths: local crate folders, in priority order
+    :param bool strict: leave out the existing PATH entirely
+    :return str: the new PATH
+    """
+    cratepaths = "".join(path + os.pathsep for path in crate_paths)
+    if strict:
+        return cratepaths
+    return cratepaths + os.environ["PATH"]
+
+
+def start_warm_session(settings, owner_pid):
+    """
+    Start a warm session, in which crate commands reuse long-lived containers.
+
+    Warm-capable wrappers start one container per image the first time they
+    run inside the session (found through the BULKERWARMDIR environment
+    variable, which this sets) and then dispatch with `docker exec`. A
+    detached reaper stops containers that sit idle and tears the session
+    down once the owning process exits.
+
+    :param Mapping settings: the 'bulker' section of the config, or the same
+        keys as stored in the registry index
+    :param int owner_pid: the session ends when this process exits
+    :return str: path to the session folder
+    """
+    import subprocess
+    import tempfile
+    warm_dir = tempfile.mkdtemp(prefix="bulker-warm-")
+    idle_timeout = settings.get("warm_idle_timeout", DEFAULT_WARM_IDLE_TIMEOUT)
+    reaper = "import sys; from bulker.runtime import warm_reaper; " \
+        "warm_reaper(sys.argv[1], int(sys.argv[2]), float(sys.argv[3]))"
+    subprocess.Popen([sys.executable, "-c", reaper, warm_dir, str(owner_pid),
+                      str(idle_timeout)], start_new_session=True,
+                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL)
+    os.environ["BULKERWARMDIR"] = warm_dir
+    _LOGGER.debug("Warm session: {}".format(warm_dir))
+    return warm_dir
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _warm_container_busy(container):
+    """ Is anything besides the keep-alive running in a warm container? """
+    import subprocess
+    try:
+        top = subprocess.run(["docker", "top", container, "-o", "pid"],
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                             universal_newlines=True, timeout=30)
+    except (OSError, subprocess.TimeoutExpired):
+        return False
+    # One header line, then one line per process
+    return top.returncode == 0 and \
+        len(top.stdout.splitlines()) - 1 > WARM_IDLE_PROCESSES
+
+
+def _lock_holder_alive(lock):
+    """ Is the wrapper that took a warm container lock still running? """
+    pid = _read_marker(os.path.join(lock, "pid"))
+    return bool(pid and pid.isdigit() and _pid_alive(int(pid)))
+
+
+def _read_marker(marker):
+    try:
+        with open(marker) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _remove_containers(containers):
+    import subprocess
+    if containers:
+        _LOGGER.debug("Removing warm containers: {}".format(containers))
+        subprocess.run(["docker", "rm", "--force"] + containers,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def _stop_warm_container(marker):
+    """ Retire a warm container so new calls start cold, then remove it """
+    container = _read_marker(marker)
+    try:
+        os.remove(marker)
+    except OSError:
+        return
+    _remove_containers([container] if container else [])
+
+
+def _stop_warm_session(warm_dir):
+    """ Remove every container started in a warm session, then its folder """
+    import shutil
+    import subprocess
+    try:
+        found = subprocess.run(
+            ["docker", "ps", "--all", "--quiet", "--filter",
+             "label=bulker.warm={}".format(warm_dir)],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            universal_newlines=True).stdout.split()
+    except OSError:
+        found = []
+    _remove_containers(found)
+    shutil.rmtree(warm_dir, ignore_errors=True)
+
+
+def warm_reaper(warm_dir, owner_pid, idle_timeout, poll=WARM_POLL_INTERVAL):
+    """
+    Watch a warm session: stop containers idle for longer than the timeout,
+    clear locks left by wrappers that died while starting one, and stop all
+    of them and remove the session folder once the owner exits.
+
+    :param str warm_dir: path to the session folder
+    :param int owner_pid: process whose exit ends the session
+    :param float idle_timeout: seconds a container may sit unused
+    :param float poll: seconds between checks
+    """
+    import shutil
+    import time
+    while _pid_alive(owner_pid):
+        now = time.time()
+        try:
+            names = os.listdir(warm_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(warm_dir, name)
+            try:
+                age = now - os.stat(path).st_mtime
+            except OSError:
+                continue
+            if name.endswith(".lock") or name.endswith(".tmp"):
+                if age > WARM_LOCK_TIMEOUT or (name.endswith(".lock") and
+                        age > WARM_LOCK_GRACE and not _lock_holder_alive(path)):
+                    shutil.rmtree(path, ignore_errors=True)
+                continue
+            if name.endswith(".failed"):
+                # Containers of this image couldn't start; stay cold
+                continue
+            if age > idle_timeout:
+                container = _read_marker(path)
+                if container and _warm_container_busy(container):
+                    # Long-running commands don't touch the marker
+                    os.utime(path)
+                else:
+                    _stop_warm_container(path)
+        time.sleep(poll)
+    _stop_warm_session(warm_dir)
+
+
+def activate(settings, config_dir, newpath, name, echo=False, strict=False,
+             prompt=True, warm=False):
+    """
+    Start a shell (or echo the exports) for an already-resolved crate PATH.
+
+    :param Mapping settings: the 'bulker' section of the config, or the same
+        keys as stored in the registry index
+    :param str config_dir: folder of the config file, for relative rcfiles
+    :param str newpath: PATH with the crate folders in front
+    :param str name: crate name shown in the prompt and BULKERCRATE
+    :param bool echo: Should we just echo the new PATH to create? Otherwise, the
+        function will create a new shell and replace the current process with
+        it.
+    :param bool strict: Should we wipe out the PATH, such that the returned
+        environment contains strictly only commands listed in the bulker
+        manifests?
+    :param bool prompt: Should we reset the shell prompt?
+    :param bool warm: Start a warm session (see start_warm_session) that
+        lasts as long as the new shell; with echo, as long as the calling shell
+    """
+    # activating is as simple as adding a crate folder to the PATH env var.
+
+    new_env = os.environ
+
+
+    if "shell_path" in settings:
+        shellpath = os.path.expandvars(settings["shell_path"])
+    else:
+        shellpath = os.path.expandvars("$SHELL")
+
+    if not which(shellpath):
+        bashpath = "/bin/bash"
+        _LOGGER.warning("Specified shell is not callable: '{}'. Using {}.".format(shellpath, bashpath))
+        shell_list = [bashpath, bashpath]
+
+
+    if "shell_rc" in settings:
+        shell_rc = os.path.expandvars(settings["shell_rc"])
+    else:
+        if os.path.basename(shellpath) == "bash":
+            shell_rc = "$HOME/.bashrc"
+        elif os.path.basename(shellpath) == "zsh":
+            shell_rc = "$HOME/.zshrc"
+        else:
+            _LOGGER.warning("No shell RC specified shell")
+
+    if os.path.basename(shellpath) == "bash":
+        shell_list = [shellpath, shellpath, "--noprofile"]
+    elif os.path.basename(shellpath) == "zsh":
+        shell_list = [shellpath, shellpath]
+    else:
+        bashpath = "/bin/bash"
+        _LOGGER.warning("Shell must be bash or zsh. Specified shell was: '{}'. Using {}.".format(shellpath, bashpath))
+        shell_list = [bashpath, bashpath, "--noprofile"]
+
+    _LOGGER.debug("Newpath: {}".format(newpath))
+
+
+    if "shell_prompt" in settings:
+        ps1 = settings["shell_prompt"]
+    else:
+        if os.path.basename(shellpath) == "bash":
+            ps1 = "\\u@\\b:\\w\\a\\$ "
+            # With color:
+            ps1 = "\\[\\033[01;93m\\]\\b|\\[\\033[00m\\]\\[\\033[01;34m\\]\\w\\[\\033[00m\\]\\$ "
+        elif os.path.basename(shellpath) == "zsh":
+            ps1 = "%F{226}%b|%f%F{blue}%~%f %# "
+        else:
+            ps1 = ""
+            prompt = False
+            _LOGGER.warning("No built-in custom prompt for shells other than bash or zsh")
+
+    # \b is our bulker-specific code that we populate with the crate
+    # registry path
+    ps1 = ps1.replace("\\b", name)  # for bash
+    ps1 = ps1.replace("%b", name)  # for zsh
+    _LOGGER.debug(ps1)
+
+    if warm:
+        start_warm_session(settings, os.getppid() if echo else os.getpid())
+
+    if echo:
+        if warm:
+            print("export BULKERWARMDIR=\"{}\"".format(os.environ["BULKERWARMDIR"]))
+        print("export BULKERCRATE=\"{}\"".format(name))
+        print("export BULKERPATH=\"{}\"".format(newpath))
+        print("export BULKERSHELLRC=\"{}\"".format(shell_rc))
+        if prompt:
+            print("export BULKERPROMPT=\"{}\"".format(ps1))
+            print("export PS1=\"{}\"".format(ps1))
+        print("export PATH={}".format(newpath))
+        return
+    else:
+        _LOGGER.debug("Shell list: {}". format(shell_list))
+
+        new_env["BULKERCRATE"] = name
+        new_env["BULKERPATH"] = newpath
+        if prompt:
+            new_env["BULKERPROMPT"] = ps1
+
+        new_env["BULKERSHELLRC"] = shell_rc
+
+        if strict:
+            for k in settings["envvars"]:
+                new_env[k] = os.environ.get(k, "")
+
+        if os.path.basename(shellpath) == "bash":
+            if strict:
+                rcfile = mkabs(settings["rcfile_strict"], config_dir)
+            else:
+                rcfile = mkabs(settings["rcfile"], config_dir)
+
+            shell_list.append("--rcfile")
+            shell_list.append(rcfile)
+            _LOGGER.debug("rcfile: {}".format(rcfile))
+            _LOGGER.debug(shell_list)
+
+        if os.path.basename(shellpath) == "zsh":
+            if strict:
+                rcfolder = mkabs(os.path.join(
+                    os.path.dirname(settings["rcfile_strict"]),
+                    "zsh_start_strict"), config_dir)
+            else:
+                rcfolder = mkabs(os.path.join(
+                    os.path.dirname(settings["rcfile_strict"]),
+                    "zsh_start"), config_dir)
+
+            new_env["ZDOTDIR"] = rcfolder
+            _LOGGER.debug("ZDOTDIR: {}".format(new_env["ZDOTDIR"]))
+
+        _LOGGER.debug(new_env)
+        _run_before_exec()
+        #os.execv(shell_list[0], shell_list[1:])
+        os.execve(shell_list[0], shell_list[1:], env=new_env)
+
+         # The 'v' means 'pass a variable with a list of args' vs. 'l' which is
+        # a list of separate args.
+        # The 'e' means add the 'env' to replace any environment variables
+
+
+def before_exec(func):
+    """
+    Register a function to call just before `run` or `activate` replace the
+    process, which skips atexit handlers.
+
+    :param callable func: function taking no arguments
+    """
+    _BEFORE_EXEC.append(func)
+
+
+def _run_before_exec():
+    for func in _BEFORE_EXEC:
+        func()
+    # Python's buffers don't survive exec
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+
+def run(newpath, command, supervise=False):
+    """
+    Run a command with the given PATH, replacing the current process.
+
+    The command is resolved against the new PATH and exec'd directly with its
+    argument list, so there is no intermediate shell and no Python process
+    left waiting on it.
+
+    :param str newpath: PATH with the crate folders in front
+    :param list command: the command and its arguments
+    :param bool supervise: instead run the command in a shell under a Python
+        supervisor that cleans up the whole process group on interrupt
+    """
+    _LOGGER.debug("Running: {}".format(command))
+    if not command:
+        _LOGGER.error("No command to run. Usage: bulker run CRATE COMMAND [ARGS ...]")
+        sys.exit(2)
+    if supervise:
+        supervised_run(newpath, command)
+    os.environ["PATH"] = newpath
+    if len(command) == 1 and " " in command[0] and not which(command[0], path=newpath):
+        # A single quoted argument, like "fortune | cowsay", is a shell command
+        command = ["/bin/sh", "-c", command[0]]
+    if not which(command[0], path=newpath):
+        _LOGGER.error("Command not found in crate PATH: '{}'".format(command[0]))
+        sys.exit(127)
+    _run_before_exec()
+    try:
+        os.execvpe(command[0], command, os.environ)
+    except OSError as e:
+        _LOGGER.error("Couldn't run '{}': {}".format(command[0], e))
+        sys.exit(126)
+
+
+def supervised_run(newpath, command):
+    """
+    Run a command in a shell under a supervising Python process, and exit with
+    its return code. Interrupts are forwarded to the command's children.
+
+    :param str newpath: PATH with the crate folders in front
+    :param list command: the command and its arguments
+    """
+    def maybe_quote(item):
+        if ' ' in item:
+            return "\"{}\"".format(item)
+        else:
+            return item
+
+    quoted_command = [maybe_quote(x) for x in command]
+    os.environ["PATH"] = newpath
+    export = "export PATH=\"{}\"".format(newpath)
+    merged_command = "{export}; {command}".format(export=export, command=" ".join(quoted_command))
+    _LOGGER.debug("{}".format(merged_command))
+    # os.system(merged_command)
+    # os.execlp(command[0], merged_command)
+    import psutil
+    signal.signal(signal.SIGINT, _generic_signal_handler)
+    signal.signal(signal.SIGTERM, _generic_signal_handler)
+    # process = subprocess.call(merged_command, shell=True)
+    global PROC
+    PROC = psutil.Popen(merged_command, shell=True, preexec_fn=os.setsid)
+    PROC.communicate()
+    sys.exit(PROC.returncode)
+    #command[0:0] = ["export", "PATH=\"{}\"".format(newpath)]
+    #subprocess.call(merged_command)
+
+def _generic_signal_handler(sig, frame):
+    """
+    Function for handling both SIGTERM and SIGINT
+    """
+    import psutil
+
+    global PROC
+    message = "Interrupt received. Bulker (pid: {}) failing gracefully...".format(PROC.pid)
+    _LOGGER.info(message)
+    sys.stdout.flush()
+    try:
+        parent_process = psutil.Process(PROC.pid)
+        print("children:", [x for x in parent_process.children(recursive=False)])
+        for child_proc in parent_process.children(recursive=False):
+            _kill_process(child_proc.pid)
+    except psutil.NoSuchProcess:
+        print("already dead")
+        return
+    _kill_process(PROC.pid)
+    PROC.wait(timeout=5)
+    sys.stdout.flush()
+
+    sys.exit(1)
+
+
+def _attend_process( proc, sleeptime):
+    """
+    Waits on a process for a given time to see if it finishes, returns True
+    if it's still running after the given time or False as soon as it
+    returns.
+
+    :param psutil.Popen proc: Process object opened by psutil.Popen()
+    :param float sleeptime: Time to wait
+    :return bool: True if process is still running; otherwise false
+    """
+    import psutil
+    # print("attend:{}".format(proc.pid))
+    try:
+        proc.wait(timeout=sleeptime)
+    except psutil.TimeoutExpired:
+        return True
+    return False
+
+def _kill_process(pid, sig=signal.SIGINT, proc_name=None):
+    """
+    Pypiper spawns subprocesses. We need to kill them to exit gracefully,
+    in the event of a pipeline termination or interrupt signal.
+    By default, child processes are not automatically killed when python
+    terminates, so Pypiper must clean these up manually.
+    Given a process ID, this function just kills it.
+
+    :param int pid: Process id.
+    """
+
+    # When we kill process, it turns into a zombie, and we have to reap it.
+    # So we can't just kill it and then let it go; we call wait
+    import psutil
+
+    if pid is None:
+        return
+
+    try:
+        parent_process = psutil.Process(pid)
+        sys.stdout.flush()
+        time_waiting = 0
+        sleeptime = .25
+        still_running = _attend_process(psutil.Process(pid), 0)
+
+        while still_running and time_waiting < 3:
+            if time_waiting > 2:
+                sig = signal.SIGKILL
+            elif time_waiting > 1:
+                sig = signal.SIGTERM
+            else:
+                sig = signal.SIGINT
+
+            _LOGGER.debug("Sending sig {} to proc {}".format(sig, pid))
+            parent_process.send_signal(sig)
+
+            # Now see if it's still running
+            time_waiting = time_waiting + sleeptime
+            if not _attend_process(psutil.Process(pid), sleeptime):
+                still_running = False
+
+    except OSError:
+        # This would happen if the child process ended between the check
+        # and the next kill step
+        still_running = False
+        time_waiting = time_waiting + sleeptime
+        print("proc {} already dead 1".format(pid))
+    except psutil.NoSuchProcess:
+        still_running = False
+        time_waiting = time_waiting + sleeptime
+        print("proc {} already dead 1".format(pid))
+
+    if proc_name:
+        proc_string = " ({proc_name})".format(proc_name=proc_name)
+    else:
+        proc_string = " "
+
+    if still_running:
+        # still running!?
+        _LOGGER.warning("Bulker child process {pid}{proc_string} never responded"
+            "I just can't take it anymore. I don't know what to do...".format(pid=pid,
+                proc_string=proc_string))
+    else:
+        if time_waiting > 0:
+            note = "terminated after {time} sec".format(time=int(time_waiting))
+        else:
+            note = "was already terminated"
+
+        msg = "Bulker child process {pid}{proc_string} {note}.".format(
+            pid=pid, proc_string=proc_string, note=note)
+        _LOGGER.info(msg)
+
+
+def _parse_fast_args(argv):
+    """
+    Parse the arguments of a plain `run` or `activate` call.
+
+    Only the common forms are understood; anything else (global options,
+    combined short flags, help, remote crates) returns None so the full
+    argparse CLI can handle it.
+
+    :param list argv: command-line arguments, without the program name
+    :return dict: parsed arguments, or None
+    """
+    if not argv or argv[0] not in ["run", "activate"]:
+        return None
+    args = {"command": argv[0], "config": None, "strict": False,
+            "echo": False, "prompt": True, "supervise": False,
+            "warm": False, "crates": None, "cmd": []}
+    rest = argv[1:]
+    i = 0
+    while i < len(rest):
+        arg = rest[i]
+        if args["command"] == "run" and args["crates"] is not None:
+            args["cmd"] = rest[i:]
+            break
+        if arg in ["-c", "--config"]:
+            if i + 1 == len(rest):
+                return None
+            args["config"] = rest[i + 1]
+            i += 2
+            continue
+        if arg.startswith("--config="):
+            args["config"] = arg.split("=", 1)[1]
+        elif arg in ["-s", "--strict"]:
+            args["strict"] = True
+        elif args["command"] == "run" and arg == "--supervise":
+            args["supervise"] = True
+        elif arg == "--warm":
+            args["warm"] = True
+        elif args["command"] == "activate" and arg in ["-e", "--echo"]:
+            args["echo"] = True
+        elif args["command"] == "activate" and arg in ["-p", "--no-prompt"]:
+            args["prompt"] = False
+        elif arg.startswith("-") or args["crates"] is not None:
+            return None
+        else:
+            args["crates"] = arg
+        i += 1
+    if not args["crates"] or (args["command"] == "run" and not args["cmd"]):
+        return None
+    return args
+
+
+def _index_crates(index, paths, default_namespace):
+    """
+    Look up comma-separated crate registry paths in the registry index.
+
+    :param dict index: registry index
+    :param str paths: crate registry paths, e.g. 'bulker/demo,samtools:1.9'
+    :param str default_namespace: namespace for paths that don't give one
+    :return list: (namespace, crate, local path) tuples, or None if any path
+        is unusual or not in the index
+    """
+    found = []
+    for path in paths.split(","):
+        if not path or "://" in path or path.count("/") > 1:
+            return None
+        namespace, _, crate = path.rpartition("/")
+        crate, _, tag = crate.partition(":")
+        namespace = namespace or default_namespace
+        key = "{}/{}:{}".format(namespace, crate, tag or "default")
+        if not crate or key not in index["crates"]:
+            return None
+        found.append((namespace, crate, index["crates"][key]))
+    return found
+
+
+def fast_main(argv):
+    """
+    Serve `bulker run` or `bulker activate` straight from the registry index.
+
+    Returns only if the call can't be served this way; otherwise it replaces
+    or exits the process.
+
+    :param list argv: command-line arguments, without the program name
+    """
+    args = _parse_fast_args(argv)
+    if not args:
+        return
+    config_path = args["config"] or os.environ.get("BULKERCFG")
+    if not config_path or not os.path.isfile(config_path):
+        return
+    index = read_registry_index(config_path)
+    if not index:
+        return
+    if args["command"] == "run":
+        # Matches the full CLI, which resolves run paths in 'bulker'
+        default_namespace = "bulker"
+    else:
+        default_namespace = index.get("default_namespace", "bulker")
+    crates = _index_crates(index, args["crates"], default_namespace)
+    if not crates:
+        return
+    newpath = crate_search_path([path for _, _, path in crates],
+                                args["strict"])
+    if args["command"] == "run":
+        if args["warm"]:
+            start_warm_session(index, os.getpid())
+        run(newpath, args["cmd"], supervise=args["supervise"])
+    name = "{}/{}".format(crates[-1][0], crates[-1][1])
+    activate(index, os.path.dirname(os.path.abspath(config_path)), newpath,
+             name, echo=args["echo"], strict=args["strict"],
+             prompt=args["prompt"], warm=args["warm"])
+    sys.exit(0)
+
+
+def main():
+    """ Console entry point; falls back to the full CLI when needed """
+    try:
+        if not os.environ.get(NO_FASTPATH_ENVVAR):
+            fast_main(sys.argv[1:])
+        from .bulker import main as full_main
+        full_main()
+    except KeyboardInterrupt:
+        _LOGGER.error("Program canceled by user!")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,4 @@
+#! /bin/bash
+
+export PS1="${BULKERPROMPT}"
+export PATH="${BULKERPATH}"
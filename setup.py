@@ -48,7 +48,7 @@ setup(
     license="BSD2",
     entry_points={
         "console_scripts": [
-            'bulker = bulker.bulker:main'
+            'bulker = bulker.runtime:main'
         ],
     },    
     package_data={"bulker": [os.path.join("bulker", "*")]},
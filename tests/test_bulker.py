@@ -1,18 +1,89 @@
+import json
 import os
 import subprocess
+import sys
 import pytest
 
 import yacman
+import bulker.bulker
 from bulker.bulker import DEFAULT_CONFIG_FILEPATH
 from bulker.bulker import bulker_init, bulker_load, load_remote_registry_path, \
                           bulker_activate, parse_registry_paths
-from bulker.bulker import mkabs
+from bulker.bulker import mkabs, build_images, bulker_unload, crate_generations, bulker_cache, read_manifest_cache, \
+                          manifest_cache_folder, bulker_reload, load_templates, template_cache_folder, \
+                          ImportGraph, ImportCycleError, BulkerError, pull_singularity_image, \
+                          bulker_images_prefetch, bulker_images_gc, singularity_image_path, \
+                          ToolArgs, bulker_inspect_args, bulker_load_batch, read_crate_list, \
+                          bulker_freeze, bulker_restore, read_lockfile, write_lockfile, \
+                          lockfile_digests, pinned_image, \
+                          bulker_bundle, bulker_load_bundle, read_crate_index, get_local_path, \
+                          command_index_path, find_commands, write_spans, profile_report, \
+                          telemetry_log_path, read_telemetry, bulker_stats, crate_registry, \
+                          load_crate_registry, registry_update, bulker_registry_export, \
+                          bulker_registry_import, store_crates, match_crates, \
+                          trash_folder, bulker_gc, refresh_registry_index
+from bulker.runtime import fast_main, read_registry_index, warm_reaper
 import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from urllib.error import HTTPError
 
 DUMMY_CFG_FOLDER = "bulker_temp"
 DUMMY_CFG_FILEPATH = os.path.join(DUMMY_CFG_FOLDER, "tmp.yaml")
 DUMMY_CFG_TEMPLATES = os.path.join(DUMMY_CFG_FOLDER, "templates")
 DUMMY_CFG_CRATE_SUBDIR = "crates"
+EXAMPLE_MANIFESTS = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                                 "example_manifests")
+
+
+def make_local_config(tmp_path, registry_url=None, manifests=None):
+    """ Initialize a bulker config whose registry is a local folder """
+    registry = tmp_path / "registry"
+    (registry / "bulker").mkdir(parents=True, exist_ok=True)
+    manifests = manifests or {"demo": "demo_manifest.yaml", "alpine": "alpine.yaml",
+                              "import": "import.yaml", "import2": "import_level2.yaml"}
+    for name, filename in manifests.items():
+        shutil.copy(os.path.join(EXAMPLE_MANIFESTS, filename),
+                    registry / "bulker" / (name + ".yaml"))
+    cfg_path = str(tmp_path / "cfg" / "bulker_config.yaml")
+    bulker_init(cfg_path, DEFAULT_CONFIG_FILEPATH, "docker")
+    bulker_config = yacman.YAMLConfigManager.from_yaml_file(cfg_path)
+    bulker_config["bulker"]["default_crate_folder"] = str(tmp_path / "crates")
+    bulker_config["bulker"]["registry_url"] = registry_url or str(registry) + "/"
+    return bulker_config
+
+
+def write_manifest(folder, name, commands=(), imports=()):
+    """ Write a manifest with one docker command per given command name """
+    manifest = {"manifest": {
+        "name": name,
+        "imports": list(imports),
+        "commands": [{"command": cmd, "docker_image": "nsheff/" + cmd}
+                     for cmd in commands]}}
+    yacman.YAMLConfigManager.from_obj(manifest).write_copy(
+        str(folder / "bulker" / (name + ".yaml")))
+
+
+@pytest.fixture
+def registry_server(tmp_path):
+    """ Serve a local folder over HTTP, recording each request's status """
+    served = tmp_path / "served"
+    (served / "bulker").mkdir(parents=True)
+    requests = []
+
+    class Handler(SimpleHTTPRequestHandler):
+        def log_request(self, code="-", size="-"):
+            requests.append((self.path, int(code)))
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(Handler, directory=str(served)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{}/".format(server.server_address[1]), served, requests
+    server.shutdown()
+    server.server_close()
 
 def test_yacman():
 
@@ -136,6 +207,928 @@ def test_nonconfig_load():
 
 
 
+def test_build_images_dedup(tmp_path):
+    import jinja2
+    log = tmp_path / "built.txt"
+    build_template = jinja2.Template(
+        "echo {{ pkg.docker_image }} >> " + str(log) + "\n"
+        "{% if 'bogus' in pkg.docker_image %}exit 1{% endif %}")
+    pkgs = [{"docker_image": img, "container_engine": "docker"}
+            for img in ["alpine", "alpine", "ubuntu", "bogus/image", "ubuntu"]]
+    failed = build_images(build_template, pkgs, jobs=3)
+    assert failed == ["bogus/image"]
+    assert sorted(log.read_text().split()) == ["alpine", "bogus/image", "ubuntu"]
+
+
+def test_manifest_cache_revalidation(tmp_path, registry_server, monkeypatch):
+    url, served, requests = registry_server
+    shutil.copy(os.path.join(EXAMPLE_MANIFESTS, "demo_manifest.yaml"),
+                served / "bulker" / "demo.yaml")
+    bulker_config = make_local_config(tmp_path, registry_url=url)
+
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/demo")
+    assert manifest["manifest"]["name"] == "demo"
+    assert requests == [("/bulker/demo.yaml", 200)]
+
+    # Second fetch revalidates with a conditional request
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/demo")
+    assert manifest["manifest"]["name"] == "demo"
+    assert requests[-1] == ("/bulker/demo.yaml", 304)
+
+    # Within the TTL, or offline, the network isn't touched at all
+    bulker_config["bulker"]["manifest_cache_ttl"] = 3600
+    load_remote_registry_path(bulker_config, "bulker/demo")
+    load_remote_registry_path(bulker_config, "bulker/demo", offline=True)
+    assert len(requests) == 2
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/pi", offline=True)
+    assert manifest is None
+
+    entries = read_manifest_cache(manifest_cache_folder(bulker_config))
+    assert [e["registry_path"] for e in entries] == ["bulker/demo"]
+    bulker_cache(bulker_config, "prune", older_than=1)
+    assert len(read_manifest_cache(manifest_cache_folder(bulker_config))) == 1
+
+    # A server error falls back to the cached copy; a missing manifest doesn't
+    bulker_config["bulker"]["manifest_cache_ttl"] = 0
+    for code, name in [(503, "demo"), (404, None)]:
+        def fail(request, code=code):
+            raise HTTPError(request.full_url, code, "error", {}, None)
+        monkeypatch.setattr("urllib.request.urlopen", fail)
+        manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/demo")
+        assert (manifest["manifest"]["name"] if manifest else None) == name
+    monkeypatch.undo()
+
+    bulker_cache(bulker_config, "clear")
+    assert read_manifest_cache(manifest_cache_folder(bulker_config)) == []
+
+    # The built-in config has no cache beside the package, however it's named
+    monkeypatch.setattr("bulker.bulker.DEFAULT_CONFIG_FILEPATH",
+                        os.path.relpath(DEFAULT_CONFIG_FILEPATH))
+    default = yacman.YAMLConfigManager.from_yaml_file(DEFAULT_CONFIG_FILEPATH)
+    assert manifest_cache_folder(default) is None
+
+
+def test_import_graph_fetches_once(tmp_path, registry_server):
+    url, served, requests = registry_server
+    write_manifest(served, "base", ["cowsay"])
+    write_manifest(served, "mid", ["fortune"], imports=["bulker/base"])
+    write_manifest(served, "top", ["pi"], imports=["bulker/mid", "bulker/base"])
+    bulker_config = make_local_config(tmp_path, registry_url=url)
+    bulker_config["bulker"]["manifest_cache_ttl"] = 3600
+    exe_template, shell_template, _ = load_templates(bulker_config)
+
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/top")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template,
+                force=True, recurse=True)
+    assert sorted(path for path, code in requests) == \
+        ["/bulker/base.yaml", "/bulker/mid.yaml", "/bulker/top.yaml"]
+    top = os.path.join(str(tmp_path / "crates"), "bulker", "top", "default")
+    assert {"pi", "fortune", "cowsay"} <= set(os.listdir(top))
+
+    graph = ImportGraph(bulker_config)
+    graph.add("bulker/top")
+    assert graph.order() == ["bulker/base:default", "bulker/mid:default", "bulker/top:default"]
+    bulker_reload(bulker_config)
+
+
+def test_import_cycle_detected(tmp_path):
+    bulker_config = make_local_config(tmp_path, manifests={})
+    registry = tmp_path / "registry"
+    write_manifest(registry, "ying", ["cowsay"], imports=["bulker/yang"])
+    write_manifest(registry, "yang", ["fortune"], imports=["bulker/ying"])
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/ying")
+    with pytest.raises(ImportCycleError):
+        bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template,
+                    force=True)
+    assert not bulker_config["bulker"]["crates"]
+
+
+def test_reload_isolates_failures(tmp_path):
+    bulker_config = make_local_config(tmp_path)
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/import")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template, force=True)
+    bulker_config["bulker"]["crates"]["bulker"]["bogus"] = {"default": str(tmp_path / "bogus")}
+    os.remove(str(tmp_path / "registry" / "bulker" / "alpine.yaml"))
+
+    results = bulker_reload(bulker_config, jobs=4)
+    assert results["bulker/demo:default"][0] == "ok"
+    assert results["bulker/alpine:default"][0] == "failed"
+    assert results["bulker/bogus:default"][0] == "failed"
+    assert results["bulker/import:default"][0] == "skipped"
+    assert list(results).index("bulker/demo:default") < list(results).index("bulker/import:default")
+
+
+def test_incremental_reload(tmp_path, caplog):
+    bulker_config = make_local_config(tmp_path, manifests={})
+    registry = tmp_path / "registry"
+    write_manifest(registry, "tools", ["cowsay", "fortune", "pi"])
+    exe_template, shell_template, _ = load_templates(bulker_config)
+
+    def load():
+        manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/tools")
+        caplog.clear()
+        with caplog.at_level("INFO"):
+            bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template,
+                        force=True)
+        return [r.message for r in caplog.records if r.message.startswith("Crate files")]
+
+    assert load() == ["Crate files: 0 unchanged, 6 updated, 0 removed."]
+    crate = os.path.join(str(tmp_path / "crates"), "bulker", "tools", "default")
+    inode = os.stat(os.path.join(crate, "cowsay")).st_ino
+    assert load() == ["Crate files: 6 unchanged, 0 updated, 0 removed."]
+
+    write_manifest(registry, "tools", ["cowsay", "fortune"])
+    manifest = yacman.YAMLConfigManager.from_yaml_file(str(registry / "bulker" / "tools.yaml"))
+    manifest["manifest"]["commands"][1]["docker_image"] = "nsheff/fortune:2.0"
+    manifest.write_copy(str(registry / "bulker" / "tools.yaml"))
+    assert load() == ["Crate files: 2 unchanged, 2 updated, 2 removed."]
+    assert os.stat(os.path.join(crate, "cowsay")).st_ino == inode
+    assert sorted(os.listdir(crate)) == [".bulker_crate.json", "_cowsay", "_fortune",
+                                         "cowsay", "fortune"]
+
+
+def test_crate_swap_is_atomic(tmp_path):
+    import jinja2
+    bulker_config = make_local_config(tmp_path, manifests={})
+    registry = tmp_path / "registry"
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    crate = os.path.join(str(tmp_path / "crates"), "bulker", "tools", "default")
+
+    for commands in [["cowsay"], ["cowsay", "fortune"], ["fortune"]]:
+        write_manifest(registry, "tools", commands)
+        manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/tools")
+        bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template,
+                    force=True)
+    assert os.path.islink(crate)
+    assert len(crate_generations(crate)) == 2
+    assert sorted(os.listdir(crate))[1:] == ["_fortune", "fortune"]
+    # Other dot folders beside the crate aren't generations
+    os.mkdir(os.path.join(os.path.dirname(crate), ".default.backup"))
+    assert len(crate_generations(crate)) == 2
+
+    # A failed build leaves the live crate untouched
+    write_manifest(registry, "tools", ["fortune", "boom"])
+    broken = jinja2.Template("{% if pkg.command == 'boom' %}{{ pkg.boom() }}{% endif %}")
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/tools")
+    with pytest.raises(Exception):
+        bulker_load(manifest, cratevars, bulker_config, broken, shell_template, force=True)
+    assert sorted(os.listdir(crate))[1:] == ["_fortune", "fortune"]
+    assert len(crate_generations(crate)) == 2
+
+    bulker_unload(bulker_config, "bulker/tools")
+    assert not os.path.lexists(crate)
+    assert crate_generations(crate) == []
+
+
+def test_linked_imports(tmp_path):
+    bulker_config = make_local_config(tmp_path, manifests={})
+    registry = tmp_path / "registry"
+    write_manifest(registry, "base", ["cowsay", "fortune"])
+    write_manifest(registry, "top", ["fortune"], imports=["bulker/base"])
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    crates = os.path.join(str(tmp_path / "crates"), "bulker")
+
+    def load(name):
+        manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/" + name)
+        bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template,
+                    force=True)
+
+    load("top")
+    top = os.path.join(crates, "top", "default")
+    assert os.readlink(os.path.join(top, "cowsay")) == \
+        os.path.join(crates, "base", "default", "cowsay")
+    assert not os.path.islink(os.path.join(top, "fortune"))  # local command wins
+
+    # Re-importing the base crate updates the crate that imports it
+    write_manifest(registry, "base", ["cowsay", "fortune", "pi"])
+    load("base")
+    assert os.path.islink(os.path.join(top, "pi"))
+
+    bulker_config["bulker"]["import_mode"] = "copy"
+    load("top")
+    assert not os.path.islink(os.path.join(top, "pi"))
+    assert os.path.isfile(os.path.join(top, "pi"))
+
+
+def test_registry_index_fast_path(tmp_path, capsys):
+    bulker_config = make_local_config(tmp_path)
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/demo")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    index = read_registry_index(bulker_config.filepath)
+    assert index["crates"]["bulker/demo:default"] == \
+        os.path.join(str(tmp_path / "crates"), "bulker", "demo", "default")
+
+    # The fast path echoes exactly what the full activate does
+    bulker_activate(bulker_config, parse_registry_paths("demo"), echo=True)
+    expected = capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        fast_main(["activate", "-e", "-c", bulker_config.filepath, "demo"])
+    assert capsys.readouterr().out == expected
+
+    # Unknown crates, unusual arguments and stale indexes fall through
+    assert fast_main(["activate", "-e", "-c", bulker_config.filepath, "nope"]) is None
+    assert fast_main(["activate", "-se", "-c", bulker_config.filepath, "demo"]) is None
+    os.utime(bulker_config.filepath, ns=(0, 0))
+    assert read_registry_index(bulker_config.filepath) is None
+    assert fast_main(["activate", "-e", "-c", bulker_config.filepath, "demo"]) is None
+
+    # A refresh from a config read before a write stays stale, not current
+    config_mtime = os.stat(bulker_config.filepath).st_mtime_ns
+    os.utime(bulker_config.filepath, ns=(config_mtime + 10**9, config_mtime + 10**9))
+    refresh_registry_index(bulker_config, config_mtime)
+    assert read_registry_index(bulker_config.filepath) is None
+    refresh_registry_index(bulker_config, config_mtime + 10**9)
+    assert read_registry_index(bulker_config.filepath)["crates"] == index["crates"]
+
+
+def test_run_execs_command(tmp_path):
+    bulker_config = make_local_config(tmp_path)
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/demo")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    cli = [sys.executable, "-c", "from bulker.runtime import main; main()"]
+    script = 'echo "[$1]" $$; exit 3'
+
+    for env in [{}, {"BULKER_NO_FASTPATH": "1"}]:
+        proc = subprocess.Popen(
+            cli + ["run", "-c", bulker_config.filepath, "demo", "sh", "-c", script,
+                   "_", "a  b"], stdout=subprocess.PIPE, universal_newlines=True,
+            env=dict(os.environ, **env))
+        out, _ = proc.communicate()
+        # Arguments pass through unmangled, and the command replaced bulker
+        assert out.split() == ["[a", "b]", str(proc.pid)] and "[a  b]" in out
+        assert proc.returncode == 3
+
+    # A single quoted argument still runs as a shell command line
+    out = subprocess.check_output(
+        cli + ["run", "-c", bulker_config.filepath, "demo", "echo one | tr o 0"],
+        universal_newlines=True)
+    assert out == "0ne\n"
+
+    # With no command, both paths fail with a usage error
+    for env in [{}, {"BULKER_NO_FASTPATH": "1"}]:
+        proc = subprocess.run(cli + ["run", "-c", bulker_config.filepath, "demo"],
+                              stderr=subprocess.PIPE, universal_newlines=True,
+                              env=dict(os.environ, **env))
+        assert proc.returncode == 2 and "No command to run" in proc.stderr
+
+
+FAKE_DOCKER = """#!/bin/sh
+echo "$@" >> "$DOCKER_LOG"
+case "$1" in
+  run) [ "$2" = "--detach" ] && { [ -n "$DOCKER_NO_WARM" ] && exit 1; echo warm-container; } ;;
+  ps) echo warm-container ;;
+  top) printf "PID\\n1\\n2\\n" ;;
+esac
+exit 0
+"""
+
+
+def test_warm_mode(tmp_path, monkeypatch):
+    bulker_config = make_local_config(tmp_path, manifests={})
+    write_manifest(tmp_path / "registry", "warm", ["cowsay", "fortune"])
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/warm")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    crate = os.path.join(str(tmp_path / "crates"), "bulker", "warm", "default")
+
+    bin_folder = tmp_path / "bin"
+    bin_folder.mkdir()
+    (bin_folder / "docker").write_text(FAKE_DOCKER)
+    os.chmod(str(bin_folder / "docker"), 0o755)
+    log = tmp_path / "docker.log"
+    warm_dir = tmp_path / "warm"
+    warm_dir.mkdir()
+    monkeypatch.setenv("PATH", str(bin_folder) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("DOCKER_LOG", str(log))
+
+    def calls():
+        return [line.split()[0] for line in log.read_text().splitlines()]
+
+    # Without a warm session, every call is a plain docker run
+    subprocess.check_call([os.path.join(crate, "cowsay")])
+    assert calls() == ["run"]
+
+    # In a session, the first call starts the container and calls exec into it
+    monkeypatch.setenv("BULKERWARMDIR", str(warm_dir))
+    for cmd in ["cowsay", "cowsay", "fortune"]:
+        subprocess.check_call([os.path.join(crate, cmd), "moo"])
+    assert calls() == ["run", "run", "exec", "exec", "run", "exec"]
+    assert log.read_text().splitlines()[2].endswith("warm-container cowsay moo")
+
+    # Idle containers are stopped, and everything goes when the owner exits
+    owner = subprocess.Popen(["sleep", "30"])
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    # Locks are cleared once the wrapper holding them is gone
+    for name, pid in [("dead", dead.pid), ("live", owner.pid)]:
+        lock = warm_dir / (name + ".lock")
+        lock.mkdir()
+        (lock / "pid").write_text("{}\n".format(pid))
+        os.utime(str(lock), (time.time() - 10, time.time() - 10))
+    reaper = threading.Thread(target=warm_reaper,
+                              args=(str(warm_dir), owner.pid, 0, 0.05))
+    reaper.start()
+    time.sleep(0.5)
+    assert sorted(os.listdir(str(warm_dir))) == ["live.lock"]
+    owner.kill()
+    owner.wait()
+    reaper.join(timeout=10)
+    assert not reaper.is_alive() and not warm_dir.exists()
+    assert calls()[6:] == ["top", "rm", "top", "rm", "ps", "rm"]
+
+    # A container that won't start is tried once per session, then run cold
+    warm_dir.mkdir()
+    monkeypatch.setenv("DOCKER_NO_WARM", "1")
+    for _ in range(2):
+        subprocess.check_call([os.path.join(crate, "cowsay")])
+    assert calls()[12:] == ["run", "run", "run"]
+    assert [name.endswith(".failed") for name in os.listdir(str(warm_dir))] == [True]
+
+
+def test_singularity_pulls_are_shared(tmp_path, monkeypatch):
+    bulker_config = make_local_config(tmp_path, manifests={})
+    write_manifest(tmp_path / "registry", "base", ["cowsay"])
+    write_manifest(tmp_path / "registry", "top", ["fortune", "pi"], imports=["bulker/base"])
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/top")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template,
+                recurse=True)
+
+    bin_folder = tmp_path / "bin"
+    bin_folder.mkdir()
+    (bin_folder / "singularity").write_text(
+        '#!/bin/sh\necho "$@" >> "$PULL_LOG"\nsleep 0.3\necho sif > "$2"\n')
+    os.chmod(str(bin_folder / "singularity"), 0o755)
+    log = tmp_path / "pull.log"
+    monkeypatch.setenv("PATH", str(bin_folder) + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("PULL_LOG", str(log))
+    monkeypatch.setattr("bulker.bulker.docker_image_digest", lambda image: None)
+
+    # Many simultaneous callers share a single pull
+    image_path = str(tmp_path / "simages" / "nsheff" / "cowsay")
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(
+            lambda _: pull_singularity_image("nsheff/cowsay", image_path), range(8)))
+    assert all(results) and len(log.read_text().splitlines()) == 1
+    assert sorted(os.listdir(os.path.dirname(image_path))) == ["cowsay", "cowsay.lock"]
+
+    # The wrappers' 'images pull --path' doesn't need to read any config
+    cli = [sys.executable, "-c", "from bulker.runtime import main; main()"]
+    subprocess.check_call(cli + ["images", "pull", "nsheff/cowsay", "--path",
+                                 str(tmp_path / "pulled"), "-c",
+                                 str(tmp_path / "no_such_config.yaml")])
+    assert (tmp_path / "pulled").read_text() == "sif\n"
+
+    # Prefetching covers imported crates, and skips images already present
+    bulker_config["bulker"]["container_engine"] = "singularity"
+    bulker_config["bulker"]["singularity_image_folder"] = str(tmp_path / "simages")
+    assert bulker_images_prefetch(bulker_config, parse_registry_paths("top")) == []
+    pulled = sorted(line.split()[-1] for line in log.read_text().splitlines())
+    assert pulled == ["docker://nsheff/cowsay", "docker://nsheff/fortune",
+                      "docker://nsheff/pi"]
+
+
+def test_image_store_gc(tmp_path, monkeypatch):
+    bulker_config = make_local_config(tmp_path, manifests={})
+    bulker_config["bulker"]["container_engine"] = "singularity"
+    bulker_config["bulker"]["singularity_image_folder"] = str(tmp_path / "simages")
+    registry = tmp_path / "registry"
+    write_manifest(registry, "one", ["cowsay", "fortune"])
+    write_manifest(registry, "two", ["cowsay"])
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    for name in ["one", "two"]:
+        manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/" + name)
+        bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+
+    bin_folder = tmp_path / "bin"
+    bin_folder.mkdir()
+    (bin_folder / "singularity").write_text('#!/bin/sh\necho "sif of $3" > "$2"\n')
+    os.chmod(str(bin_folder / "singularity"), 0o755)
+    monkeypatch.setenv("PATH", str(bin_folder) + os.pathsep + os.environ["PATH"])
+    digests = {"nsheff/cowsay": "sha256:aaa", "nsheff/cowsay:1.0": "sha256:aaa",
+               "nsheff/fortune": "sha256:bbb", "nsheff/pi": None}
+    monkeypatch.setattr("bulker.bulker.docker_image_digest", digests.get)
+    simages = tmp_path / "simages"
+
+    # Names link into the store, and tags of the same image share one copy
+    for image in digests:
+        assert pull_singularity_image(image, singularity_image_path(bulker_config, image))
+    assert os.readlink(str(simages / "nsheff" / "cowsay:1.0")) == \
+        os.path.join("..", ".store", "sha256", "aaa")
+    stored = sorted(os.listdir(str(simages / ".store" / "sha256")))
+    assert len(stored) == 3 and "aaa" in stored and "bbb" in stored
+    # Pulled by the digest it's stored under, not by a tag that may move
+    assert (simages / ".store" / "sha256" / "aaa").read_text() == \
+        "sif of docker://nsheff/cowsay@sha256:aaa\n"
+
+    # Only images used by a loaded crate survive; crate 'one' still uses both
+    bulker_unload(bulker_config, "bulker/two")
+    assert bulker_images_gc(bulker_config, dry_run=True)[0] == 1
+    assert bulker_images_gc(bulker_config) == (1, len("sif of docker://nsheff/pi\n"))
+    assert sorted(name for name in os.listdir(str(simages / "nsheff"))
+                  if not name.endswith(".lock")) == ["cowsay", "fortune"]
+    bulker_unload(bulker_config, "bulker/one")
+    bulker_images_gc(bulker_config)
+    assert sorted(os.listdir(str(simages / "nsheff"))) == \
+        ["cowsay.lock", "cowsay:1.0.lock", "fortune.lock", "pi.lock"]
+    assert os.listdir(str(simages / ".store" / "sha256")) == []
+
+
+def test_image_gc_shared_folder(tmp_path):
+    registry = tmp_path / "registry"
+    (registry / "bulker").mkdir(parents=True)
+    configs = {}
+    for name in ["one", "two"]:
+        bulker_config = make_local_config(tmp_path / name, manifests={})
+        bulker_config["bulker"]["container_engine"] = "singularity"
+        bulker_config["bulker"]["singularity_image_folder"] = str(tmp_path / "simages")
+        bulker_config["bulker"]["registry_url"] = str(registry) + "/"
+        configs[name] = bulker_config
+    write_manifest(registry, "one", ["cowsay"])
+    write_manifest(registry, "two", ["fortune"])
+    for name, bulker_config in configs.items():
+        exe_template, shell_template, _ = load_templates(bulker_config)
+        manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/" + name)
+        bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    simages = tmp_path / "simages" / "nsheff"
+    simages.mkdir(parents=True, exist_ok=True)
+    for image in ["cowsay", "fortune", "pi"]:
+        (simages / image).write_text("sif\n")
+
+    # Images loaded by another config using the folder are kept
+    bulker_images_gc(configs["one"])
+    assert sorted(os.listdir(str(simages))) == ["cowsay", "fortune"]
+
+    docker_config = make_local_config(tmp_path / "docker", manifests={})
+    with pytest.raises(BulkerError):
+        bulker_images_gc(docker_config)
+
+
+def test_templates_compiled_once(tmp_path, monkeypatch):
+    bulker_config = make_local_config(tmp_path)
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    assert load_templates(bulker_config)[:2] == (exe_template, shell_template)
+    cache = tmp_path / "cfg" / "template_cache"
+    assert len(os.listdir(str(cache))) == 2  # compiled bytecode, for later runs
+
+    # Editing a template recompiles it and changes the hash crates record
+    template_path = os.path.join(str(tmp_path / "cfg"),
+                                 bulker_config["bulker"]["executable_template"])
+    with open(template_path, "a") as f:
+        f.write("# edited\n")
+    os.utime(template_path, (time.time() + 5, time.time() + 5))
+    edited = load_templates(bulker_config)[0]
+    assert edited is not exe_template and edited.bulker_hash != exe_template.bulker_hash
+    assert edited.render(pkg={"docker_image": "x"}).endswith("# edited")
+
+    # Nothing is compiled beside the package for the built-in config
+    monkeypatch.setattr("bulker.bulker.DEFAULT_CONFIG_FILEPATH",
+                        os.path.relpath(DEFAULT_CONFIG_FILEPATH))
+    default = yacman.YAMLConfigManager.from_yaml_file(DEFAULT_CONFIG_FILEPATH)
+    assert template_cache_folder(default) is None
+
+
+def test_render_context_scales(tmp_path):
+    bulker_config = make_local_config(tmp_path)
+    bulker_config["bulker"]["crates"] = {"bulker": {
+        "crate{}".format(i): {"default": "/x/{}".format(i)} for i in range(200)}}
+    commands = [{"command": "cmd{}".format(i), "docker_image": "ns/img{}:1".format(i % 50)}
+                for i in range(500)]
+    manifest = yacman.YAMLConfigManager.from_obj(
+        {"manifest": {"name": "big", "commands": commands}})
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    start = time.perf_counter()
+    bulker_load(manifest, {"namespace": "bulker", "crate": "big", "tag": "default"},
+                bulker_config, exe_template, shell_template, write_config=False)
+    elapsed = time.perf_counter() - start
+    crate_path = bulker_config["bulker"]["crates"]["bulker"]["big"]["default"]
+    assert len([f for f in os.listdir(crate_path) if f.startswith("cmd")]) == 500
+    # The manifest's command entries are left as they were, config not merged in
+    assert sorted(manifest["manifest"]["commands"][0].keys()) == ["command", "docker_image"]
+    assert elapsed < 10
+
+
+def test_tool_args_index(tmp_path, capsys):
+    bulker_config = make_local_config(tmp_path)
+    bulker_config["bulker"]["tool_args"] = {
+        "nsheff": {
+            "cowsay": {"default": {"docker_args": "-v /cow:/cow"},
+                       "dev": {"docker_args": "-v /dev_cow:/cow"}},
+            "fort*": {"default": {"docker_args": "-v /fortune:/f",
+                                  "exclude_volumes": ["/tmp"]},
+                      "2.*": {"docker_args": "-v /fortune2:/f"}}},
+        "*": {"*": {"default": {"docker_args": "--cpus=1"}}}}
+    tool_args = ToolArgs(bulker_config)
+    assert tool_args.get("nsheff/cowsay", "docker_args") == "-v /cow:/cow"
+    assert tool_args.get("nsheff/cowsay:dev", "docker_args") == "-v /dev_cow:/cow"
+    assert tool_args.get("nsheff/fortune:2.1", "docker_args") == "-v /fortune2:/f"
+    assert tool_args.get("nsheff/fortune:2.1", "exclude_volumes") == ["/tmp"]
+    assert tool_args.get("ubuntu", "docker_args") == "--cpus=1"
+    assert tool_args.get("nsheff/cowsay", "exclude_volumes") == ""
+
+    manifest = yacman.YAMLConfigManager.from_obj({"manifest": {"name": "demo", "commands": [
+        {"command": "cowsay", "docker_image": "nsheff/cowsay"},
+        {"command": "fortune", "docker_image": "nsheff/fortune"}]}})
+    bulker_inspect_args(bulker_config, manifest)
+    out = capsys.readouterr().out.splitlines()
+    assert out[1].split() == ["cowsay", "nsheff/cowsay", "-v", "/cow:/cow", "-"]
+    assert out[2].split() == ["fortune", "nsheff/fortune", "-v", "/fortune:/f", "/tmp"]
+
+
+def test_load_batch(tmp_path, monkeypatch):
+    bulker_config = make_local_config(tmp_path)
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/alpine")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    writes = []
+    monkeypatch.setattr(bulker_config, "write", lambda *a, **k: writes.append(1))
+
+    crate_list = tmp_path / "crates.txt"
+    crate_list.write_text("# node setup\nbulker/import\n\nbulker/demo  # again\n")
+    results = bulker_load_batch(bulker_config, read_crate_list(str(crate_list)))
+    # bulker/demo is both listed and imported, and is loaded once; the
+    # already-loaded import bulker/alpine isn't reloaded
+    assert list(results) == ["bulker/demo:default", "bulker/import:default"]
+    assert all(status == "ok" for status, _, _ in results.values())
+    assert len(writes) == 1
+    crates = bulker_config["bulker"]["crates"]["bulker"]
+    assert sorted(crates) == ["alpine", "demo", "import"]
+    assert os.path.islink(os.path.join(crates["import"]["default"], "samtools"))
+
+
+def test_load_batch_failure_not_registered(tmp_path):
+    bulker_config = make_local_config(tmp_path)
+    write_manifest(tmp_path / "registry", "empty")
+    results = bulker_load_batch(bulker_config, ["bulker/demo", "bulker/empty"], force=True)
+    assert results["bulker/demo:default"][0] == "ok"
+    assert results["bulker/empty:default"][0] != "ok"
+    for cfg in [bulker_config,
+                yacman.YAMLConfigManager.from_yaml_file(bulker_config.filepath)]:
+        assert list(cfg["bulker"]["crates"]["bulker"]) == ["demo"]
+    assert "bulker/empty:default" not in read_registry_index(bulker_config.filepath)["crates"]
+
+
+def test_freeze_and_restore(tmp_path, monkeypatch):
+    monkeypatch.setattr("bulker.bulker.docker_image_digest", lambda image, timeout=10:
+                        "sha256:" + image.replace("/", "-").replace(":", "-"))
+    bulker_config = make_local_config(tmp_path)
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/import")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+
+    lockfile = str(tmp_path / "bulker.lock")
+    write_lockfile(bulker_freeze(bulker_config), lockfile)
+    # The registry changes, but a restore rebuilds what was frozen
+    shutil.rmtree(str(tmp_path / "registry"))
+    other = tmp_path / "node"
+    other.mkdir()
+    node_config = make_local_config(other, manifests={})
+    results = bulker_restore(node_config, lockfile)
+    assert list(results) == ["bulker/alpine:default", "bulker/demo:default",
+                             "bulker/import:default"]
+    assert all(status == "ok" for status, _, _ in results.values())
+    old = bulker_config["bulker"]["crates"]["bulker"]["demo"]["default"]
+    new = node_config["bulker"]["crates"]["bulker"]["demo"]["default"]
+    with open(os.path.join(old, "samtools")) as f1, open(os.path.join(new, "samtools")) as f2:
+        assert f1.read() == f2.read()
+    lock = read_lockfile(lockfile)
+    assert list(lock) == list(results)
+
+    # Prefetching pulls the frozen digests, not whatever the tags point to now
+    bin_folder = tmp_path / "bin"
+    bin_folder.mkdir()
+    (bin_folder / "singularity").write_text(
+        '#!/bin/sh\necho "$3" >> "{}"\necho sif > "$2"\n'.format(tmp_path / "pulls"))
+    os.chmod(str(bin_folder / "singularity"), 0o755)
+    monkeypatch.setenv("PATH", str(bin_folder) + os.pathsep + os.environ["PATH"])
+    node_config["bulker"]["container_engine"] = "singularity"
+    node_config["bulker"]["singularity_image_folder"] = str(other / "simages")
+    digests = lockfile_digests(lock)
+    assert digests and bulker_images_prefetch(
+        node_config, parse_registry_paths("import"), digests=digests) == []
+    pulled = (tmp_path / "pulls").read_text().split()
+    assert sorted(pulled) == sorted("docker://" + pinned_image(image, digest)
+                                    for image, digest in digests.items())
+    assert all("@sha256:" in ref for ref in pulled)
+
+
+def test_bundle_relocates_crates(tmp_path):
+    bulker_config = make_local_config(tmp_path)
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/import")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    bundle = str(tmp_path / "import.tar.gz")
+    bulker_bundle(bulker_config, [cratevars], bundle)
+
+    node = tmp_path / "node"
+    node.mkdir()
+    node_config = make_local_config(node, manifests={})
+    installed = bulker_load_bundle(node_config, bundle)
+    assert sorted(installed) == ["bulker/alpine:default", "bulker/demo:default",
+                                 "bulker/import:default"]
+    crates = node_config["bulker"]["crates"]["bulker"]
+    assert crates["import"]["default"] == str(node / "crates" / "bulker" / "import" / "default")
+    # Imported commands link to this machine's copy of the imported crate
+    link = os.readlink(os.path.join(crates["import"]["default"], "samtools"))
+    assert link == os.path.join(crates["demo"]["default"], "samtools")
+    assert os.access(os.path.join(crates["demo"]["default"], "samtools"), os.X_OK)
+    assert read_crate_index(crates["demo"]["default"])["manifest"]["manifest"]["name"]
+
+
+def test_bundle_rejects_escaping_members(tmp_path):
+    import io
+    import json
+    import tarfile
+    outside = tmp_path / "outside"
+    outside.mkdir()
+    node_config = make_local_config(tmp_path, manifests={})
+    other = tmp_path / "crates" / "bulker" / "other" / "default"
+    other.mkdir(parents=True)
+    meta = {"bulker_bundle": 1, "container_engine": "docker", "images": {},
+            "singularity_image_folder": None, "crates": {}}
+    for name in ["evil", "other"]:
+        meta["crates"]["bulker/{}:default".format(name)] = {
+            "path": "/old/crates/bulker/{}/default".format(name), "imports": [],
+            "folder": "crates/bulker/{}/default".format(name)}
+
+    def member(tar, name, link=None):
+        info = tarfile.TarInfo(name)
+        if link:
+            info.type, info.linkname = tarfile.SYMTYPE, link
+            tar.addfile(info)
+        else:
+            info.size = 4
+            tar.addfile(info, io.BytesIO(b"boom"))
+
+    # A link out of the crate and image folders, and a file written through
+    # a link into another crate
+    for members in [[("x", str(outside))],
+                    [("x", "/old/crates/bulker/other/default"), ("x/pwned", None)]]:
+        bundle = str(tmp_path / "evil.tar")
+        with tarfile.open(bundle, "w") as tar:
+            data = json.dumps(meta).encode("utf-8")
+            info = tarfile.TarInfo("bulker_bundle.json")
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+            for name, link in members:
+                member(tar, "crates/bulker/evil/default/" + name, link=link)
+        with pytest.raises(BulkerError):
+            bulker_load_bundle(node_config, bundle)
+    assert os.listdir(str(outside)) == [] and os.listdir(str(other)) == []
+    assert not node_config["bulker"]["crates"]
+
+
+def test_crate_stores(tmp_path):
+    (tmp_path / "site").mkdir()
+    (tmp_path / "user").mkdir()
+    site_config = make_local_config(tmp_path / "site")
+    exe_template, shell_template, _ = load_templates(site_config)
+    manifest, cratevars = load_remote_registry_path(site_config, "bulker/import")
+    bulker_load(manifest, cratevars, site_config, exe_template, shell_template)
+    site_crates = site_config["bulker"]["crates"]["bulker"]
+
+    user_config = make_local_config(tmp_path / "user")
+    user_config["bulker"]["crate_stores"] = [site_config.filepath]
+    exe_template, shell_template, _ = load_templates(user_config)
+    manifest, cratevars = load_remote_registry_path(user_config, "bulker/import")
+    bulker_load(manifest, cratevars, user_config, exe_template, shell_template)
+    # The site store already has identical crates, so nothing is built
+    assert not user_config["bulker"]["crates"]
+    assert not os.path.exists(str(tmp_path / "user" / "crates"))
+    assert get_local_path(user_config, cratevars) == site_crates["import"]["default"]
+    index = read_registry_index(user_config.filepath)
+    assert index["crates"]["bulker/demo:default"] == site_crates["demo"]["default"]
+
+    # With different settings, the user gets a crate of their own
+    user_config["bulker"]["volumes"].append("/scratch")
+    manifest, cratevars = load_remote_registry_path(user_config, "bulker/demo")
+    bulker_load(manifest, cratevars, user_config, exe_template, shell_template)
+    own = user_config["bulker"]["crates"]["bulker"]["demo"]["default"]
+    assert own.startswith(str(tmp_path / "user"))
+    assert get_local_path(user_config, cratevars) == own
+
+
+def test_which_and_search(tmp_path):
+    bulker_config = make_local_config(tmp_path)
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/import")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    assert os.path.isfile(command_index_path(bulker_config.filepath))
+
+    assert find_commands(bulker_config, "samtools", exact=True) == [
+        ("samtools", "bulker/demo:default", "quay.io/biocontainers/samtools:1.9--h91753b0_8", None),
+        ("samtools", "bulker/import:default", None, "bulker/demo:default")]
+    assert [f[:2] for f in find_commands(bulker_config, "Rscr*")] == [
+        ("Rscript", "bulker/demo:default"), ("Rscript", "bulker/import:default")]
+    assert ("ls", "bulker/alpine:default", None, None) in find_commands(bulker_config, "ls")
+
+    bulker_unload(bulker_config, "bulker/import")
+    assert [f[1] for f in find_commands(bulker_config, "samtools", exact=True)] == \
+        ["bulker/demo:default"]
+
+
+def test_profile_spans(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr("bulker.bulker._SPANS", [])
+    bulker_config = make_local_config(tmp_path)
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/demo")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    spans_file = str(tmp_path / "spans.jsonl")
+    write_spans(bulker.bulker._SPANS, spans_file)
+    with open(spans_file) as f:
+        spans = [json.loads(line) for line in f]
+    phases = {record["phase"] for record in spans}
+    assert {"template compile", "load", "render", "file write", "crate swap",
+            "config write"} <= phases
+    assert len([r for r in spans if r["phase"] == "render"]) == 12
+    assert all(r["seconds"] >= 0 for r in spans)
+
+    profile_report(spans, 1.0)
+    report = capsys.readouterr().err.splitlines()
+    assert report[0].split() == ["Phase", "Count", "Total", "Mean", "Max"]
+    assert [line.split()[1] for line in report if line.startswith("render ")] == ["12"]
+
+    # Commands that replace the bulker process still report
+    cli = [sys.executable, "-c", "from bulker.runtime import main; main()"]
+    proc = subprocess.run(cli + ["--profile", "run", "-c", bulker_config.filepath, "demo",
+                                 "true"], stderr=subprocess.PIPE, universal_newlines=True)
+    assert proc.returncode == 0 and "Wall time:" in proc.stderr
+
+
+def test_telemetry_stats(tmp_path, monkeypatch, capsys):
+    bulker_config = make_local_config(tmp_path)
+    bulker_config["bulker"]["telemetry"] = True
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/demo")
+    bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    crate = os.path.join(str(tmp_path / "crates"), "bulker", "demo", "default")
+    log = telemetry_log_path(bulker_config)
+    with open(os.path.join(crate, "samtools")) as f:
+        assert log in f.read()
+
+    # A stand-in docker records the call and passes on the exit status
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "docker").write_text("#!/bin/sh\nexit 3\n")
+    os.chmod(str(bin_dir / "docker"), 0o755)
+    monkeypatch.setenv("PATH", str(bin_dir) + os.pathsep + os.environ["PATH"])
+    assert subprocess.call([os.path.join(crate, "samtools")]) == 3
+    calls = read_telemetry(log)
+    assert [(c["command"], c["mode"], c["status"]) for c in calls] == [("samtools", "cold", 3)]
+
+    # Rotated lines are read too, and stamps without nanoseconds are seconds
+    with open(log + ".1", "w") as f:
+        f.write("100N\t102N\tfortune\tnsheff/fortune\tcold\t0\n")
+        f.write("200000000000\t200500000000\tfortune\tnsheff/fortune\tcold\t0\n")
+        f.write("300000000000\t300100000000\tfortune\tnsheff/fortune\twarm\t0\n")
+        f.write("truncated line\n")
+    rows = {row["command"]: row for row in bulker_stats(bulker_config)}
+    assert rows["fortune"]["calls"] == 3 and rows["fortune"]["warm"] == 1
+    assert rows["fortune"]["p50"] == pytest.approx(0.5)
+    assert rows["fortune"]["p95"] == pytest.approx(2.0)
+    # Startup is cold less warm time where both are known, else a bound
+    assert rows["fortune"]["startup"] == pytest.approx(0.4)
+    assert rows["fortune"]["overhead"] == pytest.approx(0.8)
+    assert not rows["fortune"]["startup_bound"] and rows["samtools"]["startup_bound"]
+    assert rows["samtools"]["failures"] == 1
+    lines = {line.split()[0]: line for line in capsys.readouterr().out.splitlines()}
+    assert " <" not in lines["fortune"] and " <" in lines["samtools"]
+
+    bulker_stats(bulker_config, clear=True)
+    assert read_telemetry(log) == []
+
+    # The built-in config never logs beside the package, however it's named
+    monkeypatch.setattr("bulker.bulker.DEFAULT_CONFIG_FILEPATH",
+                        os.path.relpath(DEFAULT_CONFIG_FILEPATH))
+    default = yacman.YAMLConfigManager.from_yaml_file(DEFAULT_CONFIG_FILEPATH)
+    assert telemetry_log_path(default) is None
+
+
+def test_sqlite_crate_registry(tmp_path, monkeypatch):
+    (tmp_path / "site").mkdir()
+    bulker_config = make_local_config(tmp_path / "site")
+    bulker_config["bulker"]["crate_registry"] = "crates.db"
+    with yacman.write_lock(bulker_config) as locked_cfg:
+        locked_cfg.write()
+    load_crate_registry(bulker_config)
+    config_mtime = os.stat(bulker_config.filepath).st_mtime_ns
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    for name in ["demo", "alpine"]:
+        manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/" + name)
+        bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+
+    # Loads commit to the database, not the YAML, and keep the index current
+    assert os.stat(bulker_config.filepath).st_mtime_ns == config_mtime
+    assert crate_registry(bulker_config).seeded()
+    fresh = yacman.YAMLConfigManager.from_yaml_file(bulker_config.filepath)
+    assert not fresh["bulker"]["crates"]
+    load_crate_registry(fresh)
+    assert sorted(fresh["bulker"]["crates"]["bulker"]) == ["alpine", "demo"]
+    assert sorted(read_registry_index(bulker_config.filepath)["crates"]) == \
+        ["bulker/alpine:default", "bulker/demo:default"]
+
+    # The folder goes to the trash within the transaction that unregisters it
+    trash_crate_folder = bulker.bulker.trash_crate_folder
+    in_transaction = []
+    monkeypatch.setattr("bulker.bulker.trash_crate_folder", lambda *args: (
+        in_transaction.append(crate_registry(bulker_config).db.in_transaction),
+        trash_crate_folder(*args)))
+    bulker_unload(bulker_config, ["bulker/alpine"])
+    assert in_transaction == [True]
+    assert list(crate_registry(bulker_config).crates()["bulker"]) == ["demo"]
+    assert "bulker/alpine:default" not in read_registry_index(bulker_config.filepath)["crates"]
+
+    # YAML export and import, into a config that keeps crates in its YAML
+    export = str(tmp_path / "crates.yaml")
+    bulker_registry_export(bulker_config, export)
+    (tmp_path / "other").mkdir()
+    other = make_local_config(tmp_path / "other")
+    with registry_update(other) as locked_cfg:
+        assert bulker_registry_import(locked_cfg, export) == 1
+    other = yacman.YAMLConfigManager.from_yaml_file(other.filepath)
+    assert other.to_dict()["bulker"]["crates"] == crate_registry(bulker_config).crates()
+
+    # Crate stores can be backed by a database too
+    (tmp_path / "user").mkdir()
+    user_config = make_local_config(tmp_path / "user")
+    user_config["bulker"]["crate_stores"] = [bulker_config.filepath]
+    assert list(store_crates(user_config)) == ["bulker/demo:default"]
+
+
+def test_seeded_registry_keeps_load_times(tmp_path):
+    bulker_config = make_local_config(tmp_path)
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    for name in ["demo", "alpine"]:
+        manifest, cratevars = load_remote_registry_path(bulker_config, "bulker/" + name)
+        bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    month_ago = time.time() - 30 * 86400
+    demo = os.path.join(str(tmp_path / "crates"), "bulker", "demo", "default")
+    os.utime(os.path.realpath(demo), (month_ago, month_ago))
+
+    # Crates moved into a new registry keep the age of their folders
+    bulker_config["bulker"]["crate_registry"] = "crates.db"
+    with yacman.write_lock(bulker_config) as locked_cfg:
+        locked_cfg.write()
+    load_crate_registry(bulker_config)
+    assert crate_registry(bulker_config).loaded_times() == {}
+    assert bulker_unload(bulker_config, "bulker/*", older_than=7) == ["bulker/demo:default"]
+
+
+def test_unload_patterns_trash_and_gc(tmp_path, monkeypatch):
+    bulker_config = make_local_config(tmp_path, manifests={
+        "demo": "demo_manifest.yaml", "demo_v2": "demo_manifest.yaml",
+        "alpine": "alpine.yaml", "import2": "import_level2.yaml"})
+    exe_template, shell_template, _ = load_templates(bulker_config)
+    for path in ["bulker/demo", "bulker/demo:v2", "bulker/alpine", "bulker/import2"]:
+        manifest, cratevars = load_remote_registry_path(bulker_config, path)
+        bulker_load(manifest, cratevars, bulker_config, exe_template, shell_template)
+    crates = str(tmp_path / "crates")
+    demo = os.path.join(crates, "bulker", "demo", "default")
+    assert [key for key, _, _ in match_crates(bulker_config, "bulker/demo*")] == \
+        ["bulker/demo:default", "bulker/demo:v2"]
+    assert [key for key, _, _ in match_crates(bulker_config, "demo")] == ["bulker/demo:default"]
+
+    # Only crates loaded long enough ago; demo looks a month old
+    month_ago = time.time() - 30 * 86400
+    os.utime(os.path.realpath(demo), (month_ago, month_ago))
+    assert bulker_unload(bulker_config, "bulker/*", older_than=7) == ["bulker/demo:default"]
+    assert not os.path.lexists(demo) and not crate_generations(demo)
+    assert len(os.listdir(trash_folder(bulker_config))) == 1
+
+    # The rest go in one registry update; their folders wait in the trash,
+    # moved there while the config is still locked
+    trash_crate_folder = bulker.bulker.trash_crate_folder
+    locked = []
+    monkeypatch.setattr("bulker.bulker.trash_crate_folder", lambda *args: (
+        locked.append(bulker_config.locker.locked[yacman.yacman.WRITE]),
+        trash_crate_folder(*args)))
+    assert bulker_unload(bulker_config, "bulker/demo:*,bulker/alpine") == \
+        ["bulker/alpine:default", "bulker/demo:v2"]
+    assert locked == [True, True]
+    saved = yacman.YAMLConfigManager.from_yaml_file(bulker_config.filepath)
+    assert list(saved["bulker"]["crates"]["bulker"]) == ["import2"]
+    assert bulker_gc(bulker_config, dry_run=True)[0] == 3
+
+    # Crates that can't be deleted aren't counted, and stay for the next gc
+    real_rmtree = shutil.rmtree
+    stuck = sorted(os.listdir(trash_folder(bulker_config)))[0]
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(shutil, "rmtree", lambda path, **kwargs: None
+                   if path.endswith(stuck) else real_rmtree(path, **kwargs))
+        assert bulker_gc(bulker_config)[0] == 2
+    assert os.listdir(trash_folder(bulker_config)) == [stuck]
+    removed, reclaimed = bulker_gc(bulker_config)
+    assert removed == 1 and reclaimed > 0
+    assert os.listdir(trash_folder(bulker_config)) == []
+    assert sorted(os.listdir(os.path.join(crates, "bulker"))) == [
+        "alpine", "demo", "import2"]
+    assert os.listdir(os.path.join(crates, "bulker", "demo")) == []
+
+
 # import inspect
 # inspect.getsourcelines(yacman.yaml.SafeLoader.construct_pairs)
 